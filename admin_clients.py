@@ -4,12 +4,13 @@ import html
 from fastapi import APIRouter, Depends, Query, HTTPException
 from fastapi.responses import HTMLResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, or_
+from sqlalchemy import select, func
 from sqlalchemy.orm import joinedload
 
-from models import Order, OrderStatusHistory, Employee
+from models import ClientStat, Order, OrderStatusHistory, Employee
 from templates import ADMIN_HTML_TEMPLATE, ADMIN_CLIENTS_LIST_BODY, ADMIN_CLIENT_DETAIL_BODY
 from dependencies import get_db_session, check_credentials
+from search_index import client_search_clause
 
 router = APIRouter()
 
@@ -24,57 +25,28 @@ async def admin_clients_list(
     per_page = 20
     offset = (page - 1) * per_page
 
-    # Підзапит для отримання останнього імені клієнта для кожного номера телефону
-    latest_name_subquery = (
-        select(
-            Order.phone_number,
-            Order.customer_name,
-            func.row_number().over(
-                partition_by=Order.phone_number,
-                order_by=Order.id.desc()
-            ).label("rn")
-        )
-        .where(Order.phone_number.isnot(None))
-        .subquery()
-    )
-
-    # Основний запит для агрегації даних про клієнтів
-    client_query = (
-        select(
-            Order.phone_number,
-            func.count(Order.id).label("order_count"),
-            func.sum(Order.total_price).label("total_spent"),
-            latest_name_subquery.c.customer_name.label("customer_name")
-        )
-        .join(latest_name_subquery, Order.phone_number == latest_name_subquery.c.phone_number)
-        .where(latest_name_subquery.c.rn == 1)
-        .group_by(Order.phone_number, latest_name_subquery.c.customer_name)
-        .order_by(func.count(Order.id).desc())
-    )
-
+    # Підсумки клієнтів ведуться в client_stats; сортування йде за індексом (order_count, phone_number)
+    client_query = select(ClientStat).order_by(ClientStat.order_count.desc(), ClientStat.phone_number.desc())
+    count_query = select(func.count()).select_from(ClientStat)
     if q:
-        client_query = client_query.where(
-            or_(
-                latest_name_subquery.c.customer_name.ilike(f"%{q}%"),
-                Order.phone_number.ilike(f"%{q}%")
-            )
-        )
+        client_query = client_query.where(client_search_clause(q))
+        count_query = count_query.where(client_search_clause(q))
 
-    total_res = await session.execute(select(func.count()).select_from(client_query.subquery()))
+    total_res = await session.execute(count_query)
     total = total_res.scalar_one()
     pages = (total // per_page) + (1 if total % per_page > 0 else 0)
 
     clients_res = await session.execute(client_query.limit(per_page).offset(offset))
-    clients = clients_res.mappings().all()
+    clients = clients_res.scalars().all()
 
     rows = "".join([f"""
     <tr>
-        <td><a href="/admin/client/{c['phone_number']}">{html.escape(c['customer_name'])}</a></td>
-        <td>{html.escape(c['phone_number'])}</td>
-        <td>{c['order_count']}</td>
-        <td>{c['total_spent']} грн</td>
+        <td><a href="/admin/client/{c.phone_number}">{html.escape(c.customer_name or '')}</a></td>
+        <td>{html.escape(c.phone_number)}</td>
+        <td>{c.order_count}</td>
+        <td>{c.total_spent} грн</td>
         <td class="actions">
-            <a href="/admin/client/{c['phone_number']}" class="button-sm">Дивитись</a>
+            <a href="/admin/client/{c.phone_number}" class="button-sm">Дивитись</a>
         </td>
     </tr>""" for c in clients])
 
@@ -100,6 +72,10 @@ async def admin_client_detail(
     username: str = Depends(check_credentials)
 ):
     """Відображає детальну інформацію про клієнта та його історію замовлень."""
+    client = await session.get(ClientStat, phone_number)
+    if not client:
+        raise HTTPException(status_code=404, detail="Клієнта з таким номером не знайдено")
+
     orders_res = await session.execute(
         select(Order)
         .where(Order.phone_number == phone_number)
@@ -113,17 +89,11 @@ async def admin_client_detail(
     
     orders = orders_res.unique().scalars().all()
 
-    if not orders:
-        raise HTTPException(status_code=404, detail="Клієнта з таким номером не знайдено")
-
-    # Деталі клієнта з останнього замовлення
-    latest_order = orders[0]
-    client_name = latest_order.customer_name
-    client_address = latest_order.address
-
-    # Загальна статистика
-    total_orders = len(orders)
-    total_spent = sum(o.total_price for o in orders)
+    # Ім'я та підсумки — з client_stats, адреса — з останнього замовлення
+    client_name = client.customer_name or ''
+    client_address = orders[0].address if orders else None
+    total_orders = client.order_count
+    total_spent = client.total_spent
 
     order_rows = []
     for o in orders:
@@ -0,0 +1,258 @@
+# admin_exports.py
+
+import asyncio
+import csv
+import decimal
+import io
+import logging
+import os
+import re
+import time
+import zipfile
+from datetime import date, datetime, timedelta
+from typing import Any, AsyncIterator, Callable, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+import sqlalchemy as sa
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import aliased
+
+from dependencies import check_credentials
+from models import ORDER_TYPE_LABELS, ClientStat, Employee, Order, async_session_maker
+from order_stats import courier_report_query
+from reference_data import get_completed_status_ids, get_statuses
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Скільки рядків за раз читається з курсора БД і записується у відповідь
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+# Скільки вивантажень можуть одночасно тримати з'єднання з БД (решта чекають черги)
+EXPORT_MAX_CONCURRENCY = int(os.getenv("EXPORT_MAX_CONCURRENCY", "2"))
+# Через скільки секунд вивантаження обривається, щоб повільний клієнт не тримав курсор і з'єднання
+EXPORT_TIMEOUT = int(os.getenv("EXPORT_TIMEOUT", "600"))
+
+EXPORT_FORMATS = ("csv", "xlsx")
+
+_export_semaphore = asyncio.Semaphore(max(EXPORT_MAX_CONCURRENCY, 1))
+# Текст, що починається з цих символів, Excel виконує як формулу
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+async def _stream_rows(query: sa.Select, convert: Callable[[Any], Sequence[Any]]) -> AsyncIterator[List[Sequence[Any]]]:
+    """
+    Читає результат запиту порціями по EXPORT_CHUNK_SIZE (серверний курсор там, де БД його підтримує).
+    Сесія відкривається тут, а не через Depends: відповідь пишеться вже після виходу з обробника.
+    Одночасно відкрито не більше EXPORT_MAX_CONCURRENCY курсорів, і кожен живе не довше EXPORT_TIMEOUT секунд.
+    """
+    async with _export_semaphore:
+        deadline = time.monotonic() + EXPORT_TIMEOUT
+        async with async_session_maker() as session:
+            result = await session.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+            async for partition in result.partitions():
+                if time.monotonic() > deadline:
+                    # Виняток обриває з'єднання, тож клієнт бачить незавершене завантаження, а не урізаний файл
+                    logger.warning(f"Вивантаження перервано: не завершилося за {EXPORT_TIMEOUT} с.")
+                    raise TimeoutError("Export timed out")
+                yield [convert(row) for row in partition]
+
+
+def _csv_safe(value: Any) -> Any:
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+async def _csv_stream(headers: Sequence[str], chunks: AsyncIterator[List[Sequence[Any]]]) -> AsyncIterator[bytes]:
+    # BOM і ';' — щоб Excel з українською локаллю відкрив файл без майстра імпорту
+    def encode(rows) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer, delimiter=';').writerows([_csv_safe(value) for value in row] for row in rows)
+        return buffer.getvalue().encode("utf-8")
+
+    yield "\ufeff".encode("utf-8") + encode([headers])
+    async for chunk in chunks:
+        yield encode(chunk)
+
+
+class _StreamBuffer:
+    """Файл лише для запису: zipfile пише сюди, а генератор забирає готові байти у відповідь."""
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+_XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# Керівні символи заборонені в XML
+_XML_ILLEGAL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xlsx_row(values: Sequence[Any]) -> str:
+    cells = []
+    for value in values:
+        if value is None or value == "":
+            cells.append("<c/>")
+        elif isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool):
+            cells.append(f"<c><v>{value}</v></c>")
+        else:
+            text = escape(_XML_ILLEGAL.sub("", str(value)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return f"<row>{''.join(cells)}</row>"
+
+
+async def _xlsx_stream(headers: Sequence[str], chunks: AsyncIterator[List[Sequence[Any]]], sheet_name: str) -> AsyncIterator[bytes]:
+    """
+    XLSX з одним аркушем, що пишеться рядок за рядком прямо в ZIP-потік (рядки як inline-рядки,
+    без спільної таблиці рядків), тому в пам'яті одночасно лише одна порція.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+        ))
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + _xlsx_row(headers)
+            ).encode("utf-8"))
+            async for chunk in chunks:
+                sheet.write("".join(_xlsx_row(row) for row in chunk).encode("utf-8"))
+                yield buffer.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield buffer.drain()
+
+
+def _export_response(filename: str, export_format: str, headers: Sequence[str], chunks: AsyncIterator[List[Sequence[Any]]],
+                     sheet_name: str) -> StreamingResponse:
+    if export_format == "xlsx":
+        content = _xlsx_stream(headers, chunks, sheet_name)
+        media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    else:
+        content = _csv_stream(headers, chunks)
+        media_type = "text/csv; charset=utf-8"
+    return StreamingResponse(content, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'})
+
+
+def _parse_format(export_format: str) -> str:
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Підтримуються формати csv та xlsx")
+    return export_format
+
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Дата має бути у форматі РРРР-ММ-ДД")
+
+
+def _format_dt(value: Optional[datetime]) -> str:
+    return value.strftime("%d.%m.%Y %H:%M") if value else ""
+
+
+@router.get("/admin/export/orders")
+async def export_orders(
+    export_format: str = Query("csv", alias="format"),
+    date_from_str: str = Query(None, alias="date_from"),
+    date_to_str: str = Query(None, alias="date_to"),
+    username: str = Depends(check_credentials)
+):
+    """Усі замовлення за період (за датою створення; без дат — усі)."""
+    export_format = _parse_format(export_format)
+    date_from, date_to = _parse_date(date_from_str), _parse_date(date_to_str)
+    status_names = {s.id: s.name for s in await get_statuses()}
+
+    courier = aliased(Employee)
+    query = (
+        sa.select(Order.id, Order.created_at, Order.customer_name, Order.phone_number, Order.address, Order.order_type,
+                  Order.status_id, Order.total_price, Order.products, courier.full_name.label("courier_name"))
+        .outerjoin(courier, Order.completed_by_courier_id == courier.id)
+        .order_by(Order.id)
+    )
+    if date_from:
+        query = query.where(Order.created_at >= date_from)
+    if date_to:
+        query = query.where(Order.created_at < date_to + timedelta(days=1))
+
+    headers = ["ID", "Дата", "Клієнт", "Телефон", "Адреса", "Тип", "Статус", "Сума, грн", "Склад", "Кур'єр"]
+    chunks = _stream_rows(query, lambda r: (
+        r.id, _format_dt(r.created_at), r.customer_name, r.phone_number, r.address,
+        ORDER_TYPE_LABELS.get(r.order_type, r.order_type), status_names.get(r.status_id, ""), r.total_price, r.products, r.courier_name
+    ))
+    period = f"_{date_from or ''}_{date_to or ''}" if date_from or date_to else ""
+    return _export_response(f"orders{period}", export_format, headers, chunks, "Замовлення")
+
+
+@router.get("/admin/export/clients")
+async def export_clients(export_format: str = Query("csv", alias="format"), username: str = Depends(check_credentials)):
+    export_format = _parse_format(export_format)
+    query = sa.select(ClientStat).order_by(ClientStat.order_count.desc(), ClientStat.phone_number.desc())
+    headers = ["Ім'я", "Телефон", "Всього замовлень", "Загальна сума, грн", "Останнє замовлення"]
+    chunks = _stream_rows(query, lambda r: (
+        r.ClientStat.customer_name, r.ClientStat.phone_number, r.ClientStat.order_count, r.ClientStat.total_spent,
+        _format_dt(r.ClientStat.last_order_at)
+    ))
+    return _export_response("clients", export_format, headers, chunks, "Клієнти")
+
+
+@router.get("/admin/export/couriers")
+async def export_courier_report(
+    export_format: str = Query("csv", alias="format"),
+    date_from_str: str = Query(None, alias="date_from"),
+    date_to_str: str = Query(None, alias="date_to"),
+    username: str = Depends(check_credentials)
+):
+    """Звіт по кур'єрах з тими ж датами за замовчуванням, що й сторінка звіту (останні 7 днів)."""
+    export_format = _parse_format(export_format)
+    date_to = _parse_date(date_to_str) or date.today()
+    date_from = _parse_date(date_from_str) or date_to - timedelta(days=6)
+    headers = ["Ім'я кур'єра", "Кількість виконаних замовлень", "Сума виконаних замовлень, грн"]
+
+    completed_status_ids = await get_completed_status_ids()
+    chunks = _stream_rows(courier_report_query(date_from, date_to, completed_status_ids),
+                          lambda r: (r.full_name, r.completed_orders, r.revenue))
+    return _export_response(f"couriers_{date_from}_{date_to}", export_format, headers, chunks, "Кур'єри")
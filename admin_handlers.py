@@ -14,8 +14,13 @@ from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 from urllib.parse import quote_plus
 import re # <--- ДОДАНО
+from typing import Optional
 
-from models import Order, Product, Category, OrderStatus, Employee, Role, Settings, OrderStatusHistory
+from models import Order, OrderItem, Product, Category, Employee, OrderStatusHistory
+from order_items import refresh_order_totals
+from notification_dispatcher import Notification, send_notifications
+from staff_identity import StaffIdentity, staff_cache
+from reference_data import get_settings_snapshot, get_visible_statuses, get_role_ids, get_status
 # --- ПОЧАТОК ЗМІН: Додано _generate_waiter_order_view ---
 from courier_handlers import get_operator_keyboard, get_staff_login_keyboard, get_courier_keyboard, _generate_waiter_order_view
 # --- КІНЕЦЬ ЗМІН ---
@@ -32,37 +37,11 @@ class AdminEditOrderStates(StatesGroup):
 class OperatorAuthStates(StatesGroup):
     waiting_for_phone = State()
 
-def parse_products_string(products_str: str) -> dict[str, int]:
-    """Розбирає рядок 'Назва x Кількість, ...' на словник."""
-    if not products_str: return {}
-    products_dict = {}
-    for part in products_str.split(', '):
-        try:
-            name, quantity_str = part.rsplit(' x ', 1)
-            products_dict[name] = int(quantity_str)
-        except ValueError:
-            logging.warning(f"Не вдалося розібрати частину рядка продукту: {part}")
-    return products_dict
-
-def build_products_string(products_dict: dict[str, int]) -> str:
-    """Збирає словник назад у рядок 'Назва x Кількість, ...'."""
-    return ", ".join([f"{name} x {quantity}" for name, quantity in products_dict.items()])
-
-async def recalculate_order_total(products_dict: dict[str, int], session: AsyncSession) -> int:
-    """Перераховує загальну суму замовлення на основі оновленого складу."""
-    total = 0
-    if not products_dict: return 0
-    products_res = await session.execute(select(Product).where(Product.name.in_(list(products_dict.keys()))))
-    db_products = {p.name: p for p in products_res.scalars().all()}
-    for name, quantity in products_dict.items():
-        if product := db_products.get(name):
-            total += product.price * quantity
-    return total
-
 async def _generate_order_admin_view(order: Order, session: AsyncSession):
     """Генерує текст та клавіатуру для відображення замовлення в адмін-боті."""
-    await session.refresh(order, ['status', 'courier'])
-    status_name = order.status.name if order.status else 'Невідомий'
+    await session.refresh(order, ['courier'])
+    status = await get_status(order.status_id)
+    status_name = status.name if status else 'Невідомий'
     delivery_info = f"Адреса: {html_module.escape(order.address or 'Не вказана')}" if order.is_delivery else 'Самовивіз'
     time_info = f"Час: {html_module.escape(order.delivery_time)}"
     source = f"Джерело: {'Сайт' if order.user_id is None else 'Telegram-бот'}"
@@ -77,10 +56,7 @@ async def _generate_order_admin_view(order: Order, session: AsyncSession):
                   f"<b>Статус:</b> {status_name}")
 
     kb_admin = InlineKeyboardBuilder()
-    statuses_res = await session.execute(
-        select(OrderStatus).where(OrderStatus.visible_to_operator == True).order_by(OrderStatus.id)
-    )
-    statuses = statuses_res.scalars().all()
+    statuses = await get_visible_statuses("operator")
     status_buttons = [
         InlineKeyboardButton(text=f"{'✅ ' if s.id == order.status_id else ''}{s.name}", callback_data=f"change_order_status_{order.id}_{s.id}")
         for s in statuses
@@ -107,23 +83,18 @@ async def _display_edit_items_menu(bot: Bot, chat_id: int, message_id: int, orde
     """Показує меню редагування складу замовлення."""
     order = await session.get(Order, order_id)
     if not order: return
-    products_dict = parse_products_string(order.products)
     text = f"<b>Склад замовлення #{order.id}</b> (Сума: {order.total_price} грн)\n\n"
     kb = InlineKeyboardBuilder()
-    if not products_dict:
+    if not order.items:
         text += "<i>Замовлення порожнє</i>"
     else:
-        product_names = list(products_dict.keys())
-        products_res = await session.execute(select(Product).where(Product.name.in_(product_names)))
-        db_products = {p.name: p for p in products_res.scalars().all()}
-        for name, quantity in products_dict.items():
-            if product := db_products.get(name):
-                kb.row(
-                    InlineKeyboardButton(text="➖", callback_data=f"admin_change_qnt_{order.id}_{product.id}_-1"),
-                    InlineKeyboardButton(text=f"{html_module.escape(name)}: {quantity}", callback_data="noop"),
-                    InlineKeyboardButton(text="➕", callback_data=f"admin_change_qnt_{order.id}_{product.id}_1"),
-                    InlineKeyboardButton(text="❌", callback_data=f"admin_delete_item_{order.id}_{product.id}")
-                )
+        for item in order.items:
+            kb.row(
+                InlineKeyboardButton(text="➖", callback_data=f"admin_change_qnt_{order.id}_{item.id}_-1"),
+                InlineKeyboardButton(text=f"{html_module.escape(item.name)}: {item.quantity}", callback_data="noop"),
+                InlineKeyboardButton(text="➕", callback_data=f"admin_change_qnt_{order.id}_{item.id}_1"),
+                InlineKeyboardButton(text="❌", callback_data=f"admin_delete_item_{order.id}_{item.id}")
+            )
     kb.row(InlineKeyboardButton(text="➕ Додати страву", callback_data=f"admin_add_item_start_{order_id}"))
     kb.row(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"edit_order_{order_id}"))
     await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, reply_markup=kb.as_markup())
@@ -177,8 +148,8 @@ async def _display_edit_delivery_menu(bot: Bot, chat_id: int, message_id: int, o
 
 def register_admin_handlers(dp: Dispatcher):
     @dp.message(F.text == "🔐 Вхід оператора")
-    async def operator_login_start(message: Message, state: FSMContext, session: AsyncSession):
-        employee = await session.scalar(select(Employee).where(Employee.telegram_user_id == message.from_user.id).options(joinedload(Employee.role)))
+    async def operator_login_start(message: Message, state: FSMContext, staff: Optional[StaffIdentity]):
+        employee = staff
         if employee:
             if employee.role.can_manage_orders:
                 return await message.answer(f"✅ Ви вже авторизовані як оператор.", reply_markup=get_operator_keyboard(employee))
@@ -193,17 +164,20 @@ def register_admin_handlers(dp: Dispatcher):
         phone = message.text.strip()
         employee = await session.scalar(select(Employee).options(joinedload(Employee.role)).where(Employee.phone_number == phone))
         if employee and employee.role.can_manage_orders:
+            old_telegram_user_id = employee.telegram_user_id
             employee.telegram_user_id = message.from_user.id
             await session.commit()
+            staff_cache.invalidate(old_telegram_user_id)
+            staff_cache.invalidate(message.from_user.id)
             await state.clear()
             await message.answer(f"🎉 Доброго дня, {employee.full_name}! Ви успішно авторизовані як {employee.role.name}.", reply_markup=get_operator_keyboard(employee))
         else:
             await message.answer("❌ Співробітника з таким номером не знайдено або він не має прав Оператора.")
     
     @dp.callback_query(F.data.startswith("change_order_status_"))
-    async def change_order_status_admin(callback: CallbackQuery, session: AsyncSession):
+    async def change_order_status_admin(callback: CallbackQuery, session: AsyncSession, staff: Optional[StaffIdentity]):
         client_bot = dp.get("client_bot")
-        employee = await session.scalar(select(Employee).where(Employee.telegram_user_id == callback.from_user.id))
+        employee = staff
         actor_info = f"Оператор: {employee.full_name}" if employee else f"Оператор (ID: {callback.from_user.id})"
         
         parts = callback.data.split("_")
@@ -213,7 +187,7 @@ def register_admin_handlers(dp: Dispatcher):
         if not order: return await callback.answer("Замовлення не знайдено!", show_alert=True)
         if order.status_id == new_status_id: return await callback.answer("Статус вже встановлено.")
 
-        old_status = await session.get(OrderStatus, order.status_id)
+        old_status = await get_status(order.status_id)
         old_status_name = old_status.name if old_status else 'Невідомий'
 
         order.status_id = new_status_id
@@ -344,21 +318,18 @@ def register_admin_handlers(dp: Dispatcher):
     @dp.callback_query(F.data.startswith("admin_change_qnt_") | F.data.startswith("admin_delete_item_"))
     async def admin_modify_item(callback: CallbackQuery, session: AsyncSession):
         parts = callback.data.split("_")
-        order_id, product_id = int(parts[3]), int(parts[4])
+        order_id, item_id = int(parts[3]), int(parts[4])
         order = await session.get(Order, order_id)
-        product = await session.get(Product, product_id)
-        if not order or not product: return await callback.answer("Помилка!", show_alert=True)
+        item = next((i for i in order.items if i.id == item_id), None) if order else None
+        if not order or not item: return await callback.answer("Помилка!", show_alert=True)
 
-        products_dict = parse_products_string(order.products)
         if "change_qnt" in callback.data:
-            new_quantity = products_dict.get(product.name, 0) + int(parts[5])
-            if new_quantity > 0: products_dict[product.name] = new_quantity
-            else: del products_dict[product.name]
-        elif "delete_item" in callback.data and product.name in products_dict:
-            del products_dict[product.name]
-
-        order.products = build_products_string(products_dict)
-        order.total_price = await recalculate_order_total(products_dict, session)
+            item.quantity += int(parts[5])
+            if item.quantity <= 0: order.items.remove(item)
+        elif "delete_item" in callback.data:
+            order.items.remove(item)
+
+        refresh_order_totals(order)
         await session.commit()
         await _display_edit_items_menu(callback.bot, callback.message.chat.id, callback.message.message_id, order_id, session)
         await callback.answer()
@@ -402,10 +373,11 @@ def register_admin_handlers(dp: Dispatcher):
         order = await session.get(Order, order_id)
         product = await session.get(Product, product_id)
         if not order or not product: return await callback.answer("Помилка!", show_alert=True)
-        products_dict = parse_products_string(order.products)
-        products_dict[product.name] = products_dict.get(product.name, 0) + 1
-        order.products = build_products_string(products_dict)
-        order.total_price = await recalculate_order_total(products_dict, session)
+        if item := next((i for i in order.items if i.product_id == product.id), None):
+            item.quantity += 1
+        else:
+            order.items.append(OrderItem(product_id=product.id, name=product.name, price=product.price, quantity=1))
+        refresh_order_totals(order)
         await session.commit()
         await _display_edit_items_menu(callback.bot, callback.message.chat.id, callback.message.message_id, order_id, session)
         await callback.answer(f"✅ {product.name} додано!")
@@ -414,8 +386,7 @@ def register_admin_handlers(dp: Dispatcher):
     async def select_courier_start(callback: CallbackQuery, session: AsyncSession):
         order_id = int(callback.data.split("_")[2])
         # ВИПРАВЛЕНО: Збираємо ID усіх ролей, які можуть бути кур'єрами
-        courier_roles_res = await session.execute(select(Role.id).where(Role.can_be_assigned == True))
-        courier_role_ids = courier_roles_res.scalars().all()
+        courier_role_ids = await get_role_ids("can_be_assigned")
         
         if not courier_role_ids:
             return await callback.answer("Помилка: Роль 'Кур'єр' не знайдена в системі.", show_alert=True)
@@ -440,21 +411,20 @@ def register_admin_handlers(dp: Dispatcher):
 
     @dp.callback_query(F.data.startswith("assign_courier_"))
     async def assign_courier(callback: CallbackQuery, session: AsyncSession):
-        settings = await session.get(Settings, 1)
+        settings = await get_settings_snapshot()
         order_id, courier_id = map(int, callback.data.split("_")[2:])
         order = await session.get(Order, order_id)
         if not order: return await callback.answer("Замовлення не знайдено!", show_alert=True)
 
         old_courier_id = order.courier_id
         new_courier_name = "Не призначений"
+        notifications = []
 
         if old_courier_id and old_courier_id != courier_id:
             old_courier = await session.get(Employee, old_courier_id)
             if old_courier and old_courier.telegram_user_id:
-                try:
-                    await callback.bot.send_message(old_courier.telegram_user_id, f"❗️ Замовлення #{order.id} було знято з вас оператором.")
-                except Exception as e:
-                    logging.error(f"Не вдалося повідомити колишнього кур'єра {old_courier.id}: {e}")
+                notifications.append(Notification(callback.bot, old_courier.telegram_user_id, f"❗️ Замовлення #{order.id} було знято з вас оператором.",
+                                                  label=f"колишньому кур'єру {old_courier.id}"))
 
         if courier_id == 0:
             order.courier_id = None
@@ -465,33 +435,32 @@ def register_admin_handlers(dp: Dispatcher):
             new_courier_name = new_courier.full_name
             
             if new_courier.telegram_user_id:
-                try:
-                    kb_courier = InlineKeyboardBuilder()
-                    statuses_res = await session.execute(select(OrderStatus).where(OrderStatus.visible_to_courier == True).order_by(OrderStatus.id))
-                    statuses = statuses_res.scalars().all()
-                    kb_courier.row(*[InlineKeyboardButton(text=s.name, callback_data=f"courier_set_status_{order.id}_{s.id}") for s in statuses])
-                    
-                    if order.is_delivery and order.address:
-                        encoded_address = quote_plus(order.address)
-                        # ВИПРАВЛЕНО: Правильне посилання на карту
-                        map_query = f"https://maps.google.com/?q={encoded_address}"
-                        kb_courier.row(InlineKeyboardButton(text="🗺️ На карті", url=map_query))
+                kb_courier = InlineKeyboardBuilder()
+                statuses = await get_visible_statuses("courier")
+                kb_courier.row(*[InlineKeyboardButton(text=s.name, callback_data=f"courier_set_status_{order.id}_{s.id}") for s in statuses])
+                
+                if order.is_delivery and order.address:
+                    encoded_address = quote_plus(order.address)
+                    # ВИПРАВЛЕНО: Правильне посилання на карту
+                    map_query = f"https://maps.google.com/?q={encoded_address}"
+                    kb_courier.row(InlineKeyboardButton(text="🗺️ На карті", url=map_query))
+                
+                # ВИДАЛЕНО: Кнопка "Зателефонувати клієнту" за запитом користувача.
                     
-                    # ВИДАЛЕНО: Кнопка "Зателефонувати клієнту" за запитом користувача.
-                        
-                    await callback.bot.send_message(
-                        new_courier.telegram_user_id,
-                        # ОНОВЛЕНО: Додано номер телефону в текст повідомлення
-                        f"🔔 Вам призначено нове замовлення!\n\n<b>Замовлення #{order.id}</b>\nАдреса: {html_module.escape(order.address or 'Самовивіз')}\nТелефон: {html_module.escape(order.phone_number)}\nСума: {order.total_price} грн.",
-                        reply_markup=kb_courier.as_markup()
-                    )
-                except Exception as e:
-                    logging.error(f"Не вдалося повідомити нового кур'єра {new_courier.telegram_user_id}: {e}")
+                notifications.append(Notification(
+                    callback.bot, new_courier.telegram_user_id,
+                    # ОНОВЛЕНО: Додано номер телефону в текст повідомлення
+                    f"🔔 Вам призначено нове замовлення!\n\n<b>Замовлення #{order.id}</b>\nАдреса: {html_module.escape(order.address or 'Самовивіз')}\nТелефон: {html_module.escape(order.phone_number)}\nСума: {order.total_price} грн.",
+                    label=f"новому кур'єру {new_courier.id}", kwargs={"reply_markup": kb_courier.as_markup()}
+                ))
         
         await session.commit()
         
         if settings and settings.admin_chat_id:
-            await callback.bot.send_message(settings.admin_chat_id, f"👤 Замовленню #{order.id} призначено кур'єра: <b>{html_module.escape(new_courier_name)}</b>")
+            notifications.append(Notification(callback.bot, settings.admin_chat_id,
+                                              f"👤 Замовленню #{order.id} призначено кур'єра: <b>{html_module.escape(new_courier_name)}</b>",
+                                              label="в адмін-чат"))
+        await send_notifications(notifications)
         
         await _display_order_view(callback.bot, callback.message.chat.id, callback.message.message_id, order_id, session)
         await callback.answer(f"Кур'єра призначено: {new_courier_name}")
\ No newline at end of file
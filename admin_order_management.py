@@ -5,35 +5,23 @@ from fastapi.responses import RedirectResponse, HTMLResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload
-from aiogram import Bot
 from urllib.parse import quote_plus
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 import re # <--- ДОДАНО
 
 
-from models import Order, OrderStatus, Employee, Role, OrderStatusHistory, Settings
+from models import Order, Employee, OrderStatusHistory
 from templates import ADMIN_HTML_TEMPLATE, ADMIN_ORDER_MANAGE_BODY
 from dependencies import get_db_session, check_credentials
 from notification_manager import notify_all_parties_on_status_change
+from notification_dispatcher import Notification, send_notifications
+from bot_instances import get_bots, get_admin_bot
+from reference_data import get_settings_snapshot, get_statuses, get_visible_statuses, get_role_ids, get_status
 
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-async def get_bot_instances(session: AsyncSession) -> tuple[Bot | None, Bot | None]:
-    """Допоміжна функція для отримання екземплярів ботів на основі налаштувань у БД."""
-    settings = await session.get(Settings, 1)
-    if not settings or not settings.admin_bot_token or not settings.client_bot_token:
-        logger.warning("Токени ботів не налаштовані в базі даних.")
-        return None, None
-    
-    from aiogram.enums import ParseMode
-    from aiogram.client.default import DefaultBotProperties
-
-    admin_bot = Bot(token=settings.admin_bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    client_bot = Bot(token=settings.client_bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    return admin_bot, client_bot
-
 @router.get("/admin/order/manage/{order_id}", response_class=HTMLResponse)
 async def get_manage_order_page(
     order_id: int,
@@ -45,20 +33,18 @@ async def get_manage_order_page(
         Order,
         order_id,
         options=[
-            joinedload(Order.status),
             joinedload(Order.courier),
-            joinedload(Order.history).joinedload(OrderStatusHistory.status)
+            joinedload(Order.history)
         ]
     )
     if not order:
         raise HTTPException(status_code=404, detail="Замовлення не знайдено")
 
-    statuses_res = await session.execute(select(OrderStatus).order_by(OrderStatus.id))
-    all_statuses = statuses_res.scalars().all()
+    all_statuses = await get_statuses()
+    status_names = {s.id: s.name for s in all_statuses}
     status_options = "".join([f'<option value="{s.id}" {"selected" if s.id == order.status_id else ""}>{html.escape(s.name)}</option>' for s in all_statuses])
 
-    courier_role_res = await session.execute(select(Role.id).where(Role.can_be_assigned == True))
-    courier_role_ids = courier_role_res.scalars().all()
+    courier_role_ids = await get_role_ids("can_be_assigned")
     
     couriers_on_shift = []
     if courier_role_ids:
@@ -76,7 +62,7 @@ async def get_manage_order_page(
     sorted_history = sorted(order.history, key=lambda h: h.timestamp, reverse=True)
     for entry in sorted_history:
         timestamp = entry.timestamp.strftime('%d.%m.%Y %H:%M')
-        history_html += f"<li><b>{entry.status.name}</b> (Ким: {html.escape(entry.actor_info)}) - {timestamp}</li>"
+        history_html += f"<li><b>{html.escape(status_names.get(entry.status_id, 'Невідомий'))}</b> (Ким: {html.escape(entry.actor_info)}) - {timestamp}</li>"
     history_html += "</ul>"
     
     products_html = "<ul>" + "".join([f"<li>{html.escape(item.strip())}</li>" for item in order.products.split(',')]) + "</ul>"
@@ -106,14 +92,15 @@ async def web_set_order_status(
     username: str = Depends(check_credentials)
 ):
     """Обробляє зміну статусу замовлення з веб-панелі."""
-    order = await session.get(Order, order_id, options=[joinedload(Order.status)])
+    order = await session.get(Order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Замовлення не знайдено")
     
     if order.status_id == status_id:
         return RedirectResponse(url=f"/admin/order/manage/{order_id}", status_code=303)
 
-    old_status_name = order.status.name if order.status else "Невідомий"
+    old_status = await get_status(order.status_id)
+    old_status_name = old_status.name if old_status else "Невідомий"
     order.status_id = status_id
     actor_info = "Адміністратор веб-панелі"
     
@@ -122,20 +109,16 @@ async def web_set_order_status(
     
     await session.commit()
 
-    admin_bot, client_bot = await get_bot_instances(session)
+    client_bot, admin_bot = await get_bots()
     if admin_bot:
-        try:
-            await notify_all_parties_on_status_change(
-                order=order,
-                old_status_name=old_status_name,
-                actor_info=actor_info,
-                admin_bot=admin_bot,
-                client_bot=client_bot,
-                session=session
-            )
-        finally:
-            await admin_bot.session.close()
-            if client_bot: await client_bot.session.close()
+        await notify_all_parties_on_status_change(
+            order=order,
+            old_status_name=old_status_name,
+            actor_info=actor_info,
+            admin_bot=admin_bot,
+            client_bot=client_bot,
+            session=session
+        )
 
     return RedirectResponse(url=f"/admin/order/manage/{order_id}", status_code=303)
 
@@ -152,63 +135,57 @@ async def web_assign_courier(
     if not order:
         raise HTTPException(status_code=404, detail="Замовлення не знайдено")
 
-    admin_bot, _ = await get_bot_instances(session)
+    admin_bot = await get_admin_bot()
     if not admin_bot:
          raise HTTPException(status_code=500, detail="Бот не налаштований для відправки сповіщень.")
 
-    try:
-        old_courier_id = order.courier_id
-        new_courier_name = "Не призначено"
-
-        if old_courier_id and old_courier_id != courier_id:
-            old_courier = await session.get(Employee, old_courier_id)
-            if old_courier and old_courier.telegram_user_id:
-                try:
-                    await admin_bot.send_message(old_courier.telegram_user_id, f"❗️ Замовлення #{order.id} було знято з вас оператором.")
-                except Exception as e:
-                    logger.error(f"Не вдалося сповістити колишнього кур'єра {old_courier.id}: {e}")
-
-        if courier_id == 0:
-            order.courier_id = None
-        else:
-            new_courier = await session.get(Employee, courier_id)
-            if not new_courier:
-                raise HTTPException(status_code=404, detail="Кур'єра не знайдено")
+    old_courier_id = order.courier_id
+    new_courier_name = "Не призначено"
+    notifications = []
+
+    if old_courier_id and old_courier_id != courier_id:
+        old_courier = await session.get(Employee, old_courier_id)
+        if old_courier and old_courier.telegram_user_id:
+            notifications.append(Notification(admin_bot, old_courier.telegram_user_id, f"❗️ Замовлення #{order.id} було знято з вас оператором.",
+                                              label=f"колишньому кур'єру {old_courier.id}"))
+
+    if courier_id == 0:
+        order.courier_id = None
+    else:
+        new_courier = await session.get(Employee, courier_id)
+        if not new_courier:
+            raise HTTPException(status_code=404, detail="Кур'єра не знайдено")
+        
+        order.courier_id = courier_id
+        new_courier_name = new_courier.full_name
+        
+        if new_courier.telegram_user_id:
+            kb_courier = InlineKeyboardBuilder()
+            statuses = await get_visible_statuses("courier")
+            kb_courier.row(*[InlineKeyboardButton(text=s.name, callback_data=f"courier_set_status_{order.id}_{s.id}") for s in statuses])
             
-            order.courier_id = courier_id
-            new_courier_name = new_courier.full_name
+            if order.is_delivery and order.address:
+                encoded_address = quote_plus(order.address)
+                # ВИПРАВЛЕНО: Правильне посилання на карту
+                map_url = f"https://maps.google.com/?q={encoded_address}"
+                kb_courier.row(InlineKeyboardButton(text="🗺️ На карті", url=map_url))
+                
+            # ВИДАЛЕНО: Кнопка "Зателефонувати клієнту" за запитом користувача.
             
-            if new_courier.telegram_user_id:
-                try:
-                    kb_courier = InlineKeyboardBuilder()
-                    statuses_res = await session.execute(select(OrderStatus).where(OrderStatus.visible_to_courier == True).order_by(OrderStatus.id))
-                    statuses = statuses_res.scalars().all()
-                    kb_courier.row(*[InlineKeyboardButton(text=s.name, callback_data=f"courier_set_status_{order.id}_{s.id}") for s in statuses])
-                    
-                    if order.is_delivery and order.address:
-                        encoded_address = quote_plus(order.address)
-                        # ВИПРАВЛЕНО: Правильне посилання на карту
-                        map_url = f"https://maps.google.com/?q={encoded_address}"
-                        kb_courier.row(InlineKeyboardButton(text="🗺️ На карті", url=map_url))
-                        
-                    # ВИДАЛЕНО: Кнопка "Зателефонувати клієнту" за запитом користувача.
-                    
-                    await admin_bot.send_message(
-                        new_courier.telegram_user_id,
-                        # ОНОВЛЕНО: Додано номер телефону в текст повідомлення
-                        f"🔔 Вам призначено нове замовлення!\n\n<b>Замовлення #{order.id}</b>\nАдреса: {html.escape(order.address or 'Самовивіз')}\nТелефон: {html.escape(order.phone_number)}\nСума: {order.total_price} грн.",
-                        reply_markup=kb_courier.as_markup()
-                    )
-                except Exception as e:
-                    logger.error(f"Не вдалося сповістити нового кур'єра {new_courier.telegram_user_id}: {e}")
-        
-        await session.commit()
+            notifications.append(Notification(
+                admin_bot, new_courier.telegram_user_id,
+                # ОНОВЛЕНО: Додано номер телефону в текст повідомлення
+                f"🔔 Вам призначено нове замовлення!\n\n<b>Замовлення #{order.id}</b>\nАдреса: {html.escape(order.address or 'Самовивіз')}\nТелефон: {html.escape(order.phone_number)}\nСума: {order.total_price} грн.",
+                label=f"новому кур'єру {new_courier.id}", kwargs={"reply_markup": kb_courier.as_markup()}
+            ))
+    
+    await session.commit()
 
-        settings = await session.get(Settings, 1)
-        if settings and settings.admin_chat_id:
-            await admin_bot.send_message(settings.admin_chat_id, f"👤 Замовленню #{order.id} призначено кур'єра: <b>{html.escape(new_courier_name)}</b> (через веб-панель)")
-            
-    finally:
-        await admin_bot.session.close()
+    settings = await get_settings_snapshot()
+    if settings.admin_chat_id:
+        notifications.append(Notification(admin_bot, settings.admin_chat_id,
+                                          f"👤 Замовленню #{order.id} призначено кур'єра: <b>{html.escape(new_courier_name)}</b> (через веб-панель)",
+                                          label="в адмін-чат"))
+    await send_notifications(notifications)
     
     return RedirectResponse(url=f"/admin/order/manage/{order_id}", status_code=303)
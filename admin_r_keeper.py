@@ -0,0 +1,114 @@
+# admin_r_keeper.py
+
+import html
+from fastapi import APIRouter, Depends
+from fastapi.responses import HTMLResponse, RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, update
+
+from models import Order, OutboxEvent, RKeeperMenuSync
+from templates import ADMIN_HTML_TEMPLATE
+from dependencies import get_db_session, check_credentials
+from outbox import EVENT_R_KEEPER_ORDER, awaiting_retry_filter, retry_events
+from r_keeper_sync import request_menu_sync
+
+router = APIRouter()
+
+STATUS_LABELS = {'pending': 'В черзі', 'sent': 'Передано', 'failed': 'Не передано'}
+
+
+async def _requeue(session: AsyncSession, event_ids: list):
+    """Повертає завдання в чергу і позначає їхні замовлення як такі, що очікують відправки."""
+    events = (await session.execute(
+        select(OutboxEvent).where(OutboxEvent.id.in_(event_ids), awaiting_retry_filter()).with_for_update()
+    )).scalars().all()
+    event_ids = [e.id for e in events]
+    order_ids = [e.payload.get("order_id") for e in events if e.payload]
+    if event_ids:
+        await retry_events(session, event_ids)
+    if order_ids:
+        await session.execute(update(Order).where(Order.id.in_(order_ids)).values(r_keeper_status='pending'))
+    await session.commit()
+
+
+@router.get("/admin/r_keeper", response_class=HTMLResponse)
+async def admin_r_keeper_queue(session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+    """Завдання відправки в R-Keeper, що очікують повтору після помилки або остаточно не виконані."""
+    counts = dict((await session.execute(
+        select(Order.r_keeper_status, func.count(Order.id)).where(Order.r_keeper_status.isnot(None)).group_by(Order.r_keeper_status)
+    )).all())
+    stuck_jobs = (await session.execute(
+        select(OutboxEvent)
+        .where(OutboxEvent.kind == EVENT_R_KEEPER_ORDER, awaiting_retry_filter())
+        .order_by(OutboxEvent.id)
+        .limit(200)
+    )).scalars().all()
+
+    rows = "".join([f"""
+    <tr>
+        <td><a href="/admin/order/manage/{job.payload.get('order_id')}">#{job.payload.get('order_id')}</a></td>
+        <td>{'❌ Спроби вичерпано' if job.status == 'failed' else '⏳ Очікує повтору'}</td>
+        <td>{job.attempts}</td>
+        <td>{job.available_at.strftime('%d.%m %H:%M:%S') if job.status == 'pending' else '-'}</td>
+        <td>{html.escape(job.last_error or '')}</td>
+        <td>{job.created_at.strftime('%d.%m.%Y %H:%M')}</td>
+        <td class='actions'>
+            <form action="/admin/r_keeper/retry/{job.id}" method="post" style="display:inline"><button type="submit" class="button-sm">🔁 Повторити зараз</button></form>
+        </td>
+    </tr>""" for job in stuck_jobs])
+
+    menu_sync = await session.get(RKeeperMenuSync, 1)
+    if menu_sync and menu_sync.last_synced_at:
+        menu_sync_info = f"Остання синхронізація {menu_sync.last_synced_at.strftime('%d.%m.%Y %H:%M')}: {html.escape(menu_sync.last_result or '')}"
+    else:
+        menu_sync_info = "Меню ще не синхронізувалося."
+
+    summary = ", ".join(f"{label}: {counts.get(status, 0)}" for status, label in STATUS_LABELS.items())
+    body = f"""
+    <div class="card">
+        <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 1.5rem;">
+            <h2>🔌 Черга відправки в R-Keeper</h2>
+            <form action="/admin/r_keeper/retry_all" method="post"><button type="submit" class="button" {'disabled' if not stuck_jobs else ''}>🔁 Повторити всі</button></form>
+        </div>
+        <p>Замовлення за статусом передачі — {summary}</p>
+        <p>Нижче завдання, які не вдалося виконати з першої спроби. Вони повторюються автоматично з наростаючою паузою; після вичерпання спроб їх можна повторити вручну.</p>
+        <table><thead><tr><th>Замовлення</th><th>Стан</th><th>Спроб</th><th>Наступна спроба</th><th>Остання помилка</th><th>Створено</th><th>Дії</th></tr></thead><tbody>
+        {rows or "<tr><td colspan='7'>Немає завдань, що застрягли</td></tr>"}
+        </tbody></table>
+    </div>
+    <div class="card">
+        <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 1.5rem;">
+            <h2>🔄 Синхронізація меню</h2>
+            <div>
+                <form action="/admin/r_keeper/sync_menu" method="post" style="display:inline"><button type="submit" class="button">Оновити зміни</button></form>
+                <form action="/admin/r_keeper/sync_menu?full=1" method="post" style="display:inline"><button type="submit" class="button">Повна звірка</button></form>
+            </div>
+        </div>
+        <p>Ціни, назви та наявність товарів з указаним ID в R-Keeper підтягуються з каси автоматично. Повна звірка також знімає з продажу товари, яких у R-Keeper більше немає. Запущена вручну синхронізація виконується у фоні — оновіть сторінку, щоб побачити результат.</p>
+        <p>{menu_sync_info}</p>
+    </div>"""
+    active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active"]}
+    active_classes["settings_active"] = "active"
+    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(title="Черга R-Keeper", body=body, **active_classes))
+
+
+@router.post("/admin/r_keeper/retry/{event_id}")
+async def admin_r_keeper_retry(event_id: int, session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+    await _requeue(session, [event_id])
+    return RedirectResponse(url="/admin/r_keeper", status_code=303)
+
+
+@router.post("/admin/r_keeper/retry_all")
+async def admin_r_keeper_retry_all(session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+    event_ids = (await session.execute(
+        select(OutboxEvent.id).where(OutboxEvent.kind == EVENT_R_KEEPER_ORDER, awaiting_retry_filter())
+    )).scalars().all()
+    if event_ids:
+        await _requeue(session, list(event_ids))
+    return RedirectResponse(url="/admin/r_keeper", status_code=303)
+
+
+@router.post("/admin/r_keeper/sync_menu")
+async def admin_r_keeper_sync_menu(full: bool = False, username: str = Depends(check_credentials)):
+    request_menu_sync(full=full)
+    return RedirectResponse(url="/admin/r_keeper", status_code=303)
@@ -0,0 +1,118 @@
+# admin_sla.py
+
+import html
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, Form, HTTPException, Query
+from fastapi.responses import HTMLResponse, RedirectResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ORDER_TYPE_LABELS, Employee
+from templates import ADMIN_HTML_TEMPLATE
+from dependencies import get_db_session, check_credentials
+from sla_stats import GROUPINGS, PERCENTILES, STAGES, group_durations, invalidate_days, load_durations
+
+router = APIRouter()
+
+GROUPING_LABELS = {'courier': "Кур'єр", 'waiter': 'Офіціант', 'hour': 'Година створення', 'order_type': 'Тип замовлення'}
+
+
+def _parse_dates(date_from_str: Optional[str], date_to_str: Optional[str]):
+    try:
+        date_to = datetime.strptime(date_to_str, "%Y-%m-%d").date() if date_to_str else date.today()
+        date_from = datetime.strptime(date_from_str, "%Y-%m-%d").date() if date_from_str else date_to - timedelta(days=6)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Дата має бути у форматі РРРР-ММ-ДД")
+    return date_from, date_to
+
+
+def _minutes(seconds: Optional[int]) -> str:
+    return "–" if seconds is None else f"{seconds / 60:.0f}"
+
+
+@router.get("/admin/reports/sla", response_class=HTMLResponse)
+async def report_sla(
+    date_from_str: str = Query(None, alias="date_from"),
+    date_to_str: str = Query(None, alias="date_to"),
+    group_by: str = Query("courier"),
+    session: AsyncSession = Depends(get_db_session),
+    username: str = Depends(check_credentials)
+):
+    """Перцентилі тривалості етапів замовлення за історією статусів."""
+    if group_by not in GROUPINGS:
+        raise HTTPException(status_code=400, detail="Невідоме групування")
+    date_from, date_to = _parse_dates(date_from_str, date_to_str)
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+
+    groups = group_durations(await load_durations(date_from, date_to), group_by)
+
+    labels: Dict[Any, str] = {}
+    if group_by in ("courier", "waiter"):
+        employee_ids = [g.key for g in groups if g.key is not None]
+        if employee_ids:
+            labels = dict((await session.execute(select(Employee.id, Employee.full_name).where(Employee.id.in_(employee_ids)))).all())
+        empty_label = "Без кур'єра" if group_by == "courier" else "Без офіціанта"
+    elif group_by == "hour":
+        labels = {h: f"{h:02d}:00–{h:02d}:59" for h in range(24)}
+        empty_label = "–"
+    else:
+        labels = ORDER_TYPE_LABELS
+        empty_label = "–"
+
+    def sort_key(group):
+        return (group.key is None, group.key if group_by == "hour" else -group.orders)
+
+    rows = []
+    for group in sorted(groups, key=sort_key):
+        label = empty_label if group.key is None else labels.get(group.key, str(group.key))
+        cells = "".join(
+            f"<td>{' / '.join(_minutes(values[p]) for p in PERCENTILES)} <small>({samples})</small></td>"
+            for samples, values in (group.stages[stage] for stage, _ in STAGES)
+        )
+        rows.append(f"<tr><td>{html.escape(label)}</td><td>{group.orders}</td>{cells}</tr>")
+
+    grouping_options = "".join(
+        f'<option value="{key}" {"selected" if key == group_by else ""}>{label}</option>' for key, label in GROUPING_LABELS.items()
+    )
+    percentiles_label = " / ".join(f"p{p}" for p in PERCENTILES)
+    stage_headers = "".join(f"<th>{label}</th>" for _, label in STAGES)
+    body = f"""
+    <div class="card">
+        <h2>Фільтр звіту</h2>
+        <form action="/admin/reports/sla" method="get" class="search-form">
+            <label for="date_from">Дата з:</label><input type="date" id="date_from" name="date_from" value="{date_from:%Y-%m-%d}">
+            <label for="date_to">Дата по:</label><input type="date" id="date_to" name="date_to" value="{date_to:%Y-%m-%d}">
+            <label for="group_by">Групувати:</label><select id="group_by" name="group_by">{grouping_options}</select>
+            <button type="submit">Сформувати звіт</button>
+        </form>
+    </div>
+    <div class="card">
+        <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 1.5rem;">
+            <h2>⏱️ Тривалість етапів з {date_from:%d.%m.%Y} по {date_to:%d.%m.%Y}</h2>
+            <form action="/admin/reports/sla/recompute" method="post">
+                <input type="hidden" name="date_from" value="{date_from:%Y-%m-%d}"><input type="hidden" name="date_to" value="{date_to:%Y-%m-%d}">
+                <input type="hidden" name="group_by" value="{group_by}">
+                <button type="submit" class="button">🔁 Перерахувати</button>
+            </form>
+        </div>
+        <p>Хвилини, {percentiles_label}; у дужках — скільки замовлень пройшли етап. Етапи визначаються за історією статусів:
+        прийняття — від створення до першого робочого статусу, приготування — до статусу, який бачать кур'єри,
+        видача / доставка — до статусу виконання. Завершені дні рахуються один раз і зберігаються; після зміни статусів натисніть «Перерахувати».</p>
+        <table><thead><tr><th>{GROUPING_LABELS[group_by]}</th><th>Замовлень</th>{stage_headers}</tr></thead><tbody>
+        {''.join(rows) or "<tr><td colspan='6'>Немає замовлень за вибраний період.</td></tr>"}
+        </tbody></table>
+    </div>"""
+    active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "settings_active"]}
+    active_classes["reports_active"] = "active"
+    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(title="Тривалість етапів", body=body, **active_classes))
+
+
+@router.post("/admin/reports/sla/recompute")
+async def report_sla_recompute(date_from: str = Form(...), date_to: str = Form(...), group_by: str = Form("courier"),
+                               username: str = Depends(check_credentials)):
+    start, end = _parse_dates(date_from, date_to)
+    await invalidate_days(min(start, end), max(start, end))
+    return RedirectResponse(url=f"/admin/reports/sla?date_from={date_from}&date_to={date_to}&group_by={group_by}", status_code=303)
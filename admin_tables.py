@@ -11,9 +11,11 @@ from sqlalchemy import select
 from sqlalchemy.orm import joinedload, selectinload
 from typing import List, Optional # <--- Додано List, Optional
 
-from models import Table, Employee, Role
+from models import Table, Employee
 from templates import ADMIN_HTML_TEMPLATE, ADMIN_TABLES_BODY
 from dependencies import get_db_session, check_credentials
+from menu_cache import invalidate_table_pages
+from reference_data import get_role_ids
 
 router = APIRouter()
 
@@ -33,8 +35,7 @@ async def admin_tables_list(
     tables = tables_res.scalars().all()
     
     # Отримуємо ID всіх ролей, які можуть обслуговувати столики
-    waiter_roles_res = await session.execute(select(Role.id).where(Role.can_serve_tables == True))
-    waiter_role_ids = waiter_roles_res.scalars().all()
+    waiter_role_ids = await get_role_ids("can_serve_tables")
     
     waiters_on_shift = []
     if waiter_role_ids:
@@ -101,8 +102,10 @@ async def delete_table(
     """Видаляє столик."""
     table = await session.get(Table, table_id)
     if table:
+        access_token = table.access_token
         await session.delete(table)
         await session.commit()
+        invalidate_table_pages(access_token)
     return RedirectResponse(url="/admin/tables", status_code=303)
 
 # ПОВНІСТЮ ОНОВЛЕНИЙ ЕНДПОІНТ
@@ -130,8 +133,7 @@ async def assign_waiter_to_table(
 
     if waiter_ids:
         # Отримуємо ID ролей офіціантів
-        waiter_roles_res = await session.execute(select(Role.id).where(Role.can_serve_tables == True))
-        waiter_role_ids = waiter_roles_res.scalars().all()
+        waiter_role_ids = await get_role_ids("can_serve_tables")
         
         if waiter_role_ids:
             # Завантажуємо об'єкти Employee, які є офіціантами
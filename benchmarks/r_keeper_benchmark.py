@@ -0,0 +1,114 @@
+# benchmarks/r_keeper_benchmark.py
+#
+# Скільки замовлень за секунду вдається передати в R-Keeper: старий спосіб (новий httpx-клієнт і /login
+# на кожне замовлення) проти спільного клієнта з пулом з'єднань і кешованим токеном (r_keeper.RKeeperAPI).
+# Заглушка R-Keeper (r_keeper_mock.py) запускається в цьому ж процесі.
+# Третій рядок — пакетна відправка через /orders/batch (R_KEEPER_BATCH_SIZE).
+# Використання: python benchmarks/r_keeper_benchmark.py [--orders 500] [--concurrency 10] [--latency-ms 20] [--batch-size 20]
+
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+import uvicorn
+
+import r_keeper
+from r_keeper import RKeeperAPI, RKeeperClient
+from r_keeper_mock import create_app
+
+ITEMS = [{"r_keeper_id": "1001", "quantity": 2, "price": 150}, {"r_keeper_id": "1002", "quantity": 1, "price": 90}]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _settings(api_url: str):
+    return SimpleNamespace(r_keeper_api_url=api_url, r_keeper_user="bench", r_keeper_password="bench",
+                           r_keeper_station_code="1", r_keeper_payment_type="cash", r_keeper_enabled=True)
+
+
+def _order(order_id: int):
+    return SimpleNamespace(id=order_id, customer_name="Бенчмарк", phone_number="+380000000000",
+                           address="вул. Тестова, 1", is_delivery=True, total_price=390, delivery_time="Якнайшвидше")
+
+
+async def send_legacy(api_url: str, order) -> bool:
+    """Як було раніше: окремий клієнт, /login і /orders на кожне замовлення."""
+    async with httpx.AsyncClient() as client:
+        login = await client.post(f"{api_url}/login", json={"user": "bench", "password": "bench"})
+        token = login.json()["access_token"]
+        api = RKeeperAPI(_settings(api_url))
+        response = await client.post(f"{api_url}/orders", json=api._build_order_data(order, ITEMS),
+                                     headers={"Authorization": f"Bearer {token}"})
+        return response.status_code == 200
+
+
+async def run(label: str, send, orders: int, concurrency: int, api_url: str):
+    async with httpx.AsyncClient() as client:
+        before = (await client.get(f"{api_url}/stats")).json()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(order_id: int):
+        async with semaphore:
+            return await send(_order(order_id))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(orders)))
+    elapsed = time.perf_counter() - started
+
+    async with httpx.AsyncClient() as client:
+        after = (await client.get(f"{api_url}/stats")).json()
+    print(f"{label:<28}{orders / elapsed:>10.1f}{elapsed / orders * 1000 * concurrency:>12.1f}"
+          f"{after['logins'] - before['logins']:>9}{sum(results):>8}/{orders}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--batch-size", type=int, default=20)
+    args = parser.parse_args()
+
+    port = _free_port()
+    api_url = f"http://127.0.0.1:{port}"
+    server = uvicorn.Server(uvicorn.Config(create_app(args.latency_ms), host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    client = RKeeperClient()
+    shared_api = RKeeperAPI(_settings(api_url), client=client)
+
+    print(f"Замовлень: {args.orders}, одночасно: {args.concurrency}, затримка R-Keeper: {args.latency_ms} мс")
+    print(f"{'спосіб':<28}{'замовл./с':>10}{'мс/замовл.':>12}{'логінів':>9}{'успішно':>12}")
+    await run("новий клієнт + /login", lambda o: send_legacy(api_url, o), args.orders, args.concurrency, api_url)
+    await run("спільний клієнт + токен", lambda o: shared_api.send_order(o, ITEMS), args.orders, args.concurrency, api_url)
+
+    # Пакетна відправка, як її робить черга outbox: воркер забирає до OUTBOX_BATCH_SIZE подій за раз
+    r_keeper.R_KEEPER_BATCH_SIZE = args.batch_size
+    batches = [list(range(i, min(i + args.batch_size, args.orders))) for i in range(0, args.orders, args.batch_size)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(shared_api.send_orders([(_order(i), ITEMS) for i in batch]) for batch in batches))
+    elapsed = time.perf_counter() - started
+    delivered = sum(sum(r.values()) for r in results)
+    print(f"{f'пакетами по {args.batch_size}':<28}{args.orders / elapsed:>10.1f}{'':>12}{'':>9}{delivered:>8}/{args.orders}")
+
+    await client.close()
+    server.should_exit = True
+    await server_task
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+# benchmarks/r_keeper_mock.py
+#
+# Локальна заглушка R-Keeper API (/login, /orders, /orders/batch, /menu) для тестів (tests/test_r_keeper_client.py), перевірки інтеграції та бенчмарку r_keeper_benchmark.py.
+# Використання: python benchmarks/r_keeper_mock.py [--port 8081] [--latency-ms 20] [--token-ttl 3600]
+# У налаштуваннях застосунку вкажіть адресу http://127.0.0.1:8081, будь-які логін/пароль, код станції та тип оплати.
+# GET /stats показує кількість логінів, прийнятих замовлень, пакетів та відповідей 401.
+# Меню: позиції з id 1001, 1002, ... (--menu-size); POST /menu/{id} змінює name/price/available, DELETE /menu/{id} видаляє позицію.
+
+import argparse
+import asyncio
+import secrets
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+
+def create_app(latency_ms: float = 20, token_ttl: int = 3600, menu_size: int = 50) -> FastAPI:
+    app = FastAPI(title="R-Keeper mock")
+    app.state.tokens = {}
+    app.state.stats = {"logins": 0, "orders": 0, "batches": 0, "unauthorized": 0, "menu_requests": 0, "menu_not_modified": 0}
+    # Кожна зміна позиції отримує новий номер версії меню, за ним відбираються зміни для ?since=
+    app.state.menu_version = 1
+    app.state.menu = {str(1000 + n): {"id": str(1000 + n), "name": f"Позиція {n}", "price": 100 + n, "available": True, "version": 1}
+                      for n in range(1, menu_size + 1)}
+
+    async def simulate_latency():
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+
+    @app.post("/login")
+    async def login(request: Request):
+        await simulate_latency()
+        body = await request.json()
+        if not body.get("user") or not body.get("password"):
+            return JSONResponse({"error": "user and password required"}, status_code=400)
+        token = secrets.token_hex(16)
+        app.state.tokens[token] = time.monotonic() + token_ttl
+        app.state.stats["logins"] += 1
+        return {"access_token": token, "expires_in": token_ttl}
+
+    @app.post("/orders")
+    async def create_order(request: Request):
+        await simulate_latency()
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if app.state.tokens.get(token, 0) < time.monotonic():
+            app.state.stats["unauthorized"] += 1
+            return JSONResponse({"error": "unauthorized"}, status_code=401)
+        order = await request.json()
+        app.state.stats["orders"] += 1
+        return {"status": "accepted", "orderNumber": order.get("orderNumber")}
+
+    @app.post("/orders/batch")
+    async def create_orders_batch(request: Request):
+        await simulate_latency()
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if app.state.tokens.get(token, 0) < time.monotonic():
+            app.state.stats["unauthorized"] += 1
+            return JSONResponse({"error": "unauthorized"}, status_code=401)
+        orders = (await request.json()).get("orders", [])
+        app.state.stats["orders"] += len(orders)
+        app.state.stats["batches"] += 1
+        return {"results": [{"orderNumber": o.get("orderNumber"), "status": "accepted"} for o in orders]}
+
+    @app.get("/menu")
+    async def get_menu(request: Request, since: int = 0):
+        await simulate_latency()
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if app.state.tokens.get(token, 0) < time.monotonic():
+            app.state.stats["unauthorized"] += 1
+            return JSONResponse({"error": "unauthorized"}, status_code=401)
+        app.state.stats["menu_requests"] += 1
+        etag = f'"{app.state.menu_version}"'
+        if request.headers.get("If-None-Match") == etag:
+            app.state.stats["menu_not_modified"] += 1
+            return Response(status_code=304, headers={"ETag": etag})
+        items = [{k: v for k, v in item.items() if k != "version"}
+                 for item in app.state.menu.values() if item["version"] > since]
+        return JSONResponse({"version": app.state.menu_version, "items": items}, headers={"ETag": etag})
+
+    @app.post("/menu/{item_id}")
+    async def update_menu_item(item_id: str, request: Request):
+        """Змінює позицію (або додає нову), як це зробив би менеджер у касі."""
+        changes = {k: v for k, v in (await request.json()).items() if k in ("name", "price", "available")}
+        app.state.menu_version += 1
+        item = app.state.menu.setdefault(item_id, {"id": item_id, "name": item_id, "price": 0, "available": True})
+        item.update(changes, version=app.state.menu_version)
+        return item
+
+    @app.delete("/menu/{item_id}")
+    async def delete_menu_item(item_id: str):
+        app.state.menu.pop(item_id, None)
+        app.state.menu_version += 1
+        return {"ok": True}
+
+    @app.post("/revoke_tokens")
+    async def revoke_tokens():
+        """Скидає всі токени, щоб перевірити повторний логін після 401."""
+        app.state.tokens.clear()
+        return {"ok": True}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.stats
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--token-ttl", type=int, default=3600)
+    parser.add_argument("--menu-size", type=int, default=50)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency_ms, args.token_ttl, args.menu_size), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
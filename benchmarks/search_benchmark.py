@@ -0,0 +1,88 @@
+# benchmarks/search_benchmark.py
+#
+# Порівнює пошук замовлень через FTS5-індекс (search_index.py) та через LIKE '%q%'.
+# Використання: python benchmarks/search_benchmark.py [--orders 1000000] [--db /tmp/search_bench.db]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+import search_index
+from models import Base, Order, OrderStatus
+
+FIRST_NAMES = ["Олександр", "Марія", "Іван", "Олена", "Андрій", "Наталія", "Дмитро", "Ірина", "Сергій", "Тетяна", "Максим", "Юлія"]
+LAST_NAMES = ["Шевченко", "Коваленко", "Бондаренко", "Ткаченко", "Кравченко", "Олійник", "Шевчук", "Поліщук", "Лисенко", "Мельник"]
+QUERIES = ["Коваленко", "олена ш", "067123", "Поліщук", "ксандр Лис", "+380931"]
+PER_PAGE = 15
+REPEATS = 30
+
+
+def fill_database(db_path: str, orders_count: int):
+    engine = sa.create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(engine)
+    rnd = random.Random(42)
+    with engine.begin() as conn:
+        conn.execute(sa.insert(OrderStatus), [{"id": 1, "name": "Новий"}])
+        batch = []
+        for _ in range(orders_count):
+            batch.append({
+                "customer_name": f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}",
+                "phone_number": f"+380{rnd.choice(['67', '93', '50', '97'])}{rnd.randint(0, 9999999):07d}",
+                "products": "Піца x 1", "total_price": rnd.randint(100, 2000), "status_id": 1,
+            })
+            if len(batch) == 50000:
+                conn.execute(sa.insert(Order), batch)
+                batch.clear()
+        if batch:
+            conn.execute(sa.insert(Order), batch)
+        # Індекс будується одним проходом ('rebuild') після масового завантаження
+        search_index.create_search_index(conn)
+    return engine
+
+
+def measure(engine, q: str, use_fts: bool) -> list[float]:
+    search_index._fts_enabled = use_fts
+    # Той самий запит, що й перша сторінка /admin/orders з пошуком
+    query = (sa.select(Order).where(search_index.order_search_clause(q, limit=PER_PAGE + 1))
+             .order_by(Order.id.desc()).limit(PER_PAGE + 1))
+    timings = []
+    with Session(engine) as session:
+        for _ in range(REPEATS):
+            started = time.perf_counter()
+            session.execute(query).scalars().all()
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--db", default="/tmp/search_bench.db")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    started = time.perf_counter()
+    engine = fill_database(args.db, args.orders)
+    print(f"Згенеровано {args.orders} замовлень та індекс за {time.perf_counter() - started:.1f} с")
+
+    print(f"{'запит':<14}{'FTS p50':>10}{'FTS p95':>10}{'LIKE p50':>11}{'LIKE p95':>11}  (мс)")
+    for q in QUERIES:
+        fts = sorted(measure(engine, q, use_fts=True))
+        like = sorted(measure(engine, q, use_fts=False))
+        p95 = int(REPEATS * 0.95) - 1
+        print(f"{q:<14}{statistics.median(fts):>10.2f}{fts[p95]:>10.2f}{statistics.median(like):>11.2f}{like[p95]:>11.2f}")
+    engine.dispose()
+    os.remove(args.db)
+
+
+if __name__ == "__main__":
+    main()
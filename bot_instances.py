@@ -1,6 +1,75 @@
 # bot_instances.py
+import asyncio
+import logging
+
 from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+
+from reference_data import get_settings_snapshot
+
+logger = logging.getLogger(__name__)
 
 # Эти переменные будут инициализированы при старте в main.py
 bot: Bot | None = None
-admin_bot: Bot | None = None
\ No newline at end of file
+admin_bot: Bot | None = None
+
+# Токени, з якими створені поточні екземпляри
+_tokens: tuple[str | None, str | None] = (None, None)
+_lock = asyncio.Lock()
+
+
+def _create_bot(token: str | None) -> Bot | None:
+    return Bot(token=token, default=DefaultBotProperties(parse_mode=ParseMode.HTML)) if token else None
+
+
+async def setup_bots(client_token: str | None, admin_token: str | None) -> tuple[Bot | None, Bot | None]:
+    """
+    Повертає спільні екземпляри клієнтського та адмін-бота для цих токенів.
+    Кожен Bot тримає власну aiohttp-сесію з пулом з'єднань, тому екземпляри створюються заново
+    лише при зміні токена, а замінені закриваються.
+    """
+    global bot, admin_bot, _tokens
+    async with _lock:
+        if (client_token, admin_token) == _tokens:
+            return bot, admin_bot
+
+        old_client_token, old_admin_token = _tokens
+        replaced = []
+        if client_token != old_client_token:
+            replaced.append(bot)
+            bot = _create_bot(client_token)
+        if admin_token != old_admin_token:
+            replaced.append(admin_bot)
+            admin_bot = _create_bot(admin_token)
+        _tokens = (client_token, admin_token)
+
+        for old_bot in replaced:
+            if old_bot:
+                logger.info(f"Токен бота id={old_bot.id} змінено, створено новий екземпляр.")
+                await old_bot.session.close()
+        return bot, admin_bot
+
+
+async def get_bots() -> tuple[Bot | None, Bot | None]:
+    """Клієнтський та адмін-бот для HTTP-обробників (токени беруться з налаштувань у пам'яті)."""
+    settings = await get_settings_snapshot()
+    return await setup_bots(settings.client_bot_token, settings.admin_bot_token)
+
+
+async def get_admin_bot() -> Bot | None:
+    return (await get_bots())[1]
+
+
+async def get_client_bot() -> Bot | None:
+    return (await get_bots())[0]
+
+
+async def close_bots():
+    """Закриває сесії ботів при зупинці застосунку."""
+    global bot, admin_bot, _tokens
+    async with _lock:
+        for instance in (bot, admin_bot):
+            if instance:
+                await instance.session.close()
+        bot, admin_bot, _tokens = None, None, (None, None)
@@ -0,0 +1,147 @@
+# bot_webhook.py
+
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+# Режим отримання оновлень: "polling" (за замовчуванням) або "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Публічна HTTPS-адреса застосунку, на яку Telegram надсилатиме оновлення, напр. https://crm.example.com
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+# Якщо не задано, секрет виводиться з токена бота, тож він однаковий в усіх процесах
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Скільки оновлень обробляється одночасно (для обох ботів разом)
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "20"))
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+router = APIRouter()
+
+
+def webhook_mode_enabled() -> bool:
+    if BOT_MODE != "webhook":
+        return False
+    if not WEBHOOK_BASE_URL:
+        logger.error("BOT_MODE=webhook, але WEBHOOK_BASE_URL не задано. Боти працюватимуть через polling.")
+        return False
+    return True
+
+
+def _secret_token(bot_name: str, bot_token: str) -> str:
+    # Telegram дозволяє в секреті лише A-Z, a-z, 0-9, _ та -; hex-дайджест цьому відповідає
+    key = (WEBHOOK_SECRET or bot_token).encode()
+    return hmac.new(key, bot_name.encode(), hashlib.sha256).hexdigest()
+
+
+@dataclass
+class _WebhookTarget:
+    bot: Bot
+    dispatcher: Dispatcher
+    secret_token: str
+
+
+class WebhookProcessor:
+    """
+    Приймає оновлення від Telegram і передає їх у відповідний Dispatcher, не більше max_concurrency одночасно.
+    Поки є вільний слот, Telegram отримує відповідь одразу, а оновлення обробляється у фоні. Коли всі слоти
+    зайняті, оновлення обробляється в самому запиті: черга не росте в пам'яті, а якщо процес зупиниться,
+    Telegram не отримає 200 і надішле оновлення знову.
+    """
+    def __init__(self, max_concurrency: int = WEBHOOK_MAX_CONCURRENCY):
+        self._targets: Dict[str, _WebhookTarget] = {}
+        self._semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+        self._tasks: Set[asyncio.Task] = set()
+
+    def get(self, bot_name: str) -> Optional[_WebhookTarget]:
+        return self._targets.get(bot_name)
+
+    async def register(self, bot_name: str, bot: Bot, dispatcher: Dispatcher):
+        """Вмикає маршрут /tg/{bot_name}/webhook і повідомляє Telegram його адресу."""
+        target = _WebhookTarget(bot=bot, dispatcher=dispatcher, secret_token=_secret_token(bot_name, bot.token))
+        self._targets[bot_name] = target
+        # Оновлення, що накопичилися під час перезапуску, не відкидаються: їх обробить будь-який процес
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL}/tg/{bot_name}/webhook",
+            secret_token=target.secret_token,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            # Telegram приймає max_connections лише в межах 1–100, інакше set_webhook падає
+            max_connections=min(max(WEBHOOK_MAX_CONCURRENCY, 1), 100),
+        )
+        logger.info(f"Webhook для бота '{bot_name}' встановлено.")
+
+    async def handle(self, target: _WebhookTarget, update: Update):
+        if self._semaphore.locked():
+            async with self._semaphore:
+                await self._process(target, update)
+            return
+        # Слот вільний, тож acquire не чекає; фонове завдання звільнить його після обробки
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process_and_release(target, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process_and_release(self, target: _WebhookTarget, update: Update):
+        try:
+            await self._process(target, update)
+        finally:
+            self._semaphore.release()
+
+    async def _process(self, target: _WebhookTarget, update: Update):
+        try:
+            result = await target.dispatcher.feed_update(target.bot, update)
+            # Обробник може повернути метод API як відповідь на вебхук — виконуємо його самі
+            if isinstance(result, TelegramMethod):
+                await target.bot(result)
+        except Exception as e:
+            logger.error(f"Помилка обробки оновлення {update.update_id}: {e}", exc_info=True)
+
+    async def shutdown(self, timeout: float = 10):
+        """
+        Дає оновленням, що обробляються у фоні, завершитися. Нові запити отримують 404, і Telegram повторить їх
+        (іншому процесу чи після перезапуску). Webhook не видаляється — його обслуговують інші процеси.
+        """
+        self._targets.clear()
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            # На ці оновлення Telegram уже отримав 200, тож повторно їх не надішле
+            logger.warning(f"Перервано {len(pending)} необроблених оновлень: не завершилися за {timeout} с.")
+
+
+webhook_processor = WebhookProcessor()
+
+
+async def register_webhook(bot_name: str, bot: Bot, dispatcher: Dispatcher):
+    await webhook_processor.register(bot_name, bot, dispatcher)
+
+
+async def shutdown_webhooks():
+    await webhook_processor.shutdown()
+
+
+@router.post("/tg/{bot_name}/webhook")
+async def telegram_webhook(bot_name: str, request: Request):
+    target = webhook_processor.get(bot_name)
+    if target is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ""), target.secret_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    update = Update.model_validate(await request.json(), context={"bot": target.bot})
+    await webhook_processor.handle(target, update)
+    return JSONResponse(content={"ok": True})
@@ -0,0 +1,119 @@
+# cache_sync.py
+
+import asyncio
+import logging
+import os
+from typing import Callable, Dict, Optional, Set
+
+import sqlalchemy as sa
+
+from models import CacheVersion, async_session_maker
+
+logger = logging.getLogger(__name__)
+
+# Як швидко інші процеси (воркери uvicorn) дізнаються про зміни, зроблені в цьому процесі
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "2"))
+
+# Назва кешу → функція, що скидає його лише в цьому процесі
+_local_invalidators: Dict[str, Callable[[], None]] = {}
+_pending: Set[str] = set()
+_known_versions: Dict[str, int] = {}
+_wakeup: Optional[asyncio.Event] = None
+_sync_task: Optional[asyncio.Task] = None
+
+
+def register_cache(name: str, invalidate_local: Callable[[], None]):
+    """
+    Реєструє кеш у пам'яті процесу. invalidate_local має лише скидати кеш локально
+    і не викликати publish_invalidation, інакше процеси будуть скидати кеш один одному без кінця.
+    """
+    _local_invalidators[name] = invalidate_local
+
+
+def publish_invalidation(name: str):
+    """
+    Повідомляє інші процеси, що кеш name застарів (викликається після локального скидання).
+    Лічильник у БД оновлюється фоновим завданням, тож виклик не блокує обробник.
+    """
+    _pending.add(name)
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _publish_pending():
+    names = sorted(_pending)
+    _pending.difference_update(names)
+    new_versions = {}
+    try:
+        async with async_session_maker() as session:
+            for name in names:
+                new_version = await session.scalar(
+                    sa.update(CacheVersion).where(CacheVersion.name == name)
+                    .values(version=CacheVersion.version + 1).returning(CacheVersion.version)
+                )
+                if new_version is None:
+                    session.add(CacheVersion(name=name, version=1))
+                    new_version = 1
+                new_versions[name] = new_version
+            await session.commit()
+    except Exception:
+        # Напр. рядок одночасно створив інший процес — спробуємо ще раз на наступному циклі
+        _pending.update(names)
+        raise
+    # Власну зміну вже застосовано локально; якщо між нею та попередньою версією не було чужих, не скидаємо кеш вдруге
+    for name, new_version in new_versions.items():
+        if _known_versions.get(name) == new_version - 1:
+            _known_versions[name] = new_version
+
+
+async def _apply_remote_changes():
+    async with async_session_maker() as session:
+        versions = dict((await session.execute(sa.select(CacheVersion.name, CacheVersion.version))).all())
+    # Кеш, який ще ніхто не скидав, має версію 0: тоді перша публікація (рядок з версією 1) скине його й тут
+    for name in _local_invalidators:
+        versions.setdefault(name, 0)
+    for name, version in versions.items():
+        known = _known_versions.get(name)
+        _known_versions[name] = version
+        # При першому читанні лише запам'ятовуємо версію: кеш щойно завантажено з БД
+        if known is not None and known != version and name in _local_invalidators:
+            logger.info(f"Кеш '{name}' змінено в іншому процесі, скидаємо локальну копію.")
+            _local_invalidators[name]()
+
+
+async def _sync_loop():
+    while True:
+        try:
+            if _pending:
+                await _publish_pending()
+            await _apply_remote_changes()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Помилка синхронізації кешів: {e}", exc_info=True)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=CACHE_SYNC_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_cache_sync():
+    global _wakeup, _sync_task
+    _wakeup = asyncio.Event()
+    _sync_task = asyncio.create_task(_sync_loop())
+
+
+async def stop_cache_sync():
+    global _wakeup, _sync_task
+    if _sync_task is None:
+        return
+    _sync_task.cancel()
+    try:
+        await _sync_task
+    except asyncio.CancelledError:
+        pass
+    # Зміни, які ще не встигли записати, публікуємо перед зупинкою
+    if _pending:
+        await _publish_pending()
+    _wakeup, _sync_task = None, None
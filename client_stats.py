@@ -0,0 +1,193 @@
+# client_stats.py
+
+import asyncio
+import logging
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from models import ClientStat, Order, async_session_maker, create_db_tables, engine
+
+logger = logging.getLogger(__name__)
+
+# Поля замовлення, від яких залежать підсумки клієнта
+TRACKED_FIELDS = ("phone_number", "customer_name", "total_price")
+_OLD_ORDERS_KEY = "client_stats_old_orders"
+CHUNK_SIZE = 500
+
+
+def _upsert_statement():
+    """
+    Додає до підсумків клієнта приріст кількості та суми. Ім'я й час останнього замовлення
+    змінюються, лише якщо передане замовлення не старіше за збережене (last_order_id).
+    """
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Статистика клієнтів не підтримує БД {dialect}")
+    statement = insert(ClientStat)
+    excluded = statement.excluded
+    newer = sa.and_(excluded.last_order_id.isnot(None),
+                    sa.or_(ClientStat.last_order_id.is_(None), excluded.last_order_id >= ClientStat.last_order_id))
+    return statement.on_conflict_do_update(
+        index_elements=[ClientStat.phone_number],
+        set_={
+            "order_count": ClientStat.order_count + excluded.order_count,
+            "total_spent": ClientStat.total_spent + excluded.total_spent,
+            **{c: sa.case((newer, excluded[c]), else_=getattr(ClientStat, c)) for c in ("customer_name", "last_order_id", "last_order_at")},
+        },
+    )
+
+
+def _order_rows(connection, order_ids: Sequence[int], for_update: bool = False) -> List[Any]:
+    query = (
+        sa.select(Order.id, Order.phone_number, Order.customer_name, Order.total_price, Order.created_at)
+        .where(Order.id.in_(list(order_ids)))
+    )
+    if for_update:
+        # Паралельна транзакція, що змінює те саме замовлення, дочекається нашого коміту й прочитає нові значення
+        query = query.with_for_update()
+    return connection.execute(query).all()
+
+
+def _client_rows(connection, phones: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """Підсумки за замовленнями для вказаних телефонів (або для всіх). Телефони без замовлень у результат не потрапляють."""
+    query = (
+        sa.select(Order.phone_number, sa.func.count(Order.id).label("order_count"),
+                  sa.func.coalesce(sa.func.sum(Order.total_price), 0).label("total_spent"), sa.func.max(Order.id).label("last_order_id"))
+        .where(Order.phone_number.isnot(None))
+        .group_by(Order.phone_number)
+    )
+    if phones is not None:
+        query = query.where(Order.phone_number.in_(list(phones)))
+    totals = connection.execute(query).all()
+
+    # Ім'я та час беруться з останнього замовлення клієнта
+    latest = {}
+    last_ids = [row.last_order_id for row in totals]
+    for start in range(0, len(last_ids), CHUNK_SIZE):
+        latest.update((row.id, row) for row in connection.execute(
+            sa.select(Order.id, Order.customer_name, Order.created_at).where(Order.id.in_(last_ids[start:start + CHUNK_SIZE]))
+        ))
+    return [
+        {"phone_number": row.phone_number, "customer_name": latest[row.last_order_id].customer_name,
+         "order_count": row.order_count, "total_spent": row.total_spent,
+         "last_order_id": row.last_order_id, "last_order_at": latest[row.last_order_id].created_at}
+        for row in totals
+    ]
+
+
+@sa.event.listens_for(Session, "before_flush")
+def _capture_old_orders(session: Session, flush_context, instances):
+    """Запам'ятовує телефон і суму змінених і видалених замовлень до зміни (значення беруться з БД)."""
+    order_ids = [
+        obj.id for obj in session.dirty
+        if isinstance(obj, Order) and any(sa.inspect(obj).attrs[f].history.has_changes() for f in TRACKED_FIELDS)
+    ]
+    order_ids += [obj.id for obj in session.deleted if isinstance(obj, Order) and obj.id is not None]
+    if order_ids:
+        session.info[_OLD_ORDERS_KEY] = _order_rows(session.connection(), order_ids, for_update=True)
+
+
+@sa.event.listens_for(Session, "after_flush")
+def _apply_deltas(session: Session, flush_context):
+    """
+    Переносить замовлення між підсумками клієнтів у тій самій транзакції: -1 і сума зі старого телефону,
+    +1 і сума до нового. Приріст додається в БД (а не перезаписує підсумок), тож паралельні транзакції
+    для одного клієнта не гублять замовлень одна одної.
+    """
+    old_rows = [row for row in session.info.pop(_OLD_ORDERS_KEY, []) if row.phone_number]
+    deleted_ids = {obj.id for obj in session.deleted if isinstance(obj, Order)}
+    new_ids = [obj.id for obj in session.new if isinstance(obj, Order)]
+    new_ids += [obj.id for obj in session.dirty
+                if isinstance(obj, Order) and obj.id not in deleted_ids
+                and any(sa.inspect(obj).attrs[f].history.has_changes() for f in TRACKED_FIELDS)]
+    if not old_rows and not new_ids:
+        return
+
+    connection = session.connection()
+    new_rows = [row for row in _order_rows(connection, new_ids) if row.phone_number] if new_ids else []
+    new_phones = {row.id: row.phone_number for row in new_rows}
+
+    deltas: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"order_count": 0, "total_spent": 0, "latest": None})
+    # Клієнти, від яких пішло замовлення (видалено чи змінено телефон): можливо, це було їхнє останнє
+    recheck = set()
+    for row in old_rows:
+        delta = deltas[row.phone_number]
+        delta["order_count"] -= 1
+        delta["total_spent"] -= row.total_price or 0
+        if new_phones.get(row.id) != row.phone_number:
+            recheck.add(row.phone_number)
+    for row in new_rows:
+        delta = deltas[row.phone_number]
+        delta["order_count"] += 1
+        delta["total_spent"] += row.total_price or 0
+        if delta["latest"] is None or row.id > delta["latest"].id:
+            delta["latest"] = row
+
+    if not deltas:
+        return
+    values = []
+    for phone, delta in sorted(deltas.items()):
+        latest = delta["latest"]
+        values.append({
+            "phone_number": phone, "order_count": delta["order_count"], "total_spent": delta["total_spent"],
+            "customer_name": latest.customer_name if latest else None,
+            "last_order_id": latest.id if latest else None,
+            "last_order_at": latest.created_at if latest else None,
+        })
+    # Рядки upsert блокує в порядку телефонів, тож і перевірка нижче бачить їх уже заблокованими
+    connection.execute(_upsert_statement(), values)
+
+    for phone in sorted(recheck):
+        latest = connection.execute(
+            sa.select(Order.id, Order.customer_name, Order.created_at)
+            .where(Order.phone_number == phone).order_by(Order.id.desc()).limit(1)
+        ).first()
+        if latest is not None:
+            connection.execute(
+                sa.update(ClientStat).where(ClientStat.phone_number == phone)
+                .values(customer_name=latest.customer_name, last_order_id=latest.id, last_order_at=latest.created_at)
+            )
+    connection.execute(sa.delete(ClientStat).where(ClientStat.phone_number.in_(list(deltas)), ClientStat.order_count <= 0))
+
+
+@sa.event.listens_for(Session, "after_rollback")
+def _discard_old_orders(session: Session):
+    session.info.pop(_OLD_ORDERS_KEY, None)
+
+
+async def rebuild_client_stats() -> int:
+    """Заповнює client_stats з нуля за всіма замовленнями. Повертає кількість клієнтів."""
+    def _rebuild(session: Session) -> int:
+        connection = session.connection()
+        if engine.dialect.name == "postgresql":
+            connection.execute(sa.text("LOCK TABLE orders IN SHARE MODE"))
+        connection.execute(sa.delete(ClientStat))
+        rows = _client_rows(connection)
+        for start in range(0, len(rows), CHUNK_SIZE):
+            connection.execute(sa.insert(ClientStat), rows[start:start + CHUNK_SIZE])
+        return len(rows)
+
+    async with async_session_maker() as session:
+        count = await session.run_sync(_rebuild)
+        await session.commit()
+    logger.info(f"Статистику клієнтів перераховано: {count} клієнтів.")
+    return count
+
+
+if __name__ == "__main__":
+    # Використання: python client_stats.py — перерахувати підсумки клієнтів з нуля
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    async def _main():
+        await create_db_tables()
+        await rebuild_client_stats()
+
+    asyncio.run(_main())
@@ -2,6 +2,7 @@
 
 import logging
 import html as html_module
+from dataclasses import replace
 from aiogram import Dispatcher, F, html, Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
@@ -10,15 +11,19 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.filters import CommandStart
 from aiogram.exceptions import TelegramBadRequest
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_
+from sqlalchemy import select, update
 from sqlalchemy.orm import joinedload
 from typing import Dict, Any, Optional # Додано Optional
 from urllib.parse import quote_plus
 import re 
 
 # ЗМІНЕНО: Додано OrderStatusHistory, Table, Category, Product
-from models import Employee, Order, OrderStatus, Settings, OrderStatusHistory, Table, Category, Product
+from models import Employee, Order, OrderStatusHistory, Table, Category, Product
 from notification_manager import notify_all_parties_on_status_change
+from order_items import build_order_items, apply_order_items
+from notification_dispatcher import Notification, broadcast, send_notifications
+from staff_identity import StaffIdentity, get_staff, staff_cache
+from reference_data import get_settings_snapshot, get_visible_statuses, get_final_status_ids, get_status, get_status_by_name
 
 # НОВІ ІМПОРТИ
 from aiogram import html as aiogram_html
@@ -44,7 +49,7 @@ def get_staff_login_keyboard():
     return builder.as_markup(resize_keyboard=True)
 
 # НОВА ФУНКЦІЯ: Об'єднує кнопки всіх ролей (КУР'ЄР, ОФІЦІАНТ)
-def get_staff_keyboard(employee: Employee):
+def get_staff_keyboard(employee: StaffIdentity | Employee):
     builder = ReplyKeyboardBuilder()
     role = employee.role
     
@@ -76,14 +81,14 @@ def get_staff_keyboard(employee: Employee):
     
     return builder.as_markup(resize_keyboard=True)
 
-# ОНОВЛЕНІ ОБГОРТКИ: Тепер приймають Employee і викликають нову функцію
-def get_courier_keyboard(employee: Employee):
+# ОНОВЛЕНІ ОБГОРТКИ: Тепер приймають StaffIdentity і викликають нову функцію
+def get_courier_keyboard(employee: StaffIdentity | Employee):
     return get_staff_keyboard(employee)
 
-def get_operator_keyboard(employee: Employee):
+def get_operator_keyboard(employee: StaffIdentity | Employee):
     return get_staff_keyboard(employee)
 
-def get_waiter_keyboard(employee: Employee):
+def get_waiter_keyboard(employee: StaffIdentity | Employee):
     return get_staff_keyboard(employee)
 
 
@@ -91,15 +96,12 @@ async def show_courier_orders(message_or_callback: Message | CallbackQuery, sess
     user_id = message_or_callback.from_user.id
     message = message_or_callback.message if isinstance(message_or_callback, CallbackQuery) else message_or_callback
 
-    employee = await session.scalar(select(Employee).where(Employee.telegram_user_id == user_id).options(joinedload(Employee.role)))
+    employee = await get_staff(session, user_id)
     
     if not employee or not employee.role.can_be_assigned:
          return await message.answer("❌ У вас немає прав кур'єра.")
 
-    final_statuses_res = await session.execute(
-        select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True))
-    )
-    final_status_ids = final_statuses_res.scalars().all()
+    final_status_ids = await get_final_status_ids()
 
     orders_res = await session.execute(
         select(Order).options(joinedload(Order.status)).where(
@@ -148,9 +150,7 @@ async def show_waiter_tables(message_or_callback: Message | CallbackQuery, sessi
     # ДОДАНО: Очищуємо стан FSM (на випадок скасування створення замовлення)
     await state.clear()
     
-    employee = await session.scalar(
-        select(Employee).where(Employee.telegram_user_id == user_id).options(joinedload(Employee.role))
-    )
+    employee = await get_staff(session, user_id)
     
     if not employee or not employee.role.can_serve_tables:
         if is_callback:
@@ -195,9 +195,7 @@ async def show_waiter_tables(message_or_callback: Message | CallbackQuery, sessi
 # ОНОВЛЕНО: Використання get_staff_keyboard в start_handler
 async def start_handler(message: Message, state: FSMContext, session: AsyncSession, **kwargs: Dict[str, Any]):
     await state.clear()
-    employee = await session.scalar(
-        select(Employee).where(Employee.telegram_user_id == message.from_user.id).options(joinedload(Employee.role))
-    )
+    employee = await get_staff(session, message.from_user.id)
     if employee:
         keyboard = get_staff_keyboard(employee) # Використовуємо уніфіковану клавіатуру
         await message.answer(f"🎉 Доброго дня, {employee.full_name}! Ви увійшли в режим {employee.role.name}.",
@@ -230,10 +228,7 @@ async def _generate_waiter_order_view(order: Order, session: AsyncSession):
     if not order.accepted_by_waiter_id:
         kb.row(InlineKeyboardButton(text="✅ Прийняти це замовлення", callback_data=f"waiter_accept_order_{order.id}"))
 
-    statuses_res = await session.execute(
-        select(OrderStatus).where(OrderStatus.visible_to_waiter == True).order_by(OrderStatus.id)
-    )
-    statuses = statuses_res.scalars().all()
+    statuses = await get_visible_statuses("waiter")
     status_buttons = [
         InlineKeyboardButton(text=f"{'✅ ' if s.id == order.status_id else ''}{s.name}", callback_data=f"staff_set_status_{order.id}_{s.id}")
         for s in statuses
@@ -251,11 +246,8 @@ def register_courier_handlers(dp_admin: Dispatcher):
     dp_admin.message.register(start_handler, CommandStart())
 
     @dp_admin.message(F.text.in_({"🚚 Вхід кур'єра", "🔐 Вхід оператора", "🤵 Вхід офіціанта"}))
-    async def staff_login_start(message: Message, state: FSMContext, session: AsyncSession):
-        user_id = message.from_user.id
-        employee = await session.scalar(
-            select(Employee).where(Employee.telegram_user_id == user_id).options(joinedload(Employee.role))
-        )
+    async def staff_login_start(message: Message, state: FSMContext, staff: Optional[StaffIdentity]):
+        employee = staff
         if employee:
             return await message.answer(f"✅ Ви вже авторизовані як {employee.role.name}. Спочатку вийдіть із системи.", 
                                         reply_markup=get_staff_login_keyboard())
@@ -285,8 +277,11 @@ def register_courier_handlers(dp_admin: Dispatcher):
         }
         
         if role_checks.get(role_type, lambda e: False)(employee):
+            old_telegram_user_id = employee.telegram_user_id
             employee.telegram_user_id = message.from_user.id
             await session.commit()
+            staff_cache.invalidate(old_telegram_user_id)
+            staff_cache.invalidate(message.from_user.id)
             await state.clear()
             
             keyboard = get_staff_keyboard(employee) # Використовуємо уніфіковану клавіатуру
@@ -305,51 +300,41 @@ def register_courier_handlers(dp_admin: Dispatcher):
              await callback.message.answer("Авторизацію скасовано.", reply_markup=get_staff_login_keyboard())
     
     @dp_admin.message(F.text.in_({"🟢 Почати зміну", "🔴 Завершити зміну"}))
-    async def toggle_shift(message: Message, session: AsyncSession):
-        employee = await session.scalar(
-            select(Employee).where(Employee.telegram_user_id == message.from_user.id).options(joinedload(Employee.role))
-        )
-        if not employee: return
+    async def toggle_shift(message: Message, session: AsyncSession, staff: Optional[StaffIdentity]):
+        if not staff: return
         is_start = message.text.startswith("🟢")
-        if employee.is_on_shift == is_start:
+        if staff.is_on_shift == is_start:
             await message.answer(f"Ваш статус вже {'на зміні' if is_start else 'не на зміні'}.")
             return
 
-        employee.is_on_shift = is_start
+        await session.execute(update(Employee).where(Employee.id == staff.id).values(is_on_shift=is_start))
         await session.commit()
+        staff_cache.invalidate(message.from_user.id)
         
         action = "почали" if is_start else "завершили"
         
-        keyboard = get_staff_keyboard(employee) # Використовуємо уніфіковану клавіатуру
+        keyboard = get_staff_keyboard(replace(staff, is_on_shift=is_start)) # Використовуємо уніфіковану клавіатуру
         
         await message.answer(f"✅ Ви успішно {action} зміну.", reply_markup=keyboard)
 
 
     @dp_admin.message(F.text == "🚪 Вийти")
-    async def logout_handler(message: Message, session: AsyncSession):
-        employee = await session.scalar(
-            select(Employee).where(Employee.telegram_user_id == message.from_user.id)
-            .options(joinedload(Employee.role), joinedload(Employee.assigned_tables))
-        )
-        if employee:
-            employee.telegram_user_id = None
-            employee.is_on_shift = False
-            if employee.role.can_be_assigned:
-                 employee.current_order_id = None
-            if employee.role.can_serve_tables:
-                 # employee.assigned_tables.clear() # НЕПРАВИЛЬНО: Вихід з системи не повинен скасовувати призначення.
-                 pass
-
+    async def logout_handler(message: Message, session: AsyncSession, staff: Optional[StaffIdentity]):
+        if staff:
+            values = {"telegram_user_id": None, "is_on_shift": False}
+            if staff.role.can_be_assigned:
+                 values["current_order_id"] = None
+            # Вихід з системи не скасовує призначення офіціанта до столиків.
+            await session.execute(update(Employee).where(Employee.id == staff.id).values(**values))
             await session.commit()
+            staff_cache.invalidate(message.from_user.id)
             await message.answer("👋 Ви вийшли з системи.", reply_markup=get_staff_login_keyboard())
         else:
             await message.answer("❌ Ви не авторизовані.")
 
     @dp_admin.message(F.text.in_({"📦 Мої замовлення", "🍽 Мої столики"}))
-    async def handle_show_items_by_role(message: Message, session: AsyncSession, state: FSMContext, **kwargs: Dict[str, Any]): # Додано state
-        employee = await session.scalar(
-            select(Employee).where(Employee.telegram_user_id == message.from_user.id).options(joinedload(Employee.role))
-        )
+    async def handle_show_items_by_role(message: Message, session: AsyncSession, state: FSMContext, staff: Optional[StaffIdentity], **kwargs: Dict[str, Any]): # Додано state
+        employee = staff
         if not employee:
             return await message.answer("❌ Ви не авторизовані.")
 
@@ -377,10 +362,7 @@ def register_courier_handlers(dp_admin: Dispatcher):
                 f"Сума: {order.total_price} грн\n\n")
         
         kb = InlineKeyboardBuilder()
-        statuses_res = await session.execute(
-            select(OrderStatus).where(OrderStatus.visible_to_courier == True).order_by(OrderStatus.id)
-        )
-        courier_statuses = statuses_res.scalars().all()
+        courier_statuses = await get_visible_statuses("courier")
         
         status_buttons = [
             InlineKeyboardButton(text=status.name, callback_data=f"staff_set_status_{order.id}_{status.id}")
@@ -402,9 +384,9 @@ def register_courier_handlers(dp_admin: Dispatcher):
         await show_courier_orders(callback, session)
 
     @dp_admin.callback_query(F.data.startswith("staff_set_status_"))
-    async def staff_set_status(callback: CallbackQuery, session: AsyncSession, **kwargs: Dict[str, Any]):
+    async def staff_set_status(callback: CallbackQuery, session: AsyncSession, staff: Optional[StaffIdentity], **kwargs: Dict[str, Any]):
         client_bot = dp_admin.get("client_bot")
-        employee = await session.scalar(select(Employee).where(Employee.telegram_user_id == callback.from_user.id).options(joinedload(Employee.role)))
+        employee = staff
         actor_info = f"{employee.role.name}: {employee.full_name}" if employee else f"Співробітник (ID: {callback.from_user.id})"
         
         order_id, new_status_id = map(int, callback.data.split("_")[3:])
@@ -412,16 +394,19 @@ def register_courier_handlers(dp_admin: Dispatcher):
         order = await session.get(Order, order_id, options=[joinedload(Order.table)])
         if not order: return await callback.answer("Замовлення не знайдено.")
         
-        new_status = await session.get(OrderStatus, new_status_id)
+        new_status = await get_status(new_status_id)
         if not new_status: return await callback.answer(f"Помилка: Статус не знайдено.")
 
-        old_status_name = order.status.name if order.status else 'Невідомий'
+        old_status = await get_status(order.status_id)
+        old_status_name = old_status.name if old_status else 'Невідомий'
         order.status_id = new_status.id
         alert_text = f"Статус змінено: {new_status.name}"
 
         if new_status.is_completed_status or new_status.is_cancelled_status:
-            if employee and employee.current_order_id == order_id:
-                employee.current_order_id = None
+            if employee:
+                await session.execute(
+                    update(Employee).where(Employee.id == employee.id, Employee.current_order_id == order_id).values(current_order_id=None)
+                )
             if new_status.is_completed_status and order.courier_id:
                 order.completed_by_courier_id = order.courier_id
 
@@ -457,8 +442,7 @@ def register_courier_handlers(dp_admin: Dispatcher):
         if not table:
             return await callback.answer("Столик не знайдено!", show_alert=True)
 
-        final_statuses_res = await session.execute(select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True)))
-        final_statuses = final_statuses_res.scalars().all()
+        final_statuses = await get_final_status_ids()
         
         active_orders_res = await session.execute(select(Order).where(Order.table_id == table_id, Order.status_id.not_in(final_statuses)).options(joinedload(Order.status)))
         active_orders = active_orders_res.scalars().all()
@@ -521,12 +505,10 @@ def register_courier_handlers(dp_admin: Dispatcher):
         await callback.answer()
 
     @dp_admin.callback_query(F.data.startswith("waiter_accept_order_"))
-    async def waiter_accept_order(callback: CallbackQuery, session: AsyncSession):
+    async def waiter_accept_order(callback: CallbackQuery, session: AsyncSession, staff: Optional[StaffIdentity]):
         order_id = int(callback.data.split("_")[-1])
         
-        employee = await session.scalar(
-            select(Employee).where(Employee.telegram_user_id == callback.from_user.id)
-        )
+        employee = staff
         if not employee:
             return await callback.answer("Вас не знайдено в системі.", show_alert=True)
 
@@ -555,7 +537,7 @@ def register_courier_handlers(dp_admin: Dispatcher):
         
         processing_status = None
         try:
-            processing_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "В обробці").limit(1))
+            processing_status = await get_status_by_name("В обробці")
             if processing_status:
                 order.status_id = processing_status.id
                 session.add(OrderStatusHistory(
@@ -581,26 +563,25 @@ def register_courier_handlers(dp_admin: Dispatcher):
             if w.telegram_user_id and w.is_on_shift and w.id != employee.id:
                 target_chat_ids.add(w.telegram_user_id)
         
-        settings = await session.get(Settings, 1)
-        if settings and settings.admin_chat_id:
+        settings = await get_settings_snapshot()
+        if settings.admin_chat_id:
             try:
                 target_chat_ids.add(int(settings.admin_chat_id))
             except ValueError:
                 logger.warning(f"Некоректний admin_chat_id: {settings.admin_chat_id}")
             
-        for chat_id in target_chat_ids:
-            try:
-                await callback.bot.send_message(chat_id, notification_text)
-            except Exception as e:
-                logger.error(f"Не вдалося сповістити {chat_id} про прийняття замовлення #{order_id}: {e}")
+        notifications = [
+            Notification(callback.bot, chat_id, notification_text, label=f"про прийняття замовлення #{order_id}")
+            for chat_id in target_chat_ids
+        ]
 
         if processing_status and processing_status.notify_customer and order.user_id:
             client_bot = dp_admin.get("client_bot")
             if client_bot:
-                try:
-                    await client_bot.send_message(order.user_id, f"Ваше замовлення #{order.id} прийнято в обробку.")
-                except Exception as e:
-                    logger.error(f"Не вдалося сповістити клієнта {order.user_id} про прийняття замовлення: {e}")
+                notifications.append(Notification(client_bot, order.user_id, f"Ваше замовлення #{order.id} прийнято в обробку.",
+                                                  label="клієнту про прийняття замовлення"))
+
+        await send_notifications(notifications)
 
     # --- НОВІ ОБРОБНИКИ ДЛЯ FSM СТВОРЕННЯ ЗАМОВЛЕННЯ ---
 
@@ -757,7 +738,7 @@ def register_courier_handlers(dp_admin: Dispatcher):
         await _display_waiter_cart(callback, state, session)
 
     @dp_admin.callback_query(WaiterCreateOrderStates.managing_cart, F.data == "waiter_cart_finalize")
-    async def waiter_cart_finalize(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    async def waiter_cart_finalize(callback: CallbackQuery, state: FSMContext, session: AsyncSession, staff: Optional[StaffIdentity]):
         """Створення замовлення та збереження в БД."""
         data = await state.get_data()
         cart = data.get("cart", {})
@@ -767,21 +748,16 @@ def register_courier_handlers(dp_admin: Dispatcher):
         if not cart:
             return await callback.answer("Кошик порожній!", show_alert=True)
         
-        employee = await session.scalar(
-            select(Employee).where(Employee.telegram_user_id == callback.from_user.id)
-        )
+        employee = staff
         if not employee:
             return await callback.answer("Вас не знайдено в системі.", show_alert=True)
 
-        total_price = 0
-        product_strings = []
-        for item in cart.values():
-            total_price += item['price'] * item['quantity']
-            product_strings.append(f"{item['name']} x {item['quantity']}")
-        products_str = ", ".join(product_strings)
+        order_items = await build_order_items(session, {int(prod_id): item['quantity'] for prod_id, item in cart.items()})
+        if not order_items:
+            return await callback.answer("Страви з кошика більше недоступні.", show_alert=True)
 
         # Знаходимо статус "В обробці"
-        processing_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "В обробці").limit(1))
+        processing_status = await get_status_by_name("В обробці")
         status_id_to_set = processing_status.id if processing_status else 1 # Стандартно "Новий"
         actor_info = f"Офіціант (створив): {employee.full_name}"
 
@@ -789,8 +765,6 @@ def register_courier_handlers(dp_admin: Dispatcher):
             customer_name=f"Стіл: {table_name}",
             phone_number=f"table_{table_id}",
             address=None,
-            products=products_str,
-            total_price=total_price,
             is_delivery=False,
             delivery_time="In House",
             order_type="in_house",
@@ -798,6 +772,8 @@ def register_courier_handlers(dp_admin: Dispatcher):
             status_id=status_id_to_set, 
             accepted_by_waiter_id=employee.id # Приймається автоматично
         )
+        apply_order_items(order, order_items)
+        products_str, total_price = order.products, order.total_price
         session.add(order)
         await session.commit()
         await session.refresh(order)
@@ -816,8 +792,8 @@ def register_courier_handlers(dp_admin: Dispatcher):
         # Сповіщення в адмін-чат (кухню)
         admin_bot = dp_admin.get("bot_instance")
         if admin_bot:
-            settings = await session.get(Settings, 1)
-            if settings and settings.admin_chat_id:
+            settings = await get_settings_snapshot()
+            if settings.admin_chat_id:
                 try:
                     admin_chat_id = int(settings.admin_chat_id)
                     
@@ -832,13 +808,10 @@ def register_courier_handlers(dp_admin: Dispatcher):
                     kb_admin = InlineKeyboardBuilder()
                     kb_admin.row(InlineKeyboardButton(text="⚙️ Керувати замовленням", callback_data=f"waiter_manage_order_{order.id}"))
                     
-                    await admin_bot.send_message(
-                        admin_chat_id, 
-                        order_details_text,
-                        reply_markup=kb_admin.as_markup()
-                    )
-                except Exception as e:
-                    logger.error(f"Не вдалося надіслати сповіщення (від офіціанта) в адмін-чат {settings.admin_chat_id}: {e}")
+                    await broadcast(admin_bot, [admin_chat_id], order_details_text,
+                                    label="від офіціанта в адмін-чат", reply_markup=kb_admin.as_markup())
+                except ValueError:
+                    logger.error(f"Некоректний admin_chat_id: {settings.admin_chat_id}")
 
         # ВИПРАВЛЕНО: Повертаємо офіціанта до перегляду столика, передаючи table_id явно
         await state.clear()
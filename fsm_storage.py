@@ -0,0 +1,176 @@
+# fsm_storage.py
+
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Mapping, Optional
+
+import sqlalchemy as sa
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from models import FsmRecord, async_session_maker, engine
+
+logger = logging.getLogger(__name__)
+
+# Незавершене оформлення чи кошик офіціанта видаляються, якщо їх не чіпали стільки годин
+FSM_STATE_TTL_HOURS = int(os.getenv("FSM_STATE_TTL_HOURS", "24"))
+# Зміни за цей проміжок записуються в БД однією транзакцією
+FSM_FLUSH_DELAY = float(os.getenv("FSM_FLUSH_DELAY", "0.2"))
+FSM_PURGE_INTERVAL = 3600
+
+
+def _dumps(data: Mapping[str, Any]) -> Optional[str]:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")) if data else None
+
+
+@dataclass
+class _PendingRecord:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    # Лічильник змін: запис прибирається з пам'яті, лише якщо після збереження його не змінили знову
+    revision: int = 0
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """
+    FSM-сховище aiogram у таблиці fsm_states (SQLite або PostgreSQL — та сама БД, що й у застосунку).
+    Стан переживає перезапуск і доступний усім воркерам.
+
+    Записи не йдуть у БД на кожен set_state/update_data: змінені ключі тримаються в пам'яті
+    і зберігаються пакетом через FSM_FLUSH_DELAY секунд, тож кілька змін за одне оновлення —
+    це один upsert. Поки ключ не збережено, читання йде з пам'яті; інакше — один запит за первинним ключем.
+    """
+    def __init__(self, key_builder: Optional[KeyBuilder] = None, ttl_hours: int = FSM_STATE_TTL_HOURS,
+                 flush_delay: float = FSM_FLUSH_DELAY):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.ttl = timedelta(hours=ttl_hours)
+        self.flush_delay = flush_delay
+        self._pending: Dict[str, _PendingRecord] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._last_purge: Optional[datetime] = None
+
+    # --- BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record_for_update(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = await self._record_for_update(key)
+        record.data = data.copy()
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._load(key)).data.copy()
+
+    async def close(self) -> None:
+        """Зберігає незаписані зміни. Сховище лишається робочим (диспетчер викликає close при зупинці polling)."""
+        await self.flush()
+
+    # --- Внутрішня логіка ---
+
+    async def _load(self, key: StorageKey) -> _PendingRecord:
+        storage_key = self.key_builder.build(key)
+        pending = self._pending.get(storage_key)
+        if pending is not None:
+            return pending
+
+        async with async_session_maker() as session:
+            row = await session.get(FsmRecord, storage_key)
+        if row is None or row.expires_at < datetime.now():
+            return _PendingRecord()
+        return _PendingRecord(state=row.state, data=json.loads(row.data) if row.data else {})
+
+    async def _record_for_update(self, key: StorageKey) -> _PendingRecord:
+        storage_key = self.key_builder.build(key)
+        record = self._pending.get(storage_key)
+        if record is None:
+            record = await self._load(key)
+            # Поки читали з БД, ключ міг змінити інший обробник
+            record = self._pending.setdefault(storage_key, record)
+        return record
+
+    def _mark_dirty(self, key: StorageKey):
+        self._pending[self.key_builder.build(key)].revision += 1
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Поки це завдання живе, _mark_dirty нового не створює — тож зміни, що прийшли під час запису
+        # (або лишилися після помилки), зберігаємо тут же наступним циклом
+        while True:
+            await asyncio.sleep(self.flush_delay)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Не вдалося зберегти FSM-стани: {e}", exc_info=True)
+            if not self._pending:
+                return
+
+    async def flush(self):
+        """Записує всі змінені стани в БД однією транзакцією і видаляє прострочені."""
+        async with self._flush_lock:
+            batch = {k: (r.state, _dumps(r.data), r.revision) for k, r in self._pending.items()}
+            if batch:
+                await self._write(batch)
+                for storage_key, (_, _, revision) in batch.items():
+                    record = self._pending.get(storage_key)
+                    if record is not None and record.revision == revision:
+                        del self._pending[storage_key]
+
+            now = datetime.now()
+            if self._last_purge is None or now - self._last_purge > timedelta(seconds=FSM_PURGE_INTERVAL):
+                self._last_purge = now
+                await self._purge_expired(now)
+
+    async def _write(self, batch: Dict[str, tuple]):
+        now = datetime.now()
+        expires_at = now + self.ttl
+        upserts = [{"key": k, "state": state, "data": data, "updated_at": now, "expires_at": expires_at}
+                   for k, (state, data, _) in batch.items() if state is not None or data is not None]
+        # Порожній стан без даних (після state.clear()) просто видаляється
+        cleared = [k for k, (state, data, _) in batch.items() if state is None and data is None]
+
+        async with async_session_maker() as session:
+            if cleared:
+                await session.execute(sa.delete(FsmRecord).where(FsmRecord.key.in_(cleared)))
+            if upserts:
+                await session.execute(_upsert_statement(), upserts)
+            await session.commit()
+
+    async def _purge_expired(self, now: datetime):
+        async with async_session_maker() as session:
+            result = await session.execute(sa.delete(FsmRecord).where(FsmRecord.expires_at < now))
+            await session.commit()
+        if result.rowcount:
+            logger.info(f"Видалено {result.rowcount} покинутих FSM-станів.")
+
+
+def _upsert_statement():
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"FSM-сховище не підтримує БД {dialect}")
+    statement = insert(FsmRecord)
+    return statement.on_conflict_do_update(
+        index_elements=[FsmRecord.key],
+        set_={c: statement.excluded[c] for c in ("state", "data", "updated_at", "expires_at")},
+    )
+
+
+fsm_storage = SQLAlchemyStorage()
@@ -0,0 +1,132 @@
+# image_processing.py
+
+import asyncio
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any
+
+# Pillow вже потрібен для генерації QR-кодів; без нього просто зберігаємо оригінал
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Ширини похідних зображень. Картка товару має ширину ~280-400px,
+# тому найбільший варіант покриває екрани з подвійною щільністю пікселів.
+DERIVATIVE_WIDTHS = (320, 480, 720)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+# Підказка браузеру про ширину картки (див. .products-grid у templates.py); підставляється в атрибут sizes обох меню
+IMAGE_SIZES = "(max-width: 640px) 100vw, 400px"
+
+# Пул потоків для обробки зображень: Pillow звільняє GIL під час масштабування та кодування,
+# а event loop не блокується на завантаженні фото в адмінці.
+_executor = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="image-worker")
+
+
+def _derivative_path(source_path: str, width: int, ext: str) -> str:
+    base, _ = os.path.splitext(source_path)
+    return f"{base}_{width}w.{ext}"
+
+
+def _make_derivatives_sync(source_path: str) -> List[Dict[str, Any]]:
+    """Створює зменшені WebP/JPEG копії. Виконується в пулі потоків."""
+    variants = []
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "L"):
+            # JPEG не підтримує прозорість: накладаємо на білий фон
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+        elif image.mode == "L":
+            image = image.convert("RGB")
+
+        # Не збільшуємо маленькі фото: беремо лише ширини, не більші за оригінал
+        widths = [w for w in DERIVATIVE_WIDTHS if w <= image.width] or [image.width]
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+
+            webp_path = _derivative_path(source_path, width, "webp")
+            jpeg_path = _derivative_path(source_path, width, "jpg")
+            resized.save(webp_path, "WEBP", quality=WEBP_QUALITY, method=6)
+            resized.save(jpeg_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            variants.append({"width": width, "webp": webp_path, "jpeg": jpeg_path})
+    return variants
+
+
+async def generate_image_variants(source_path: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Генерує похідні зображення у фоновому пулі.
+    Повертає список варіантів для Product.image_variants або None, якщо обробка неможлива.
+    """
+    if Image is None:
+        logger.warning("Pillow не встановлено, похідні зображення не створюються.")
+        return None
+    if not source_path or not os.path.exists(source_path):
+        return None
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_executor, _make_derivatives_sync, source_path)
+    except Exception as e:
+        logger.error(f"Не вдалося створити похідні зображення для {source_path}: {e}")
+        return None
+
+
+def remove_image_files(image_url: Optional[str], variants: Optional[List[Dict[str, Any]]]):
+    """Видаляє оригінал та всі його похідні з диска."""
+    paths = [image_url] if image_url else []
+    for variant in variants or []:
+        paths.extend([variant.get("webp"), variant.get("jpeg")])
+    for path in paths:
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"Не вдалося видалити зображення {path}: {e}")
+
+
+def build_srcset(variants: Optional[List[Dict[str, Any]]], fmt: str) -> Optional[str]:
+    """Формує значення атрибута srcset ('/path 320w, ...') для формату 'webp' або 'jpeg'."""
+    if not variants:
+        return None
+    return ", ".join(f"/{v[fmt]} {v['width']}w" for v in variants if v.get(fmt))
+
+
+async def backfill_product_images():
+    """Створює похідні для всіх товарів, у яких є фото, але ще немає варіантів."""
+    from sqlalchemy import select
+    from models import Product, async_session_maker, create_db_tables
+
+    await create_db_tables()
+    processed = 0
+    async with async_session_maker() as session:
+        products_res = await session.execute(
+            select(Product).where(Product.image_url.is_not(None), Product.image_variants.is_(None))
+        )
+        for product in products_res.scalars().all():
+            variants = await generate_image_variants(product.image_url)
+            if variants:
+                product.image_variants = variants
+                processed += 1
+                await session.commit()
+                logger.info(f"Оброблено зображення страви #{product.id}: {product.image_url}")
+    logger.info(f"Готово. Оброблено зображень: {processed}. Перезапустіть веб-сервер, щоб оновити кеш меню.")
+
+
+if __name__ == "__main__":
+    # Використання: python image_processing.py backfill
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        asyncio.run(backfill_product_images())
+    else:
+        print("Використання: python image_processing.py backfill")
@@ -0,0 +1,129 @@
+# leader_election.py
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from models import WorkerLease, async_session_maker
+
+logger = logging.getLogger(__name__)
+
+# Якщо лідер не продовжив оренду за цей час (процес впав чи завис), її забирає інший воркер
+LEADER_LEASE_TTL = int(os.getenv("LEADER_LEASE_TTL", "30"))
+LEADER_RENEW_INTERVAL = LEADER_LEASE_TTL / 3
+# Пауза перед повторним запуском роботи, що завершилася сама (напр. не задано токени ботів або polling впав)
+LEADER_JOB_RESTART_DELAY = int(os.getenv("LEADER_JOB_RESTART_DELAY", "30"))
+
+
+class LeaderLease:
+    """
+    Оренда в таблиці worker_leases: лише процес, що її тримає, виконує роль name.
+    Захоплення та продовження — один умовний UPDATE, тому двоє воркерів не можуть стати лідерами одночасно.
+    Час береться з годинника процесу, тож воркери мають працювати на одному сервері або з синхронізованим часом.
+    """
+    def __init__(self, name: str, ttl: int = LEADER_LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # До якого часу оренда точно наша (за останнім успішним продовженням)
+        self.held_until: Optional[datetime] = None
+
+    async def try_acquire(self) -> bool:
+        """Захоплює вільну чи прострочену оренду або продовжує власну. Повертає True, якщо процес — лідер."""
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=self.ttl)
+        async with async_session_maker() as session:
+            result = await session.execute(
+                sa.update(WorkerLease)
+                .where(WorkerLease.name == self.name,
+                       sa.or_(WorkerLease.holder == self.holder, WorkerLease.expires_at < now))
+                .values(holder=self.holder, expires_at=expires_at)
+            )
+            if result.rowcount:
+                await session.commit()
+                self.held_until = expires_at
+                return True
+
+            if await session.get(WorkerLease, self.name):
+                return False
+            session.add(WorkerLease(name=self.name, holder=self.holder, expires_at=expires_at))
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Інший воркер створив оренду раніше
+                await session.rollback()
+                return False
+            self.held_until = expires_at
+            return True
+
+    async def release(self):
+        """Звільняє оренду, щоб інший воркер перейняв роль одразу, а не після закінчення TTL."""
+        async with async_session_maker() as session:
+            await session.execute(
+                sa.update(WorkerLease)
+                .where(WorkerLease.name == self.name, WorkerLease.holder == self.holder)
+                .values(expires_at=datetime.now())
+            )
+            await session.commit()
+
+
+async def run_as_leader(lease: LeaderLease, job: Callable[[], Awaitable[None]]):
+    """
+    Запускає job, лише поки цей процес тримає оренду. Якщо оренду втрачено (напр. процес не зміг
+    продовжити її вчасно), job скасовується, а воркер знову чекає на свою чергу.
+    Якщо job завершився сам, оренда звільняється, а спроба повторюється через LEADER_JOB_RESTART_DELAY.
+    """
+    task: Optional[asyncio.Task] = None
+    restart_after: Optional[datetime] = None
+    try:
+        while True:
+            if task is not None and task.done():
+                error = None if task.cancelled() else task.exception()
+                if error is not None:
+                    logger.error(f"Робота '{lease.name}' завершилася з помилкою: {error}", exc_info=error)
+                else:
+                    logger.warning(f"Робота '{lease.name}' завершилася; повторний запуск через {LEADER_JOB_RESTART_DELAY} с.")
+                task = None
+                # Звільняємо оренду, щоб роль міг перейняти інший воркер, а цей спробує знову після паузи
+                try:
+                    await lease.release()
+                except Exception as e:
+                    logger.warning(f"Не вдалося звільнити оренду '{lease.name}': {e}")
+                restart_after = datetime.now() + timedelta(seconds=LEADER_JOB_RESTART_DELAY)
+
+            if restart_after is not None and datetime.now() < restart_after:
+                await asyncio.sleep(LEADER_RENEW_INTERVAL)
+                continue
+
+            try:
+                is_leader = await lease.try_acquire()
+            except Exception as e:
+                logger.error(f"Не вдалося оновити оренду '{lease.name}': {e}")
+                # Короткий збій БД не зупиняє лідера, поки його оренда ще не скінчилася
+                is_leader = task is not None and lease.held_until is not None and datetime.now() < lease.held_until
+
+            if is_leader and task is None:
+                logger.info(f"Процес {lease.holder} став лідером '{lease.name}'.")
+                task = asyncio.create_task(job())
+            elif not is_leader and task is not None:
+                logger.warning(f"Процес {lease.holder} втратив лідерство '{lease.name}', зупиняємо роботу.")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                task = None
+
+            await asyncio.sleep(LEADER_RENEW_INTERVAL)
+    finally:
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            try:
+                await lease.release()
+            except Exception as e:
+                logger.warning(f"Не вдалося звільнити оренду '{lease.name}': {e}")
@@ -22,11 +22,10 @@ from fastapi.staticfiles import StaticFiles
 import uvicorn
 
 # --- Aiogram ---
-from aiogram import Bot, Dispatcher, F
-from aiogram.client.default import DefaultBotProperties
+from aiogram import Dispatcher, F
 from aiogram.enums import ParseMode, ChatAction
 from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, FSInputFile, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
@@ -36,12 +35,12 @@ from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 import sqlalchemy as sa
-from sqlalchemy import func, and_
+from sqlalchemy import func
 
 # --- Локальні імпорти ---
 from templates import ADMIN_HTML_TEMPLATE, WEB_ORDER_HTML, ADMIN_EMPLOYEE_BODY, ADMIN_ROLES_BODY, ADMIN_REPORTS_BODY, ADMIN_ORDER_FORM_BODY, ADMIN_SETTINGS_BODY, ADMIN_MENU_BODY, ADMIN_ORDER_MANAGE_BODY, ADMIN_TABLES_BODY
 from models import *
-from admin_handlers import register_admin_handlers, parse_products_string
+from admin_handlers import register_admin_handlers
 from courier_handlers import register_courier_handlers
 from notification_manager import notify_new_order_to_staff
 from admin_clients import router as clients_router
@@ -49,19 +48,31 @@ from dependencies import get_db_session, check_credentials
 # --- НОВІ ІМПОРТИ ---
 from admin_order_management import router as admin_order_router
 from admin_tables import router as admin_tables_router
+from admin_r_keeper import router as admin_r_keeper_router
+from admin_exports import router as admin_exports_router
+from admin_sla import router as admin_sla_router
+from r_keeper_sync import start_menu_sync, stop_menu_sync
 from in_house_menu import router as in_house_menu_router
+from image_processing import IMAGE_SIZES, generate_image_variants, remove_image_files
+from menu_cache import get_menu_snapshot, invalidate_menu_cache, invalidate_table_pages, build_menu_response, MENU_VIEW_DELIVERY
+from telegram_media import send_photo_cached, forget_photo
+from pagination import keyset_paginate, count_cache, render_keyset_pagination
+from search_index import init_search_index, order_search_clause, product_search_clause
+from order_items import build_order_items, apply_order_items, quantities_from_items
+from migrations import run_migrations
+import order_stats  # Також реєструє слухачі сесії, що оновлюють order_daily_stats при зміні замовлень
+import client_stats  # noqa: F401 — слухачі сесії для client_stats
+from bot_instances import setup_bots, get_admin_bot, close_bots
+from bot_webhook import router as bot_webhook_router, webhook_mode_enabled, register_webhook, shutdown_webhooks
+from cache_sync import start_cache_sync, stop_cache_sync
+from leader_election import LeaderLease, run_as_leader
+from fsm_storage import fsm_storage
+from outbox import enqueue_new_order_events, start_outbox_workers, stop_outbox_workers
+from staff_identity import StaffIdentityMiddleware, staff_cache
+from reference_data import (load_reference_data, get_settings_snapshot, get_completed_status_ids, get_status_by_name,
+                            invalidate_statuses, invalidate_roles, invalidate_settings)
 # -----------------------------------------------
 
-# --- Інтеграція з R-Keeper ---
-try:
-    from r_keeper import RKeeperAPI
-except ImportError:
-    class RKeeperAPI:
-        def __init__(self, settings): pass
-        async def send_order(self, order, items):
-            logging.warning("r_keeper.py не знайдено, інтеграція з R-Keeper вимкнена.")
-            pass
-
 # --- КОНФІГУРАЦІЯ ---
 load_dotenv()
 PRODUCTS_PER_PAGE = 5
@@ -76,8 +87,9 @@ class CheckoutStates(StatesGroup):
     waiting_for_specific_time = State()
 
 # --- TELEGRAM БОТИ ---
-dp = Dispatcher()
-dp_admin = Dispatcher()
+# FSM-стан зберігається в БД: оформлення замовлення переживає перезапуск і доступне всім воркерам
+dp = Dispatcher(storage=fsm_storage)
+dp_admin = Dispatcher(storage=fsm_storage)
 
 async def get_main_reply_keyboard(session: AsyncSession):
     builder = ReplyKeyboardBuilder()
@@ -124,7 +136,7 @@ async def command_start_handler(message: Message, state: FSMContext, session: As
     welcome_photo_url = 'https://i.postimg.cc/4y2BL0ck/14e9a2ee-449d-4881-ac89-c2b42b51abc0.jpg'
     caption = f"Шановний {html.escape(message.from_user.full_name)}, ласкаво просимо до ресторану Дайберг! 👋\n\nМи раді вас бачити. Оберіть опцію:"
     keyboard = await get_main_reply_keyboard(session)
-    await message.answer_photo(photo=welcome_photo_url, caption=caption, reply_markup=keyboard)
+    await send_photo_cached(message.bot, message.chat.id, welcome_photo_url, caption=caption, reply_markup=keyboard)
 
 
 @dp.message(F.text == "🍽️ Меню")
@@ -163,7 +175,7 @@ async def back_to_start_menu(callback: CallbackQuery, state: FSMContext, session
     welcome_photo_url = 'https://i.postimg.cc/4y2BL0ck/14e9a2ee-449d-4881-ac89-c2b42b51abc0.jpg'
     caption = f"Шановний {html.escape(callback.from_user.full_name)}, ласкаво просимо до ресторану Дайберг! 👋\n\nМи раді вас бачити. Оберіть опцію:"
     keyboard = await get_main_reply_keyboard(session)
-    await callback.message.answer_photo(photo=welcome_photo_url, caption=caption, reply_markup=keyboard)
+    await send_photo_cached(callback.bot, callback.message.chat.id, welcome_photo_url, caption=caption, reply_markup=keyboard)
     await callback.answer()
 
 async def show_my_orders(message_or_callback: Message | CallbackQuery, session: AsyncSession):
@@ -295,11 +307,6 @@ async def show_category_paginated(callback: CallbackQuery, session: AsyncSession
         else:
             logging.error(f"Неочікувана помилка TelegramBadRequest у show_category_paginated: {e}")
 
-async def get_photo_input(image_url: str):
-    if image_url and os.path.exists(image_url) and os.path.getsize(image_url) > 0:
-        return FSInputFile(image_url)
-    return None
-
 @dp.callback_query(F.data.startswith("show_product_"))
 async def show_product(callback: CallbackQuery, session: AsyncSession):
     await callback.answer("⏳ Завантаження...")
@@ -319,15 +326,13 @@ async def show_product(callback: CallbackQuery, session: AsyncSession):
     kb.add(InlineKeyboardButton(text="⬅️ Назад до страв", callback_data=f"show_category_{product.category_id}_1"))
     kb.adjust(1)
 
-    photo_input = await get_photo_input(product.image_url)
     try:
         await callback.message.delete()
     except TelegramBadRequest as e:
         logging.warning(f"Не вдалося видалити повідомлення в show_product: {e}")
 
-    if photo_input:
-        await callback.message.answer_photo(photo=photo_input, caption=text, reply_markup=kb.as_markup())
-    else:
+    sent = await send_photo_cached(callback.bot, callback.message.chat.id, product.image_url, caption=text, reply_markup=kb.as_markup())
+    if not sent:
         await callback.message.answer(text, reply_markup=kb.as_markup())
 
 @dp.callback_query(F.data.startswith("add_to_cart_"))
@@ -596,21 +601,14 @@ async def process_specific_time(message: Message, state: FSMContext, session: As
 async def finalize_order(message: Message, state: FSMContext, session: AsyncSession):
     data = await state.get_data()
     user_id = data.get('user_id')
-    admin_bot = dp_admin.get("bot_instance")
 
-    cart_items_for_rkeeper = []
+    order_items = []
     if user_id:
         cart_items_res = await session.execute(
             sa.select(CartItem).options(joinedload(CartItem.product)).where(CartItem.user_id == user_id)
         )
         cart_items = cart_items_res.scalars().all()
-        for item in cart_items:
-            if item.product and item.product.r_keeper_id:
-                cart_items_for_rkeeper.append({
-                    "r_keeper_id": item.product.r_keeper_id,
-                    "quantity": item.quantity,
-                    "price": item.product.price
-                })
+        order_items = await build_order_items(session, {item.product_id: item.quantity for item in cart_items if item.product})
 
     order = Order(
         user_id=data['user_id'], username=data.get('username'), products=data['products'],
@@ -620,6 +618,9 @@ async def finalize_order(message: Message, state: FSMContext, session: AsyncSess
         delivery_time=data.get('delivery_time', 'Якнайшвидше'),
         order_type=data.get('order_type', 'delivery')
     )
+    # Склад береться з кошика на момент оформлення; рядок з FSM лишається запасним варіантом
+    if order_items:
+        apply_order_items(order, order_items)
     session.add(order)
 
     if user_id:
@@ -632,19 +633,9 @@ async def finalize_order(message: Message, state: FSMContext, session: AsyncSess
             customer.address = data.get('address')
         await session.execute(sa.delete(CartItem).where(CartItem.user_id == user_id))
 
+    # Сповіщення персоналу та R-Keeper обробляють фонові воркери після commit (див. outbox.py)
+    await enqueue_new_order_events(session, order)
     await session.commit()
-    await session.refresh(order)
-
-    try:
-        settings = await get_settings(session)
-        if settings.r_keeper_enabled and cart_items_for_rkeeper:
-            api = RKeeperAPI(settings)
-            await api.send_order(order, cart_items_for_rkeeper)
-    except Exception as e:
-        logging.error(f"Не вдалося надіслати замовлення #{order.id} в R-Keeper: {e}")
-
-    if admin_bot:
-        await notify_new_order_to_staff(admin_bot, order, session)
 
     await message.answer("Шановний клієнте, ваше замовлення оформлено! Дякуємо за вибір ресторану Дайберг. Смачного!")
 
@@ -659,8 +650,8 @@ async def start_bot(client_dp: Dispatcher, admin_dp: Dispatcher):
                 logging.warning("Токени ботів не встановлені в базі даних. Боти не будуть запущені.")
                 return
 
-            bot = Bot(token=settings.client_bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-            admin_bot = Bot(token=settings.admin_bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+            # Ті самі екземпляри використовують HTTP-обробники (див. bot_instances.py)
+            bot, admin_bot = await setup_bots(settings.client_bot_token, settings.admin_bot_token)
 
             admin_dp["client_bot"] = bot
             admin_dp["bot_instance"] = admin_bot
@@ -668,15 +659,27 @@ async def start_bot(client_dp: Dispatcher, admin_dp: Dispatcher):
             client_dp["session_factory"] = async_session_maker
             admin_dp["session_factory"] = async_session_maker
 
+        # Воркер, що знову став лідером, запускає ботів повторно — обробники реєструються лише раз
+        if not admin_dp.get("handlers_registered"):
             client_dp.message.register(handle_dynamic_menu_item, F.text)
-
-        register_admin_handlers(admin_dp)
-        register_courier_handlers(admin_dp)
-
-        client_dp.callback_query.middleware(DbSessionMiddleware(session_pool=async_session_maker))
-        client_dp.message.middleware(DbSessionMiddleware(session_pool=async_session_maker))
-        admin_dp.callback_query.middleware(DbSessionMiddleware(session_pool=async_session_maker))
-        admin_dp.message.middleware(DbSessionMiddleware(session_pool=async_session_maker))
+            register_admin_handlers(admin_dp)
+            register_courier_handlers(admin_dp)
+
+            client_dp.callback_query.middleware(DbSessionMiddleware(session_pool=async_session_maker))
+            client_dp.message.middleware(DbSessionMiddleware(session_pool=async_session_maker))
+            admin_dp.callback_query.middleware(DbSessionMiddleware(session_pool=async_session_maker))
+            admin_dp.message.middleware(DbSessionMiddleware(session_pool=async_session_maker))
+            # Співробітник визначається один раз на оновлення (з кешу) і передається в обробники як `staff`
+            admin_dp.callback_query.middleware(StaffIdentityMiddleware())
+            admin_dp.message.middleware(StaffIdentityMiddleware())
+            admin_dp["handlers_registered"] = True
+
+        if webhook_mode_enabled():
+            # Оновлення приходять на /tg/{client|admin}/webhook цього ж застосунку (див. bot_webhook.py)
+            await register_webhook("client", bot, client_dp)
+            await register_webhook("admin", admin_bot, admin_dp)
+            logging.info("Боти працюють через webhook.")
+            return
 
         await bot.delete_webhook(drop_pending_updates=True)
         await admin_bot.delete_webhook(drop_pending_updates=True)
@@ -695,14 +698,31 @@ async def lifespan(app: FastAPI):
     os.makedirs("static/images", exist_ok=True)
     os.makedirs("static/favicons", exist_ok=True)
     await create_db_tables()
-    bot_task = asyncio.create_task(start_bot(dp, dp_admin))
+    await run_migrations()
+    await load_reference_data()
+    await init_search_index()
+    start_outbox_workers()
+    start_cache_sync()
+    start_menu_sync()
+    if webhook_mode_enabled():
+        # Вебхуки приймає кожен воркер, тож кожен готує власні диспетчери
+        bot_task = asyncio.create_task(start_bot(dp, dp_admin))
+    else:
+        # getUpdates дозволено лише одному процесу: опитує Telegram лише воркер-лідер
+        bot_task = asyncio.create_task(run_as_leader(LeaderLease("bot_polling"), lambda: start_bot(dp, dp_admin)))
     yield
     logging.info("Зупинка...")
+    await stop_menu_sync()
+    await stop_outbox_workers()
     bot_task.cancel()
     try:
         await bot_task
     except asyncio.CancelledError:
         logging.info("Завдання бота успішно скасовано.")
+    await shutdown_webhooks()
+    await fsm_storage.close()
+    await stop_cache_sync()
+    await close_bots()
 
 app = FastAPI(lifespan=lifespan)
 os.makedirs("static", exist_ok=True)
@@ -713,6 +733,10 @@ app.include_router(in_house_menu_router) # Для QR-меню
 app.include_router(clients_router)
 app.include_router(admin_order_router)
 app.include_router(admin_tables_router) # Для адмінки столиків
+app.include_router(bot_webhook_router) # Оновлення Telegram у режимі webhook
+app.include_router(admin_r_keeper_router) # Черга відправки в R-Keeper
+app.include_router(admin_exports_router) # Вивантаження в CSV/XLSX
+app.include_router(admin_sla_router) # Звіт про тривалість етапів замовлень
 # ------------------------------------
 
 class DbSessionMiddleware:
@@ -725,7 +749,7 @@ class DbSessionMiddleware:
 # --- FastAPI ендпоінти ---
 @app.get("/", response_class=HTMLResponse)
 async def get_web_ordering_page(session: AsyncSession = Depends(get_db_session)):
-    settings = await get_settings(session)
+    settings = await get_settings_snapshot()
     logo_html = f'<img src="/{settings.logo_url}" alt="Логотип" class="header-logo">' if settings.logo_url else ''
 
     menu_items_res = await session.execute(
@@ -736,7 +760,7 @@ async def get_web_ordering_page(session: AsyncSession = Depends(get_db_session))
         [f'<a href="#" class="menu-popup-trigger" data-item-id="{item.id}">{html.escape(item.title)}</a>' for item in menu_items]
     )
 
-    return HTMLResponse(content=WEB_ORDER_HTML.format(logo_html=logo_html, menu_links_html=menu_links_html))
+    return HTMLResponse(content=WEB_ORDER_HTML.format(logo_html=logo_html, menu_links_html=menu_links_html, image_sizes=IMAGE_SIZES))
 
 
 @app.get("/api/page/{item_id}", response_class=JSONResponse)
@@ -748,24 +772,11 @@ async def get_menu_page_content(item_id: int, session: AsyncSession = Depends(ge
 
 # --- ИСПРАВЛЕННАЯ ФУНКЦИЯ /api/menu ---
 @app.get("/api/menu")
-async def get_menu_data(session: AsyncSession = Depends(get_db_session)):
-    # Добавлено .where(Category.show_on_delivery_site == True)
-    categories_res = await session.execute(
-        sa.select(Category)
-        .where(Category.show_on_delivery_site == True)
-        .order_by(Category.sort_order, Category.name)
-    )
-    # Добавлено join и фильтрация
-    products_res = await session.execute(
-        sa.select(Product)
-        .join(Category, Product.category_id == Category.id)
-        .where(Product.is_active == True, Category.show_on_delivery_site == True)
-    )
-
-    categories = [{"id": c.id, "name": c.name} for c in categories_res.scalars().all()]
-    products = [{"id": p.id, "name": p.name, "description": p.description, "price": p.price, "image_url": p.image_url, "category_id": p.category_id} for p in products_res.scalars().all()]
-
-    return {"categories": categories, "products": products}
+async def get_menu_data(request: Request, session: AsyncSession = Depends(get_db_session)):
+    # Меню береться зі знімка в пам'яті, БД читається лише після змін каталогу.
+    # Тіло вже серіалізоване та стиснене, повторні запити отримують 304 за ETag.
+    snapshot = await get_menu_snapshot(session, MENU_VIEW_DELIVERY)
+    return build_menu_response(request, snapshot)
 # --- КОНЕЦ ИСПРАВЛЕНИЯ /api/menu ---
 
 @app.get("/api/customer_info/{phone_number}")
@@ -784,8 +795,10 @@ async def place_web_order(order_data: dict = Body(...), session: AsyncSession =
     if not items:
         raise HTTPException(status_code=400, detail="Кошик порожній")
 
-    total_price = sum(item['price'] * item['quantity'] for item in items)
-    products_str = ", ".join([f"{item['name']} x {item['quantity']}" for item in items])
+    # Назви та ціни беремо з БД, а не з кошика браузера
+    order_items = await build_order_items(session, quantities_from_items(items))
+    if not order_items:
+        raise HTTPException(status_code=400, detail="Страви з кошика не знайдено")
 
     is_delivery = order_data.get('is_delivery', True)
     address = order_data.get('address') if is_delivery else None
@@ -793,33 +806,15 @@ async def place_web_order(order_data: dict = Body(...), session: AsyncSession =
 
     order = Order(
         customer_name=order_data.get('customer_name'), phone_number=order_data.get('phone_number'),
-        address=address, products=products_str, total_price=total_price,
+        address=address,
         is_delivery=is_delivery, delivery_time=order_data.get('delivery_time', "Якнайшвидше"),
         order_type=order_type
     )
+    apply_order_items(order, order_items)
     session.add(order)
+    # Відповідь не чекає на Telegram і R-Keeper: події обробляються фоновими воркерами (див. outbox.py)
+    await enqueue_new_order_events(session, order)
     await session.commit()
-    await session.refresh(order)
-
-    admin_bot = dp_admin.get("bot_instance")
-    if admin_bot:
-        await notify_new_order_to_staff(admin_bot, order, session)
-
-    try:
-        settings = await get_settings(session)
-        if settings.r_keeper_enabled:
-            product_ids = [item['id'] for item in items]
-            products_res = await session.execute(sa.select(Product).where(Product.id.in_(product_ids)))
-            products_map = {str(p.id): p for p in products_res.scalars().all()}
-            items_for_rkeeper = [
-                {"r_keeper_id": products_map.get(str(item['id'])).r_keeper_id, "quantity": item['quantity'], "price": item['price']}
-                for item in items if products_map.get(str(item['id'])) and products_map.get(str(item['id'])).r_keeper_id
-            ]
-            if items_for_rkeeper:
-                api = RKeeperAPI(settings)
-                await api.send_order(order, items_for_rkeeper)
-    except Exception as e:
-        logging.error(f"Не вдалося надіслати веб-замовлення #{order.id} в R-Keeper: {e}")
 
     return JSONResponse(content={"message": "Замовлення успішно розміщено", "order_id": order.id})
 
@@ -827,7 +822,7 @@ async def place_web_order(order_data: dict = Body(...), session: AsyncSession =
 @app.get("/admin", response_class=HTMLResponse)
 async def admin_dashboard(session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
     orders_res = await session.execute(sa.select(Order).order_by(Order.id.desc()).limit(5))
-    orders_count_res = await session.execute(sa.select(sa.func.count(Order.id)))
+    orders_count_res = await session.execute(sa.select(sa.func.sum(OrderDailyStat.orders)))
     products_count_res = await session.execute(sa.select(sa.func.count(Product.id)))
     orders_count = orders_count_res.scalar_one_or_none() or 0
     products_count = products_count_res.scalar_one_or_none() or 0
@@ -848,20 +843,16 @@ async def admin_dashboard(session: AsyncSession = Depends(get_db_session), usern
 
 # --- ИСПРАВЛЕННАЯ ФУНКЦИЯ admin_products ---
 @app.get("/admin/products", response_class=HTMLResponse)
-async def admin_products(page: int = Query(1, ge=1), q: str = Query(None, alias="search"), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+async def admin_products(after: Optional[int] = Query(None), before: Optional[int] = Query(None), q: str = Query(None, alias="search"), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
     per_page = 10
-    offset = (page - 1) * per_page
 
-    query = sa.select(Product).options(joinedload(Product.category)).order_by(Product.id.desc())
+    query = sa.select(Product).options(joinedload(Product.category))
     if q:
-        query = query.where(Product.name.ilike(f"%{q}%"))
+        query = query.where(product_search_clause(q))
 
-    total_res = await session.execute(sa.select(sa.func.count()).select_from(query.subquery()))
-    total = total_res.scalar_one_or_none() or 0 # Ensure total is not None
-    products_res = await session.execute(query.limit(per_page).offset(offset))
-    products = products_res.scalars().all()
-
-    pages = (total // per_page) + (1 if total % per_page > 0 else 0)
+    total = await count_cache.get(session, "products", query, q)
+    page = await keyset_paginate(session, query, Product.id, per_page, after=after, before=before)
+    products = page.items
 
     product_rows = "".join([f"""
     <tr>
@@ -879,7 +870,7 @@ async def admin_products(page: int = Query(1, ge=1), q: str = Query(None, alias=
 
     categories_res = await session.execute(sa.select(Category))
     category_options = "".join([f'<option value="{c.id}">{html.escape(c.name)}</option>' for c in categories_res.scalars().all()])
-    pagination = f"<div class='pagination'>{' '.join([f'<a href=\"/admin/products?page={i}{f'&search={q}' if q else ''}\" class=\"{'active' if i == page else ''}\">{i}</a>' for i in range(1, pages+1)])}</div>"
+    pagination = render_keyset_pagination("/admin/products", page, q)
 
     body = f"""
     <div class="card"><h2>📝 Додати нову страву</h2><form action="/admin/add_product" method="post" enctype="multipart/form-data">
@@ -895,9 +886,10 @@ async def admin_products(page: int = Query(1, ge=1), q: str = Query(None, alias=
             <input type="text" name="search" placeholder="Пошук за назвою..." value="{q or ''}">
             <button type="submit">🔍 Знайти</button>
         </form>
+        <p>Всього страв: {total}</p>
         <table><thead><tr><th>ID</th><th>Назва</th><th>Ціна</th><th>Категорія</th><th>Статус</th><th>Дії</th></tr></thead><tbody>
         {product_rows or "<tr><td colspan='6'>Немає страв</td></tr>"}
-        </tbody></table>{pagination if pages > 1 else ''}
+        </tbody></table>{pagination}
     </div>"""
 
     # --- ИСПРАВЛЕНА ИНИЦИАЛИЗАЦИЯ СЛОВАРЯ ---
@@ -915,17 +907,21 @@ async def add_product(name: str=Form(...), price: int=Form(...), description: st
                       session: AsyncSession=Depends(get_db_session), username: str=Depends(check_credentials)):
     if price <= 0: raise HTTPException(status_code=400, detail="Ціна повинна бути позитивною")
     image_url = None
+    image_variants = None
     if image and image.filename:
         ext = image.filename.split('.')[-1] if '.' in image.filename else 'jpg'
         path = f"static/images/{secrets.token_hex(8)}.{ext}"
         try:
             async with aiofiles.open(path, 'wb') as f: await f.write(await image.read())
             image_url = path
+            image_variants = await generate_image_variants(path)
         except Exception as e:
             logging.error(f"Не вдалося зберегти зображення: {e}")
 
-    session.add(Product(name=name, price=price, description=description, image_url=image_url, category_id=category_id, r_keeper_id=r_keeper_id))
+    session.add(Product(name=name, price=price, description=description, image_url=image_url, image_variants=image_variants, category_id=category_id, r_keeper_id=r_keeper_id))
     await session.commit()
+    invalidate_menu_cache()
+    count_cache.invalidate("products")
     return RedirectResponse(url="/admin/products", status_code=303)
 
 @app.get("/admin/edit_product/{product_id}", response_class=HTMLResponse)
@@ -977,23 +973,22 @@ async def edit_product(product_id: int, name: str=Form(...), price: int=Form(...
     product.r_keeper_id = r_keeper_id
 
     if image and image.filename:
-        if product.image_url and os.path.exists(product.image_url):
-            try:
-                os.remove(product.image_url)
-            except OSError as e:
-                logging.error(f"Не вдалося видалити старе зображення {product.image_url}: {e}")
-
+        await forget_photo(product.image_url)
+        remove_image_files(product.image_url, product.image_variants)
+        product.image_variants = None
 
         ext = image.filename.split('.')[-1] if '.' in image.filename else 'jpg'
         path = f"static/images/{secrets.token_hex(8)}.{ext}"
         try:
             async with aiofiles.open(path, 'wb') as f: await f.write(await image.read())
             product.image_url = path
+            product.image_variants = await generate_image_variants(path)
         except Exception as e:
             logging.error(f"Не вдалося зберегти нове зображення {path}: {e}")
             # Optional: Decide if you want to proceed without the new image or raise an error
 
     await session.commit()
+    invalidate_menu_cache()
     return RedirectResponse(url="/admin/products", status_code=303)
 
 @app.get("/admin/product/toggle_active/{product_id}")
@@ -1002,6 +997,7 @@ async def toggle_product_active(product_id: int, session: AsyncSession = Depends
     if product:
         product.is_active = not product.is_active
         await session.commit()
+        invalidate_menu_cache()
     return RedirectResponse(url="/admin/products", status_code=303)
 
 @app.get("/admin/delete_product/{product_id}")
@@ -1009,13 +1005,13 @@ async def delete_product(product_id: int, session: AsyncSession = Depends(get_db
     product = await session.get(Product, product_id)
     if product:
         image_to_delete = product.image_url # Store path before deleting object
+        variants_to_delete = product.image_variants
         await session.delete(product)
         await session.commit()
-        if image_to_delete and os.path.exists(image_to_delete):
-            try:
-                os.remove(image_to_delete)
-            except OSError as e:
-                logging.error(f"Не вдалося видалити зображення {image_to_delete} після видалення продукту: {e}")
+        invalidate_menu_cache()
+        count_cache.invalidate("products")
+        await forget_photo(image_to_delete)
+        remove_image_files(image_to_delete, variants_to_delete)
 
     return RedirectResponse(url="/admin/products", status_code=303)
 
@@ -1099,6 +1095,7 @@ async def add_category(name: str = Form(...),
         show_in_restaurant=show_in_restaurant
     ))
     await session.commit()
+    invalidate_menu_cache()
     return RedirectResponse(url="/admin/categories", status_code=303)
 # --- КОНЕЦ ИСПРАВЛЕНИЯ add_category ---
 
@@ -1120,6 +1117,7 @@ async def edit_category(cat_id: int,
         elif field in ["show_on_delivery_site", "show_in_restaurant"]:
             setattr(category, field, value.lower() == 'true')
         await session.commit()
+        invalidate_menu_cache()
     return RedirectResponse(url="/admin/categories", status_code=303)
 # --- КОНЕЦ ИСПРАВЛЕНИЯ edit_category ---
 
@@ -1138,6 +1136,7 @@ async def delete_category(cat_id: int, session: AsyncSession = Depends(get_db_se
 
         await session.delete(category)
         await session.commit()
+        invalidate_menu_cache()
     return RedirectResponse(url="/admin/categories", status_code=303)
 
 
@@ -1215,24 +1214,18 @@ async def delete_menu_item(item_id: int, session: AsyncSession = Depends(get_db_
 
 # --- ОНОВЛЕНИЙ РОУТ ДЛЯ ЗАМОВЛЕНЬ ---
 @app.get("/admin/orders", response_class=HTMLResponse)
-async def admin_orders(page: int = Query(1, ge=1), q: str = Query(None, alias="search"), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+async def admin_orders(after: Optional[int] = Query(None), before: Optional[int] = Query(None), q: str = Query(None, alias="search"), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
     per_page = 15
-    offset = (page - 1) * per_page
-    query = sa.select(Order).options(joinedload(Order.status)).order_by(Order.id.desc())
+    query = sa.select(Order).options(joinedload(Order.status))
+    page_query = query
     if q:
-        search_term = q.replace('#', '')
-        # Check if search term is numeric for ID search
-        if search_term.isdigit():
-             query = query.where(sa.or_(Order.id == int(search_term), Order.customer_name.ilike(f"%{q}%"), Order.phone_number.ilike(f"%{q}%")))
-        else:
-             query = query.where(sa.or_(Order.customer_name.ilike(f"%{q}%"), Order.phone_number.ilike(f"%{q}%")))
-
+        query = query.where(order_search_clause(q))
+        page_query = page_query.where(order_search_clause(q, after=after, before=before, limit=per_page + 1))
 
-    total_res = await session.execute(sa.select(sa.func.count()).select_from(query.subquery()))
-    total = total_res.scalar_one_or_none() or 0
-    orders_res = await session.execute(query.limit(per_page).offset(offset))
-    orders = orders_res.scalars().all()
-    pages = (total // per_page) + (1 if total % per_page > 0 else 0)
+    # Кількість замовлень кешується на хвилину, тому показуємо її як приблизну
+    total = await count_cache.get(session, "orders", query, q)
+    page = await keyset_paginate(session, page_query, Order.id, per_page, after=after, before=before)
+    orders = page.items
 
 
     rows = "".join([f"""
@@ -1241,7 +1234,7 @@ async def admin_orders(page: int = Query(1, ge=1), q: str = Query(None, alias="s
         <td>{html.escape(o.customer_name or '')}</td>
         <td>{html.escape(o.phone_number or '')}</td>
         <td>{o.total_price} грн</td>
-        <td><span class='status'>{o.status.name if o.status else '-'}</span></td>
+        <td><span class='status'>{o.status.name if o.status else '-'}</span>{' <a href="/admin/r_keeper" title="Замовлення не передано в R-Keeper">⚠️</a>' if o.r_keeper_status == 'failed' else ''}</td>
         <td>{html.escape(o.products[:50] + '...' if o.products and len(o.products) > 50 else o.products or '')}</td>
         <td class='actions'>
             <a href='/admin/order/manage/{o.id}' class='button-sm' title="Керувати статусом та кур'єром">⚙️ Керувати</a>
@@ -1249,7 +1242,7 @@ async def admin_orders(page: int = Query(1, ge=1), q: str = Query(None, alias="s
         </td>
     </tr>""" for o in orders])
 
-    pagination = f"<div class='pagination'>{' '.join([f'<a href=\"/admin/orders?page={i}{f'&search={q}' if q else ''}\" class=\"{'active' if i == page else ''}\">{i}</a>' for i in range(1, pages+1)])}</div>"
+    pagination = render_keyset_pagination("/admin/orders", page, q)
 
     body = f"""
     <div class="card">
@@ -1261,9 +1254,16 @@ async def admin_orders(page: int = Query(1, ge=1), q: str = Query(None, alias="s
             <input type="text" name="search" placeholder="Пошук за ID, іменем, телефоном..." value="{q or ''}">
             <button type="submit">🔍 Знайти</button>
         </form>
+        <form action="/admin/export/orders" method="get" class="search-form">
+            <label for="export_date_from">Вивантажити з:</label><input type="date" id="export_date_from" name="date_from">
+            <label for="export_date_to">по:</label><input type="date" id="export_date_to" name="date_to">
+            <select name="format"><option value="xlsx">XLSX</option><option value="csv">CSV</option></select>
+            <button type="submit">⬇️ Вивантажити</button>
+        </form>
+        <p>Всього замовлень: ≈{total}</p>
         <table><thead><tr><th>ID</th><th>Клієнт</th><th>Телефон</th><th>Сума</th><th>Статус</th><th>Склад</th><th>Дії</th></tr></thead><tbody>
         {rows or "<tr><td colspan='7'>Немає замовлень</td></tr>"}
-        </tbody></table>{pagination if pages > 1 else ''}
+        </tbody></table>{pagination}
     </div>"""
     active_classes = {key: "" for key in ["main_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active"]}
     active_classes["orders_active"] = "active"
@@ -1394,6 +1394,7 @@ async def add_status(
     )
     session.add(new_status)
     await session.commit()
+    invalidate_statuses()
     return RedirectResponse(url="/admin/statuses", status_code=303)
 
 @app.post("/admin/edit_status/{status_id}")
@@ -1415,6 +1416,7 @@ async def edit_status(
         setattr(status_to_edit, field, value.lower() == 'true')
 
     await session.commit()
+    invalidate_statuses()
     return RedirectResponse(url="/admin/statuses", status_code=303)
 
 
@@ -1425,6 +1427,7 @@ async def delete_status(status_id: int, session: AsyncSession = Depends(get_db_s
         try:
             await session.delete(status_to_delete)
             await session.commit()
+            invalidate_statuses()
         except IntegrityError: # Catch the specific database error
             logging.warning(f"Attempted to delete status {status_id} which is in use.")
             return RedirectResponse(url="/admin/statuses?error=in_use", status_code=303) # Redirect with error flag
@@ -1504,6 +1507,7 @@ async def add_role(name: str = Form(...),
                     can_serve_tables=bool(can_serve_tables)) # Added new permission
     session.add(new_role)
     await session.commit()
+    invalidate_roles()
     return RedirectResponse(url="/admin/roles", status_code=303)
 
 
@@ -1547,6 +1551,8 @@ async def edit_role(role_id: int, name: str = Form(...), can_manage_orders: Opti
         role.can_be_assigned = bool(can_be_assigned)
         role.can_serve_tables = bool(can_serve_tables)
         await session.commit()
+        invalidate_roles()
+        staff_cache.clear() # Права ролі зберігаються в кеші співробітників
     return RedirectResponse(url="/admin/roles", status_code=303)
 
 @app.get("/admin/delete_role/{role_id}")
@@ -1564,6 +1570,7 @@ async def delete_role(role_id: int, session: AsyncSession = Depends(get_db_sessi
 
             await session.delete(role)
             await session.commit()
+            invalidate_roles()
         except IntegrityError: # Fallback, though the check above should prevent this
             logging.error(f"IntegrityError deleting role {role_id}, likely still in use.")
             raise HTTPException(status_code=400, detail="Неможливо видалити роль, оскільки до неї прив'язані співробітники.")
@@ -1660,6 +1667,7 @@ async def edit_employee(employee_id: int, full_name: str = Form(...), phone_numb
         employee.role_id = role_id
         try:
             await session.commit()
+            staff_cache.invalidate_employee(employee_id)
         except IntegrityError:
             await session.rollback()
             raise HTTPException(status_code=400, detail="Співробітник з таким номером телефону вже існує.")
@@ -1686,6 +1694,7 @@ async def delete_employee(employee_id: int, session: AsyncSession = Depends(get_
 
         await session.delete(employee)
         await session.commit()
+        staff_cache.invalidate_employee(employee_id)
     return RedirectResponse(url="/admin/employees", status_code=303)
 
 
@@ -1696,6 +1705,7 @@ async def admin_reports_menu(username: str = Depends(check_credentials)):
         <h2>Доступні звіти</h2>
         <ul>
             <li><a href="/admin/reports/couriers">Звіт по замовленнях кур'єрів</a></li>
+            <li><a href="/admin/reports/sla">Тривалість етапів замовлень (кухня, видача, доставка)</a></li>
             </ul>
     </div>
     """
@@ -1716,38 +1726,19 @@ async def report_couriers(
     date_from = datetime.strptime(date_from_str, "%Y-%m-%d").date() if date_from_str else date_to - timedelta(days=6) # 6 days before + today = 7 days
 
 
-    completed_status_res = await session.execute(
-        sa.select(OrderStatus.id).where(OrderStatus.is_completed_status == True) # Select all completed statuses
-    )
-    completed_status_ids = completed_status_res.scalars().all()
+    completed_status_ids = await get_completed_status_ids()
 
     if completed_status_ids:
-        # Ensure dates are inclusive by adding one day to date_to for the comparison
-        date_to_inclusive = date_to + timedelta(days=1)
-        report_query = (
-            sa.select(
-                Employee.full_name,
-                func.count(Order.id).label("completed_orders")
-            )
-            .join(Employee, Order.completed_by_courier_id == Employee.id) # Use completed_by_courier_id
-            .where(
-                and_(
-                    Order.created_at >= date_from, # Use >= for start date
-                    Order.created_at < date_to_inclusive, # Use < for end date + 1 day
-                    Order.status_id.in_(completed_status_ids) # Check against all completed statuses
-                )
-            )
-            .group_by(Employee.full_name)
-            .order_by(func.count(Order.id).desc())
-        )
+        # Денна статистика (order_daily_stats), тож звіт за рік читає не більше ~365 рядків на кур'єра
+        report_query = order_stats.courier_report_query(date_from, date_to, completed_status_ids)
         result = await session.execute(report_query)
         report_data = result.all() # Fetch all results
 
-    report_rows = "".join([f'<tr><td>{html.escape(row.full_name)}</td><td>{row.completed_orders}</td></tr>' for row in report_data])
+    report_rows = "".join([f'<tr><td>{html.escape(row.full_name)}</td><td>{row.completed_orders}</td><td>{row.revenue} грн</td></tr>' for row in report_data])
     if not report_data and (date_from_str or date_to_str): # Show message only if dates were selected
-        report_rows = '<tr><td colspan="2">Немає даних за вибраний період.</td></tr>'
+        report_rows = '<tr><td colspan="3">Немає даних за вибраний період.</td></tr>'
     elif not report_data:
-         report_rows = '<tr><td colspan="2">Оберіть період та сформуйте звіт (за замовчуванням останні 7 днів).</td></tr>'
+         report_rows = '<tr><td colspan="3">Оберіть період та сформуйте звіт (за замовчуванням останні 7 днів).</td></tr>'
 
 
     body = ADMIN_REPORTS_BODY.format(
@@ -1809,6 +1800,7 @@ async def save_admin_settings(session: AsyncSession = Depends(get_db_session), u
     settings.r_keeper_payment_type=r_keeper_payment_type.strip() if r_keeper_payment_type else None
 
     if logo_file and logo_file.filename:
+        await forget_photo(settings.logo_url)
         if settings.logo_url and os.path.exists(settings.logo_url):
             try:
                 os.remove(settings.logo_url)
@@ -1851,6 +1843,9 @@ async def save_admin_settings(session: AsyncSession = Depends(get_db_session), u
                 # Optional: Add error message to redirect
 
     await session.commit()
+    invalidate_settings()
+    # Логотип вбудований у сторінки QR-меню, тому скидаємо їх
+    invalidate_table_pages()
     return RedirectResponse(url="/admin/settings?saved=true", status_code=303)
 
 
@@ -1862,6 +1857,7 @@ async def get_settings(session: AsyncSession) -> Settings:
         try:
             await session.commit()
             await session.refresh(settings) # Refresh to get default values if any
+            invalidate_settings()
             logging.info("Створено початкові налаштування в БД.")
         except Exception as e:
             logging.error(f"Не вдалося створити початкові налаштування: {e}")
@@ -1929,17 +1925,20 @@ async def get_edit_order_form(order_id: int, session: AsyncSession = Depends(get
     order = await session.get(Order, order_id)
     if not order: raise HTTPException(404, "Замовлення не знайдено")
 
-    products_dict = parse_products_string(order.products)
-    initial_items = {}
-    if products_dict:
-        products_res = await session.execute(sa.select(Product).where(Product.name.in_(list(products_dict.keys()))))
-        db_products_map = {p.name: p for p in products_res.scalars().all()}
-        for name, quantity in products_dict.items():
-            if p := db_products_map.get(name):
-                initial_items[p.id] = {"name": p.name, "price": p.price, "quantity": quantity}
+    initial_items = {
+        item.product_id: {"name": item.name, "price": item.price, "quantity": item.quantity}
+        for item in order.items if item.product_id is not None
+    }
+
+    # Страви, яких уже немає в меню (перенесені міграцією 0001), не редагуються, але зберігаються при збереженні
+    legacy_items = [
+        {"name": item.name, "price": item.price, "quantity": item.quantity}
+        for item in order.items if item.product_id is None
+    ]
 
     initial_data = {
         "items": initial_items,
+        "legacy_items": legacy_items,
         "action": f"/api/admin/order/edit/{order_id}",
         "submit_text": "Зберегти зміни",
         "form_values": {
@@ -1990,48 +1989,36 @@ async def _process_and_save_order(order: Order, data: dict, session: AsyncSessio
 
 
     items_from_js = data.get("items", {})
-
-    if not items_from_js:
-        order.products = ""
-        order.total_price = 0
-    else:
-        # Filter out potentially invalid keys before converting to int
-        valid_product_ids = [int(pid) for pid in items_from_js.keys() if pid.isdigit()]
-
-        if not valid_product_ids:
-            order.products = ""
-            order.total_price = 0
-        else:
-            products_res = await session.execute(sa.select(Product).where(Product.id.in_(valid_product_ids)))
-            db_products_map = {p.id: p for p in products_res.scalars().all()}
-
-            total_price = 0
-            product_strings = []
-
-            for pid_str, item_data in items_from_js.items():
-                if not pid_str.isdigit(): continue # Skip non-numeric keys
-                pid = int(pid_str)
-                if product := db_products_map.get(pid):
-                    try:
-                         quantity = int(item_data.get('quantity', 0))
-                    except (ValueError, TypeError):
-                         quantity = 0 # Default to 0 if quantity is invalid
-
-                    if quantity > 0:
-                        total_price += product.price * quantity
-                        product_strings.append(f"{product.name} x {quantity}")
-
-            order.products = ", ".join(product_strings)
-            order.total_price = total_price
+    quantities = {}
+    for pid_str, item_data in items_from_js.items():
+        if not str(pid_str).isdigit(): continue # Skip non-numeric keys
+        try:
+            quantities[int(pid_str)] = int(item_data.get('quantity', 0))
+        except (ValueError, TypeError, AttributeError):
+            continue
+
+    # Позиції, що вже є в замовленні, зберігають ціну на момент замовлення
+    existing_items = {item.product_id: item for item in order.items if item.product_id is not None} if not is_new_order else {}
+    added_items = await build_order_items(session, {pid: qty for pid, qty in quantities.items() if pid not in existing_items})
+    added_by_product = {item.product_id: item for item in added_items}
+    # Позиції без product_id (страви, видалені з меню) форма не редагує — лишаємо їх без змін
+    new_items = [item for item in order.items if item.product_id is None] if not is_new_order else []
+    for product_id, quantity in quantities.items():
+        if quantity <= 0: continue
+        if item := existing_items.get(product_id):
+            item.quantity = quantity
+            new_items.append(item)
+        elif item := added_by_product.get(product_id):
+            new_items.append(item)
+    apply_order_items(order, new_items)
 
     if is_new_order:
         session.add(order)
         # Ensure status_id is set for new orders
         if not order.status_id:
             # Get the default "New" status ID (assuming it's 1 or querying it)
-            new_status_res = await session.execute(sa.select(OrderStatus.id).where(OrderStatus.name == "Новый").limit(1))
-            new_status_id = new_status_res.scalar_one_or_none() or 1 # Default to 1 if not found
-            order.status_id = new_status_id
+            new_status = await get_status_by_name("Новый")
+            order.status_id = new_status.id if new_status else 1 # Default to 1 if not found
 
 
     await session.commit() # Commit changes for both new and existing orders
@@ -2053,7 +2040,7 @@ async def _process_and_save_order(order: Order, data: dict, session: AsyncSessio
              await session.rollback() # Rollback history commit if it fails
 
 
-        admin_bot = dp_admin.get("bot_instance")
+        admin_bot = await get_admin_bot()
         if admin_bot:
             try:
                 await notify_new_order_to_staff(admin_bot, order, session)
@@ -0,0 +1,247 @@
+# menu_cache.py
+
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from cache_sync import publish_invalidation, register_cache
+from models import Category, Product
+from image_processing import build_srcset
+
+# Brotli необов'язковий: без нього віддаємо лише gzip та нестиснений варіант
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Варіанти меню: сайт/бот доставки та QR-меню в закладі
+MENU_VIEW_DELIVERY = "delivery"
+MENU_VIEW_RESTAURANT = "restaurant"
+
+_VIEW_CATEGORY_FLAGS = {
+    MENU_VIEW_DELIVERY: Category.show_on_delivery_site,
+    MENU_VIEW_RESTAURANT: Category.show_in_restaurant,
+}
+
+
+@dataclass(frozen=True)
+class MenuSnapshot:
+    """
+    Незмінний знімок меню для одного варіанту відображення.
+    Разом з даними зберігає вже серіалізований JSON, його стиснені варіанти та ETag.
+    """
+    view: str
+    version: int
+    data: Dict[str, Any]
+    json_text: str
+    body: bytes
+    gzip_body: bytes
+    br_body: Optional[bytes]
+    etag: str
+
+
+def _serialize_snapshot(view: str, version: int, data: Dict[str, Any]) -> MenuSnapshot:
+    """Серіалізує та стискає меню. Виконується один раз на версію каталогу."""
+    json_text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    body = json_text.encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    return MenuSnapshot(
+        view=view,
+        version=version,
+        data=data,
+        json_text=json_text,
+        body=body,
+        gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+        br_body=brotli.compress(body, quality=11) if brotli else None,
+        etag=f'"{view}-{digest}"',
+    )
+
+
+class MenuSnapshotCache:
+    """
+    Кеш знімків меню в пам'яті процесу.
+    Знімок будується один раз на версію каталогу для кожного варіанту меню,
+    будь-яка зміна каталогу в адмінці збільшує версію та скидає знімки.
+    """
+    def __init__(self):
+        self._version = 1
+        self._snapshots: Dict[str, MenuSnapshot] = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self):
+        """Скидає всі знімки. Викликається після кожного запису в каталог."""
+        self._version += 1
+        self._snapshots.clear()
+        logger.info(f"Кеш меню скинуто, нова версія каталогу: {self._version}")
+
+    async def get(self, session: AsyncSession, view: str) -> MenuSnapshot:
+        snapshot = self._snapshots.get(view)
+        if snapshot is not None:
+            return snapshot
+
+        async with self._lock:
+            # Поки ми чекали на блокування, знімок міг побудувати інший запит
+            snapshot = self._snapshots.get(view)
+            if snapshot is not None:
+                return snapshot
+
+            version = self._version
+            snapshot = await self._build(session, view, version)
+            # Не зберігаємо знімок, якщо каталог змінився під час побудови
+            if version == self._version:
+                self._snapshots[view] = snapshot
+            return snapshot
+
+    async def _build(self, session: AsyncSession, view: str, version: int) -> MenuSnapshot:
+        category_flag = _VIEW_CATEGORY_FLAGS[view]
+
+        categories_res = await session.execute(
+            select(Category)
+            .where(category_flag == True)
+            .order_by(Category.sort_order, Category.name)
+        )
+        products_res = await session.execute(
+            select(Product)
+            .join(Category, Product.category_id == Category.id)
+            .where(Product.is_active == True, category_flag == True)
+        )
+
+        categories = [{"id": c.id, "name": c.name} for c in categories_res.scalars().all()]
+        products = [{"id": p.id, "name": p.name, "description": p.description, "price": p.price, "image_url": p.image_url,
+                     "image_srcset": build_srcset(p.image_variants, "jpeg"), "image_srcset_webp": build_srcset(p.image_variants, "webp"),
+                     "category_id": p.category_id} for p in products_res.scalars().all()]
+
+        # Стиснення займає помітний час на великому меню, тому виносимо його з event loop
+        snapshot = await asyncio.to_thread(_serialize_snapshot, view, version, {"categories": categories, "products": products})
+        logger.info(f"Побудовано знімок меню '{view}' (версія {version}): {len(categories)} категорій, {len(products)} страв, {len(snapshot.body)} байт.")
+        return snapshot
+
+
+menu_cache = MenuSnapshotCache()
+
+
+async def get_menu_snapshot(session: AsyncSession, view: str) -> MenuSnapshot:
+    """Повертає актуальний знімок меню, звертаючись до БД лише при першому запиті після змін."""
+    return await menu_cache.get(session, view)
+
+
+register_cache("menu", menu_cache.invalidate)
+
+
+def invalidate_menu_cache():
+    """Скидає знімки меню після зміни страв або категорій."""
+    menu_cache.invalidate()
+    publish_invalidation("menu")
+
+
+@dataclass(frozen=True)
+class RenderedTablePage:
+    """Готова HTML-сторінка QR-меню столика для конкретної версії каталогу."""
+    catalog_version: int
+    body: bytes
+
+
+class TablePageCache:
+    """
+    Кеш відрендерених сторінок QR-меню за access_token столика.
+    Сторінка вважається застарілою, якщо версія каталогу змінилася після рендерингу.
+    """
+    def __init__(self):
+        self._pages: Dict[str, RenderedTablePage] = {}
+
+    def get(self, access_token: str) -> Optional[bytes]:
+        page = self._pages.get(access_token)
+        if page is None or page.catalog_version != menu_cache.version:
+            return None
+        return page.body
+
+    def put(self, access_token: str, catalog_version: int, body: bytes):
+        self._pages[access_token] = RenderedTablePage(catalog_version=catalog_version, body=body)
+
+    def invalidate(self, access_token: Optional[str] = None):
+        """Скидає сторінку одного столика або, без аргументу, всі сторінки."""
+        if access_token is None:
+            self._pages.clear()
+        else:
+            self._pages.pop(access_token, None)
+
+
+table_page_cache = TablePageCache()
+
+
+register_cache("table_pages", table_page_cache.invalidate)
+
+
+def invalidate_table_pages(access_token: Optional[str] = None):
+    """Скидає збережені сторінки QR-меню (після видалення столика або зміни логотипу)."""
+    table_page_cache.invalidate(access_token)
+    publish_invalidation("table_pages")
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Слабке порівняння (RFC 9110): префікс W/ ігнорується
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def _accepted_encodings(accept_encoding: str) -> set[str]:
+    encodings = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        name, _, value = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                if float(value) <= 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(coding)
+    return encodings
+
+
+def build_menu_response(request: Request, snapshot: MenuSnapshot) -> Response:
+    """
+    Формує відповідь з готових байтів знімка: 304 при збігу ETag,
+    інакше brotli/gzip/нестиснене тіло залежно від Accept-Encoding.
+    """
+    headers = {
+        "ETag": snapshot.etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, snapshot.etag):
+        return Response(status_code=304, headers=headers)
+
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    if snapshot.br_body is not None and "br" in accepted:
+        headers["Content-Encoding"] = "br"
+        body = snapshot.br_body
+    elif "gzip" in accepted:
+        headers["Content-Encoding"] = "gzip"
+        body = snapshot.gzip_body
+    else:
+        body = snapshot.body
+
+    return Response(content=body, media_type="application/json", headers=headers)
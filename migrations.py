@@ -0,0 +1,95 @@
+# migrations.py
+
+import asyncio
+import logging
+import sys
+
+import sqlalchemy as sa
+
+from models import Order, OrderItem, Product, SchemaMigration, async_session_maker, create_db_tables
+from order_items import parse_products_string
+from order_stats import rebuild_order_stats
+from client_stats import rebuild_client_stats
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 500
+
+
+async def backfill_order_items():
+    """
+    Створює позиції OrderItem для старих замовлень з текстового поля products.
+    Страви шукаються за назвою — це єдине місце, де назва ще використовується як ключ.
+    Для страв, яких уже немає в меню, product_id лишається порожнім, а ціна береться з суми замовлення,
+    якщо це єдина позиція, інакше — 0 (загальна сума замовлення не змінюється).
+    """
+    async with async_session_maker() as session:
+        products_res = await session.execute(sa.select(Product.id, Product.name, Product.price))
+        products_by_name = {row.name: row for row in products_res}
+
+    processed = 0
+    last_id = 0
+    while True:
+        async with async_session_maker() as session:
+            orders_res = await session.execute(
+                sa.select(Order.id, Order.products, Order.total_price)
+                .where(Order.id > last_id, ~sa.exists().where(OrderItem.order_id == Order.id))
+                .order_by(Order.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            )
+            orders = orders_res.all()
+            if not orders:
+                break
+
+            for order in orders:
+                products_dict = parse_products_string(order.products)
+                for name, quantity in products_dict.items():
+                    product = products_by_name.get(name)
+                    if product:
+                        price = product.price
+                    elif len(products_dict) == 1 and quantity:
+                        price = order.total_price // quantity
+                    else:
+                        price = 0
+                    session.add(OrderItem(order_id=order.id, product_id=product.id if product else None,
+                                          name=name[:100], price=price, quantity=quantity))
+            await session.commit()
+            processed += len(orders)
+            last_id = orders[-1].id
+            logger.info(f"Перенесено склад {processed} замовлень у order_items (до #{last_id})")
+    return processed
+
+
+# Порядок має значення: нові міграції додаються в кінець списку
+MIGRATIONS = [
+    ("0001_backfill_order_items", backfill_order_items),
+    ("0002_build_order_daily_stats", rebuild_order_stats),
+    ("0003_build_client_stats", rebuild_client_stats),
+]
+
+
+async def run_migrations():
+    """Виконує міграції даних, яких ще немає в таблиці schema_migrations."""
+    async with async_session_maker() as session:
+        applied = set((await session.execute(sa.select(SchemaMigration.name))).scalars().all())
+
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        logger.info(f"Виконується міграція {name}...")
+        await migration()
+        async with async_session_maker() as session:
+            session.add(SchemaMigration(name=name))
+            await session.commit()
+        logger.info(f"Міграцію {name} виконано.")
+
+
+if __name__ == "__main__":
+    # Використання: python migrations.py
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    async def _main():
+        await create_db_tables()
+        await run_migrations()
+
+    asyncio.run(_main())
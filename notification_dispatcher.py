@@ -0,0 +1,154 @@
+# notification_dispatcher.py
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Ліміти Telegram Bot API: ~30 повідомлень/с на бота, 1 повідомлення/с в особистий чат, 20/хв у групу
+GLOBAL_MESSAGES_PER_SECOND = float(os.getenv("NOTIFY_GLOBAL_RATE", "30"))
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+MAX_CONCURRENT_SENDS = int(os.getenv("NOTIFY_MAX_CONCURRENCY", "10"))
+MAX_SEND_ATTEMPTS = 3
+# Скільки інтервалів чатів тримати в пам'яті, перш ніж прибрати застарілі
+CHAT_LIMITERS_MAX_SIZE = 1000
+
+
+@dataclass
+class Notification:
+    """Одне повідомлення: кому, яким ботом і що відправити. label — для логів (напр. "оператору 5")."""
+    bot: Bot
+    chat_id: int | str
+    text: str
+    label: str = ""
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class NotificationResult:
+    notification: Notification
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+
+    @property
+    def chat_id(self) -> int | str:
+        return self.notification.chat_id
+
+
+class _IntervalLimiter:
+    """Видає слоти для відправки не частіше ніж раз на interval секунд (без утримання блокування під час очікування)."""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # Пауза могла настати, поки чекали свій слот (напр. 429 для іншого чату цього бота)
+        while (remaining := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(remaining)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._next_slot = max(self._next_slot, self._paused_until)
+
+    def is_idle(self) -> bool:
+        return self._next_slot < time.monotonic()
+
+
+class NotificationDispatcher:
+    """
+    Розсилає повідомлення паралельно, дотримуючись лімітів Telegram для бота та для кожного чату.
+    На 429 (TelegramRetryAfter) уся відправка цим ботом чекає вказаний час, потім повідомлення повторюється; мережеві помилки повторюються
+    з паузою, інші помилки (бот заблоковано, чат не знайдено) не повторюються.
+    """
+    def __init__(self, global_rate: float = GLOBAL_MESSAGES_PER_SECOND, max_concurrency: int = MAX_CONCURRENT_SENDS,
+                 max_attempts: int = MAX_SEND_ATTEMPTS):
+        self.global_rate = global_rate
+        self.max_attempts = max_attempts
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bot_limiters: Dict[int, _IntervalLimiter] = {}
+        self._chat_limiters: Dict[Tuple[int, str], _IntervalLimiter] = {}
+
+    def _bot_limiter(self, bot: Bot) -> _IntervalLimiter:
+        limiter = self._bot_limiters.get(bot.id)
+        if limiter is None:
+            limiter = self._bot_limiters[bot.id] = _IntervalLimiter(1 / self.global_rate)
+        return limiter
+
+    def _chat_limiter(self, bot: Bot, chat_id: int | str) -> _IntervalLimiter:
+        key = (bot.id, str(chat_id))
+        limiter = self._chat_limiters.get(key)
+        if limiter is None:
+            if len(self._chat_limiters) >= CHAT_LIMITERS_MAX_SIZE:
+                for stale_key in [k for k, l in self._chat_limiters.items() if l.is_idle()]:
+                    del self._chat_limiters[stale_key]
+            # Групи та канали мають від'ємні ID
+            is_group = str(chat_id).startswith("-")
+            limiter = self._chat_limiters[key] = _IntervalLimiter(GROUP_CHAT_INTERVAL if is_group else PRIVATE_CHAT_INTERVAL)
+        return limiter
+
+    async def _deliver(self, notification: Notification) -> NotificationResult:
+        chat_limiter = self._chat_limiter(notification.bot, notification.chat_id)
+        bot_limiter = self._bot_limiter(notification.bot)
+        error = None
+        attempt = 0
+        while attempt < self.max_attempts:
+            attempt += 1
+            await chat_limiter.wait()
+            async with self._semaphore:
+                await bot_limiter.wait()
+                try:
+                    await notification.bot.send_message(notification.chat_id, notification.text, **notification.kwargs)
+                    return NotificationResult(notification, ok=True, attempts=attempt)
+                except TelegramRetryAfter as e:
+                    error = f"429, повтор через {e.retry_after} с"
+                    # Flood wait діє на весь токен бота, а не лише на цей чат
+                    chat_limiter.pause(e.retry_after)
+                    bot_limiter.pause(e.retry_after)
+                except TelegramNetworkError as e:
+                    error = str(e)
+                    chat_limiter.pause(attempt)
+                except Exception as e:
+                    error = str(e)
+                    break
+
+        logger.error(f"Не вдалося надіслати повідомлення {notification.label or ''} (чат {notification.chat_id}) "
+                     f"після {attempt} спроб: {error}")
+        return NotificationResult(notification, ok=False, attempts=attempt, error=error)
+
+    async def send(self, notifications: Iterable[Notification]) -> List[NotificationResult]:
+        """Відправляє всі повідомлення паралельно; результати повертаються в тому ж порядку."""
+        return list(await asyncio.gather(*(self._deliver(n) for n in notifications)))
+
+    async def broadcast(self, bot: Bot, chat_ids: Iterable[int | str], text: str, label: str = "",
+                        **kwargs) -> List[NotificationResult]:
+        """Одне й те саме повідомлення кільком отримувачам (повтори chat_id відкидаються)."""
+        unique_chat_ids = list(dict.fromkeys(chat_ids))
+        return await self.send(Notification(bot, chat_id, text, label, kwargs) for chat_id in unique_chat_ids)
+
+
+notification_dispatcher = NotificationDispatcher()
+
+
+async def send_notifications(notifications: Iterable[Notification]) -> List[NotificationResult]:
+    return await notification_dispatcher.send(notifications)
+
+
+async def broadcast(bot: Bot, chat_ids: Iterable[int | str], text: str, label: str = "", **kwargs) -> List[NotificationResult]:
+    return await notification_dispatcher.broadcast(bot, chat_ids, text, label, **kwargs)
@@ -4,9 +4,12 @@ from aiogram import Bot, html
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 from urllib.parse import quote_plus
 
-from models import Order, Settings, OrderStatus, Employee, Role
+from models import Order, Employee, Table
+from notification_dispatcher import Notification, send_notifications
+from reference_data import get_settings_snapshot, get_visible_statuses, get_role_ids, get_status
 
 logger = logging.getLogger(__name__)
 
@@ -14,11 +17,13 @@ logger = logging.getLogger(__name__)
 async def notify_new_order_to_staff(admin_bot: Bot, order: Order, session: AsyncSession):
     """
     Надсилає сповіщення про НОВЕ замовлення в загальний чат і всім операторам на зміні.
+    Повертає результат відправки для кожного отримувача.
     """
-    settings = await session.get(Settings, 1)
+    settings = await get_settings_snapshot()
 
     # Генеруємо текст та клавіатуру для керування
-    status_name = order.status.name if order.status else 'Невідомий'
+    status = await get_status(order.status_id)
+    status_name = status.name if status else 'Невідомий'
     delivery_info = f"Адреса: {html.quote(order.address or 'Не вказана')}" if order.is_delivery else 'Самовивіз'
     time_info = f"Час: {html.quote(order.delivery_time)}"
     source = f"Джерело: {'Веб-сайт' if order.user_id is None else 'Telegram-бот'}"
@@ -32,60 +37,57 @@ async def notify_new_order_to_staff(admin_bot: Bot, order: Order, session: Async
                   f"<b>Статус:</b> {status_name}")
 
     kb_admin = InlineKeyboardBuilder()
-    statuses_res = await session.execute(
-        select(OrderStatus).where(OrderStatus.visible_to_operator == True).order_by(OrderStatus.id)
-    )
     status_buttons = [
         InlineKeyboardButton(text=s.name, callback_data=f"change_order_status_{order.id}_{s.id}")
-        for s in statuses_res.scalars().all()
+        for s in await get_visible_statuses("operator")
     ]
     for i in range(0, len(status_buttons), 2):
         kb_admin.row(*status_buttons[i:i+2])
     kb_admin.row(InlineKeyboardButton(text="👤 Призначити кур'єра", callback_data=f"select_courier_{order.id}"))
     kb_admin.row(InlineKeyboardButton(text="✏️ Редагувати замовлення", callback_data=f"edit_order_{order.id}"))
 
+    markup = kb_admin.as_markup()
+    notifications = []
+
     # 1. Відправка в загальний адмін-чат (як лог)
     if settings and settings.admin_chat_id:
-        try:
-            await admin_bot.send_message(
-                settings.admin_chat_id,
-                "✅ <b>Отримано нове замовлення!</b>\n\n" + admin_text,
-                reply_markup=kb_admin.as_markup()
-            )
-        except Exception as e:
-            logger.error(f"Не вдалося відправити нове замовлення в адмін-чат {settings.admin_chat_id}: {e}")
-
-    # 2. Пошук та відправка всім операторам на зміні
-    operator_roles_res = await session.execute(select(Role.id).where(Role.can_manage_orders == True))
-    operator_role_ids = operator_roles_res.scalars().all()
-
+        notifications.append(Notification(
+            admin_bot, settings.admin_chat_id, "✅ <b>Отримано нове замовлення!</b>\n\n" + admin_text,
+            label="в адмін-чат", kwargs={"reply_markup": markup}
+        ))
+
+    # 2. Пошук операторів на зміні
+    operators = []
+    operator_role_ids = await get_role_ids("can_manage_orders")
     if not operator_role_ids:
         logger.warning("У системі немає ролей для керування замовленнями.")
-        return
-
-    operators_on_shift_res = await session.execute(
-        select(Employee).where(
-            Employee.role_id.in_(operator_role_ids),
-            Employee.is_on_shift == True,
-            Employee.telegram_user_id.is_not(None)
+    else:
+        operators_on_shift_res = await session.execute(
+            select(Employee).where(
+                Employee.role_id.in_(operator_role_ids),
+                Employee.is_on_shift == True,
+                Employee.telegram_user_id.is_not(None)
+            )
         )
-    )
-    operators = operators_on_shift_res.scalars().all()
+        operators = operators_on_shift_res.scalars().all()
 
-    if not operators:
-        logger.warning(f"Нове замовлення #{order.id}, але немає операторів на зміні.")
-        if settings and settings.admin_chat_id:
-            try:
-                await admin_bot.send_message(settings.admin_chat_id, "❗️<b>УВАГА: Немає операторів на зміні для обробки замовлення!</b>❗️")
-            except Exception: pass
-        return
+        if not operators:
+            logger.warning(f"Нове замовлення #{order.id}, але немає операторів на зміні.")
+            if settings and settings.admin_chat_id:
+                notifications.append(Notification(
+                    admin_bot, settings.admin_chat_id, "❗️<b>УВАГА: Немає операторів на зміні для обробки замовлення!</b>❗️",
+                    label="в адмін-чат"
+                ))
 
     notification_text = "🔔 <b>Нове замовлення для обробки!</b>\n\n" + admin_text
     for operator in operators:
-        try:
-            await admin_bot.send_message(operator.telegram_user_id, notification_text, reply_markup=kb_admin.as_markup())
-        except Exception as e:
-            logger.error(f"Не вдалося відправити замовлення оператору {operator.id} ({operator.telegram_user_id}): {e}")
+        notifications.append(Notification(
+            admin_bot, operator.telegram_user_id, notification_text,
+            label=f"оператору {operator.id}", kwargs={"reply_markup": markup}
+        ))
+
+    # 3. Усі повідомлення відправляються паралельно з урахуванням лімітів Telegram
+    return await send_notifications(notifications)
 
 
 async def notify_all_parties_on_status_change(
@@ -98,10 +100,13 @@ async def notify_all_parties_on_status_change(
 ):
     """
     Централізована функція для надсилання всіх сповіщень при зміні статусу.
+    Повертає результат відправки для кожного отримувача.
     """
-    await session.refresh(order, ['status', 'courier'])
-    settings = await session.get(Settings, 1)
-    new_status = order.status
+    await session.refresh(order, ['courier'])
+    settings = await get_settings_snapshot()
+    new_status = await get_status(order.status_id)
+
+    notifications = []
 
     # 1. Сповіщення в головний АДМІН-ЧАТ
     if settings and settings.admin_chat_id:
@@ -110,23 +115,68 @@ async def notify_all_parties_on_status_change(
             f"<b>Ким:</b> {html.quote(actor_info)}\n"
             f"<b>Статус:</b> `{html.quote(old_status_name)}` → `{html.quote(new_status.name)}`"
         )
-        try:
-            await admin_bot.send_message(settings.admin_chat_id, log_message)
-        except Exception as e:
-            logger.error(f"Не вдалося відправити лог про зміну статусу в адмін-чат {settings.admin_chat_id}: {e}")
+        notifications.append(Notification(admin_bot, settings.admin_chat_id, log_message, label="в адмін-чат"))
 
     # 2. Сповіщення призначеному КУР'ЄРУ (якщо він є і статус для нього видимий)
     if order.courier and order.courier.telegram_user_id and "Оператор" in actor_info:
         courier_text = f"❗️ Статус вашого замовлення #{order.id} було змінено оператором на: <b>{new_status.name}</b>"
-        try:
-            await admin_bot.send_message(order.courier.telegram_user_id, courier_text)
-        except Exception as e:
-            logger.error(f"Не вдалося сповістити кур'єра {order.courier.telegram_user_id}: {e}")
+        notifications.append(Notification(admin_bot, order.courier.telegram_user_id, courier_text, label="кур'єру"))
 
     # 3. Сповіщення КЛІЄНТУ (якщо потрібно)
     if new_status.notify_customer and order.user_id and client_bot:
         client_text = f"Статус вашого замовлення #{order.id} змінено на: <b>{new_status.name}</b>"
+        notifications.append(Notification(client_bot, order.user_id, client_text, label="клієнту"))
+
+    return await send_notifications(notifications)
+
+
+async def notify_in_house_order(admin_bot: Bot, order: Order, session: AsyncSession):
+    """
+    Надсилає замовлення зі столика офіціантам цього столика на зміні (з кнопкою "Прийняти"),
+    а копію — в адмін-чат. Якщо офіціантів немає, замовлення йде лише в адмін-чат.
+    Повертає результат відправки для кожного отримувача.
+    """
+    table = await session.get(Table, order.table_id, options=[selectinload(Table.assigned_waiters)])
+    table_name = table.name if table else str(order.table_id)
+    order_details_text = (f"📝 <b>Нове замовлення зі столика: {html.bold(table_name)} (ID: #{order.id})</b>\n\n"
+                          f"<b>Склад:</b>\n- " + html.quote((order.products or '').replace(", ", "\n- ")) +
+                          f"\n\n<b>Сума:</b> {order.total_price} грн")
+
+    # Клавіатура для офіціантів (Прийняти) та для адмін-чату (Керувати)
+    kb_waiter = InlineKeyboardBuilder()
+    kb_waiter.row(InlineKeyboardButton(text="✅ Прийняти замовлення", callback_data=f"waiter_accept_order_{order.id}"))
+    kb_admin = InlineKeyboardBuilder()
+    kb_admin.row(InlineKeyboardButton(text="⚙️ Керувати (Адмін)", callback_data=f"waiter_manage_order_{order.id}"))
+
+    settings = await get_settings_snapshot()
+    admin_chat_id = None
+    if settings.admin_chat_id:
         try:
-            await client_bot.send_message(order.user_id, client_text)
-        except Exception as e:
-            logger.error(f"Не вдалося сповістити клієнта {order.user_id}: {e}")
+            admin_chat_id = int(settings.admin_chat_id)
+        except ValueError:
+            logger.warning(f"Некоректний admin_chat_id: {settings.admin_chat_id}")
+
+    waiter_chat_ids = {w.telegram_user_id for w in (table.assigned_waiters if table else []) if w.telegram_user_id and w.is_on_shift}
+
+    notifications = []
+    if waiter_chat_ids:
+        waiter_markup = kb_waiter.as_markup()
+        notifications = [
+            Notification(admin_bot, chat_id, order_details_text, label="офіціанту", kwargs={"reply_markup": waiter_markup})
+            for chat_id in waiter_chat_ids
+        ]
+        # Копія в адмін-чат (якщо він є і це не один з офіціантів)
+        if admin_chat_id and admin_chat_id not in waiter_chat_ids:
+            notifications.append(Notification(admin_bot, admin_chat_id, "✅ " + order_details_text,
+                                              label="в адмін-чат", kwargs={"reply_markup": kb_admin.as_markup()}))
+    elif admin_chat_id:
+        notifications.append(Notification(
+            admin_bot, admin_chat_id,
+            f"❗️ <b>Замовлення з вільного столика {html.bold(table_name)} (ID: #{order.id})!</b>\n\n" + order_details_text +
+            "\n\n<i>(Жоден офіціант не був на зміні або не призначений на цей столик)</i>",
+            label="в адмін-чат", kwargs={"reply_markup": kb_admin.as_markup()}
+        ))
+    else:
+        logger.error(f"Немає ані офіціантів, ані адмін-чату для замовлення #{order.id}")
+
+    return await send_notifications(notifications)
@@ -0,0 +1,78 @@
+# order_items.py
+
+import logging
+from typing import Dict, Iterable, List
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Order, OrderItem, Product
+
+logger = logging.getLogger(__name__)
+
+
+def parse_products_string(products_str: str) -> Dict[str, int]:
+    """Розбирає рядок 'Назва x Кількість, ...' на словник (потрібно лише для старих замовлень)."""
+    if not products_str: return {}
+    products_dict = {}
+    for part in products_str.split(', '):
+        try:
+            name, quantity_str = part.rsplit(' x ', 1)
+            products_dict[name] = int(quantity_str)
+        except ValueError:
+            logger.warning(f"Не вдалося розібрати частину рядка продукту: {part}")
+    return products_dict
+
+
+def format_products_string(items: Iterable[OrderItem]) -> str:
+    """Текстовий опис складу 'Назва x Кількість, ...' для повідомлень та списків."""
+    return ", ".join([f"{item.name} x {item.quantity}" for item in items])
+
+
+async def build_order_items(session: AsyncSession, quantities: Dict[int, int]) -> List[OrderItem]:
+    """
+    Створює позиції замовлення зі словника {product_id: кількість}.
+    Назва та ціна беруться з БД на момент замовлення; невідомі страви та нульові кількості пропускаються.
+    """
+    quantities = {pid: qty for pid, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return []
+    products_res = await session.execute(select(Product).where(Product.id.in_(list(quantities.keys()))))
+    products = {p.id: p for p in products_res.scalars().all()}
+
+    items = []
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is None:
+            logger.warning(f"Страву #{product_id} не знайдено, позицію пропущено.")
+            continue
+        items.append(OrderItem(product_id=product.id, name=product.name, price=product.price, quantity=quantity))
+    return items
+
+
+def apply_order_items(order: Order, items: List[OrderItem]):
+    """Замінює позиції замовлення та оновлює текстовий склад і суму."""
+    order.items = items
+    refresh_order_totals(order)
+
+
+def refresh_order_totals(order: Order):
+    """Перераховує products та total_price з позицій (після зміни кількості чи видалення позиції)."""
+    order.products = format_products_string(order.items)
+    order.total_price = sum(item.price * item.quantity for item in order.items)
+
+
+def quantities_from_items(raw_items: Iterable[dict]) -> Dict[int, int]:
+    """
+    Перетворює позиції з кошика сайту/QR-меню ([{"id": 1, "quantity": 2}, ...]) на {product_id: кількість}.
+    Некоректні записи пропускаються, повтори однієї страви сумуються.
+    """
+    quantities: Dict[int, int] = {}
+    for raw in raw_items:
+        try:
+            product_id, quantity = int(raw.get('id')), int(raw.get('quantity', 0))
+        except (TypeError, ValueError, AttributeError):
+            continue
+        if quantity > 0:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
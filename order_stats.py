@@ -0,0 +1,180 @@
+# order_stats.py
+
+import asyncio
+import logging
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from models import Employee, Order, OrderDailyStat, async_session_maker, create_db_tables, engine
+
+logger = logging.getLogger(__name__)
+
+# Поля замовлення, від яких залежить рядок у order_daily_stats
+TRACKED_FIELDS = ("created_at", "order_type", "status_id", "completed_by_courier_id", "total_price")
+_OLD_ROWS_KEY = "order_stats_old_rows"
+
+StatKey = Tuple[date, str, int, int]
+
+
+def _to_day(value: Any) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    # SQLite func.date() та сирі значення повертає рядком
+    return date.fromisoformat(str(value)[:10])
+
+
+def _key(row) -> StatKey:
+    return (_to_day(row.created_at), row.order_type or 'delivery', row.status_id, row.completed_by_courier_id or 0)
+
+
+def _select_rows(connection, order_ids: Iterable[int], for_update: bool = False) -> List[Any]:
+    query = (
+        sa.select(Order.id, Order.created_at, Order.order_type, Order.status_id, Order.completed_by_courier_id, Order.total_price)
+        .where(Order.id.in_(list(order_ids)))
+    )
+    if for_update:
+        # Інакше дві транзакції прочитають однакові старі значення й обидві віднімуть замовлення з того самого рядка
+        query = query.with_for_update()
+    return connection.execute(query).all()
+
+
+def _upsert_statement():
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Статистика замовлень не підтримує БД {dialect}")
+    statement = insert(OrderDailyStat)
+    return statement.on_conflict_do_update(
+        index_elements=[OrderDailyStat.day, OrderDailyStat.order_type, OrderDailyStat.status_id, OrderDailyStat.courier_id],
+        set_={
+            "orders": OrderDailyStat.orders + statement.excluded.orders,
+            "revenue": OrderDailyStat.revenue + statement.excluded.revenue,
+        },
+    )
+
+
+def _changed_orders(session: Session) -> List[Order]:
+    return [
+        obj for obj in session.dirty
+        if isinstance(obj, Order) and any(sa.inspect(obj).attrs[f].history.has_changes() for f in TRACKED_FIELDS)
+    ]
+
+
+@sa.event.listens_for(Session, "before_flush")
+def _capture_old_rows(session: Session, flush_context, instances):
+    """Запам'ятовує, в яких рядках статистики рахувалися замовлення до зміни чи видалення (значення беруться з БД)."""
+    order_ids = [o.id for o in _changed_orders(session)]
+    order_ids += [o.id for o in session.deleted if isinstance(o, Order) and o.id is not None]
+    if order_ids:
+        session.info[_OLD_ROWS_KEY] = _select_rows(session.connection(), order_ids, for_update=True)
+
+
+@sa.event.listens_for(Session, "after_flush")
+def _apply_deltas(session: Session, flush_context):
+    """
+    Переносить замовлення між рядками order_daily_stats у тій самій транзакції: -1 зі старого рядка, +1 у новий.
+    Працює для змін через ORM; масовий update(Order) по цих полях потребує rebuild_order_stats().
+    """
+    old_rows = session.info.pop(_OLD_ROWS_KEY, [])
+    deleted_ids = {o.id for o in session.deleted if isinstance(o, Order)}
+    new_ids = [o.id for o in session.new if isinstance(o, Order)]
+    new_ids += [row.id for row in old_rows if row.id not in deleted_ids]
+    if not old_rows and not new_ids:
+        return
+
+    connection = session.connection()
+    deltas: Dict[StatKey, List[int]] = defaultdict(lambda: [0, 0])
+    for row in old_rows:
+        delta = deltas[_key(row)]
+        delta[0] -= 1
+        delta[1] -= row.total_price or 0
+    for row in _select_rows(connection, new_ids) if new_ids else []:
+        delta = deltas[_key(row)]
+        delta[0] += 1
+        delta[1] += row.total_price or 0
+
+    values = [
+        {"day": day, "order_type": order_type, "status_id": status_id, "courier_id": courier_id, "orders": orders, "revenue": revenue}
+        for (day, order_type, status_id, courier_id), (orders, revenue) in deltas.items()
+        if orders or revenue
+    ]
+    if values:
+        connection.execute(_upsert_statement(), values)
+
+
+@sa.event.listens_for(Session, "after_rollback")
+def _discard_old_rows(session: Session):
+    session.info.pop(_OLD_ROWS_KEY, None)
+
+
+def courier_report_query(date_from: date, date_to: date, completed_status_ids: List[int]) -> sa.Select:
+    """Виконані замовлення та їх сума по кур'єрах за дні з date_from по date_to включно."""
+    return (
+        sa.select(
+            Employee.full_name,
+            sa.func.sum(OrderDailyStat.orders).label("completed_orders"),
+            sa.func.sum(OrderDailyStat.revenue).label("revenue")
+        )
+        .join(Employee, OrderDailyStat.courier_id == Employee.id) # courier_id = completed_by_courier_id
+        .where(
+            OrderDailyStat.day >= date_from,
+            OrderDailyStat.day <= date_to,
+            OrderDailyStat.status_id.in_(completed_status_ids)
+        )
+        .group_by(Employee.full_name)
+        .having(sa.func.sum(OrderDailyStat.orders) > 0)
+        .order_by(sa.func.sum(OrderDailyStat.orders).desc())
+    )
+
+
+def _day_column():
+    if engine.dialect.name == "sqlite":
+        return sa.func.date(Order.created_at)
+    return sa.cast(Order.created_at, sa.Date)
+
+
+async def rebuild_order_stats() -> int:
+    """Перераховує order_daily_stats з таблиці orders. Повертає кількість рядків статистики."""
+    day = _day_column().label("day")
+    courier_id = sa.func.coalesce(Order.completed_by_courier_id, 0).label("courier_id")
+    async with async_session_maker() as session:
+        if engine.dialect.name == "postgresql":
+            # Поки йде перерахунок, замовлення не змінюються, інакше їхні дельти загубляться
+            await session.execute(sa.text("LOCK TABLE orders IN SHARE MODE"))
+        # У SQLite DELETE першим захоплює блокування запису на весь перерахунок
+        await session.execute(sa.delete(OrderDailyStat))
+        rows = (await session.execute(
+            sa.select(day, Order.order_type, Order.status_id, courier_id,
+                      sa.func.count(Order.id).label("orders"), sa.func.coalesce(sa.func.sum(Order.total_price), 0).label("revenue"))
+            .group_by(day, Order.order_type, Order.status_id, courier_id)
+        )).all()
+        if rows:
+            await session.execute(sa.insert(OrderDailyStat), [
+                {"day": _to_day(row.day), "order_type": row.order_type, "status_id": row.status_id,
+                 "courier_id": row.courier_id, "orders": row.orders, "revenue": row.revenue}
+                for row in rows
+            ])
+        await session.commit()
+    logger.info(f"Статистику замовлень перераховано: {len(rows)} рядків.")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    # Використання: python order_stats.py — перерахувати статистику з нуля (напр. після ручних змін у БД)
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    async def _main():
+        await create_db_tables()
+        await rebuild_order_stats()
+
+    asyncio.run(_main())
@@ -0,0 +1,361 @@
+# outbox.py
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot_instances import get_admin_bot
+from models import Order, OrderItem, OutboxEvent, Product, async_session_maker
+from notification_manager import notify_in_house_order, notify_new_order_to_staff
+from reference_data import get_settings_snapshot
+
+# --- Інтеграція з R-Keeper ---
+try:
+    from r_keeper import RKeeperAPI, close_r_keeper_client
+except ImportError:
+    RKeeperAPI = close_r_keeper_client = None
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+# Як часто воркер перевіряє чергу, якщо його не розбудили (події з інших процесів, відкладені повтори)
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_BATCH_SIZE = 20
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_MAX_BACKOFF = 3600
+# Поки воркер обробляє подію, інші її не беруть; якщо процес впав, подію підхопить інший після цього часу
+OUTBOX_LEASE_SECONDS = 120
+# Скільки днів зберігати оброблені події
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+OUTBOX_PURGE_INTERVAL = 3600
+
+EVENT_NEW_ORDER = "new_order_notification"
+EVENT_IN_HOUSE_ORDER = "in_house_order_notification"
+EVENT_R_KEEPER_ORDER = "r_keeper_order"
+
+OutboxHandler = Callable[[AsyncSession, dict], Awaitable[None]]
+# Пакетний обробник отримує payload-и кількох подій і повертає для кожної None (успіх) або помилку
+OutboxBatchHandler = Callable[[AsyncSession, List[dict]], Awaitable[List[Optional[Exception]]]]
+_handlers: Dict[str, OutboxHandler] = {}
+_batch_handlers: Dict[str, OutboxBatchHandler] = {}
+_give_up_handlers: Dict[str, OutboxHandler] = {}
+
+_wakeup: Optional[asyncio.Event] = None
+_worker_tasks: List[asyncio.Task] = []
+
+
+class OutboxRetry(Exception):
+    """Подію не вдалося обробити зараз; її буде повторено пізніше."""
+
+
+def outbox_handler(kind: str):
+    """Реєструє обробник для подій цього типу."""
+    def decorator(func: OutboxHandler) -> OutboxHandler:
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def outbox_batch_handler(kind: str):
+    """Реєструє обробник, що отримує одразу всі забрані воркером події цього типу (напр. для пакетної відправки)."""
+    def decorator(func: OutboxBatchHandler) -> OutboxBatchHandler:
+        _batch_handlers[kind] = func
+        return func
+    return decorator
+
+
+def outbox_give_up_handler(kind: str):
+    """Реєструє дію, яка виконується, коли спроби для події вичерпано і її позначено як failed."""
+    def decorator(func: OutboxHandler) -> OutboxHandler:
+        _give_up_handlers[kind] = func
+        return func
+    return decorator
+
+
+def wake_outbox():
+    """Будить воркерів, щоб нові події оброблялися одразу, а не на наступному опитуванні."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def enqueue_event(session: AsyncSession, kind: str, payload: dict) -> OutboxEvent:
+    """
+    Додає подію в ту саму транзакцію, що й зміни, які її спричинили (commit робить викликач).
+    Якщо транзакцію відкотять, подія теж зникне; після commit воркери будяться автоматично.
+    """
+    event = OutboxEvent(kind=kind, payload=payload)
+    session.add(event)
+    sa.event.listen(session.sync_session, "after_commit", lambda _session: wake_outbox(), once=True)
+    return event
+
+
+async def enqueue_new_order_events(session: AsyncSession, order: Order):
+    """Події для нового замовлення з сайту чи бота: сповіщення персоналу та (якщо увімкнено) відправка в R-Keeper."""
+    if order.id is None:
+        await session.flush()
+    enqueue_event(session, EVENT_NEW_ORDER, {"order_id": order.id})
+    settings = await get_settings_snapshot()
+    if settings.r_keeper_enabled:
+        order.r_keeper_status = 'pending'
+        enqueue_event(session, EVENT_R_KEEPER_ORDER, {"order_id": order.id})
+
+
+def awaiting_retry_filter():
+    """Події, що чекають повтору після помилки або вже failed. Ті, що зараз у воркера (processing), сюди не входять."""
+    return sa.or_(OutboxEvent.status == 'failed', (OutboxEvent.status == 'pending') & (OutboxEvent.attempts > 0))
+
+
+async def retry_events(session: AsyncSession, event_ids: List[int]) -> int:
+    """
+    Повертає в чергу події, що очікують повтору або вже failed, щоб обробити їх якнайшвидше (з адмін-панелі).
+    Подію, яку зараз обробляє воркер, не чіпаємо: інакше її забрав би ще один воркер і надіслав удруге.
+    """
+    result = await session.execute(
+        sa.update(OutboxEvent)
+        .where(OutboxEvent.id.in_(event_ids), awaiting_retry_filter())
+        .values(status='pending', attempts=0, available_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    sa.event.listen(session.sync_session, "after_commit", lambda _session: wake_outbox(), once=True)
+    return result.rowcount
+
+
+# --- Обробники подій ---
+
+@outbox_handler(EVENT_NEW_ORDER)
+async def _notify_new_order(session: AsyncSession, payload: dict):
+    order = await session.get(Order, payload["order_id"])
+    if not order:
+        return
+    admin_bot = await get_admin_bot()
+    if not admin_bot:
+        logger.info(f"Адмін-бот не налаштований, сповіщення про замовлення #{order.id} не надсилається.")
+        return
+    # Повторні спроби для окремих отримувачів робить диспетчер; подію не повторюємо, щоб не дублювати повідомлення
+    await notify_new_order_to_staff(admin_bot, order, session)
+
+
+@outbox_handler(EVENT_IN_HOUSE_ORDER)
+async def _notify_in_house_order(session: AsyncSession, payload: dict):
+    order = await session.get(Order, payload["order_id"])
+    if not order:
+        return
+    admin_bot = await get_admin_bot()
+    if not admin_bot:
+        # Замовлення зі столика без сповіщення ніхто не побачить — чекаємо, поки бот з'явиться
+        raise OutboxRetry("Адмін-бот не налаштований")
+    await notify_in_house_order(admin_bot, order, session)
+
+
+@outbox_batch_handler(EVENT_R_KEEPER_ORDER)
+async def _send_orders_to_r_keeper(session: AsyncSession, payloads: List[dict]) -> List[Optional[Exception]]:
+    order_ids = [payload["order_id"] for payload in payloads]
+    orders = {o.id: o for o in (await session.execute(sa.select(Order).where(Order.id.in_(order_ids)))).scalars()}
+
+    settings = await get_settings_snapshot()
+    if not settings.r_keeper_enabled or RKeeperAPI is None:
+        if RKeeperAPI is None:
+            logger.warning("r_keeper.py не знайдено, інтеграція з R-Keeper вимкнена.")
+        # Інтеграцію вимкнули, поки замовлення чекали в черзі
+        for order in orders.values():
+            order.r_keeper_status = None
+        return [None] * len(payloads)
+
+    rows = await session.execute(
+        sa.select(OrderItem.order_id, OrderItem.quantity, OrderItem.price, Product.r_keeper_id)
+        .join(Product, OrderItem.product_id == Product.id)
+        .where(OrderItem.order_id.in_(order_ids), Product.r_keeper_id.isnot(None))
+        .order_by(OrderItem.id)
+    )
+    items_by_order: Dict[int, List[dict]] = {}
+    for r in rows:
+        items_by_order.setdefault(r.order_id, []).append({"r_keeper_id": r.r_keeper_id, "quantity": r.quantity, "price": r.price})
+
+    to_send = [(orders[order_id], items_by_order[order_id]) for order_id in dict.fromkeys(order_ids)
+               if order_id in orders and order_id in items_by_order]
+    delivered = await RKeeperAPI(settings).send_orders(to_send) if to_send else {}
+
+    errors: List[Optional[Exception]] = []
+    for order_id in order_ids:
+        order = orders.get(order_id)
+        if order is None:
+            errors.append(None)
+        elif order_id not in items_by_order:
+            # Жодна страва не має r_keeper_id — передавати нічого
+            order.r_keeper_status = None
+            errors.append(None)
+        elif delivered.get(order_id):
+            order.r_keeper_status = 'sent'
+            order.r_keeper_sent_at = datetime.now()
+            errors.append(None)
+        else:
+            errors.append(OutboxRetry(f"R-Keeper не прийняв замовлення #{order_id}"))
+    return errors
+
+
+@outbox_give_up_handler(EVENT_R_KEEPER_ORDER)
+async def _mark_r_keeper_failed(session: AsyncSession, payload: dict):
+    order = await session.get(Order, payload["order_id"])
+    if order:
+        order.r_keeper_status = 'failed'
+
+
+# --- Воркери ---
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(5 * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF))
+
+
+async def _claim_due_events() -> List[Tuple[int, str]]:
+    """
+    Забирає в обробку події, час яких настав. UPDATE з тими самими умовами, що й вибірка,
+    гарантує, що одну подію не візьмуть два воркери (чи два процеси) одночасно.
+    Забрана подія стає processing до кінця оренди; якщо процес впав, її підхопить інший воркер після оренди.
+    """
+    now = datetime.now()
+    due = sa.and_(OutboxEvent.status.in_(('pending', 'processing')), OutboxEvent.available_at <= now)
+    async with async_session_maker() as session:
+        due_ids = (await session.execute(
+            sa.select(OutboxEvent.id)
+            .where(due)
+            .order_by(OutboxEvent.id).limit(OUTBOX_BATCH_SIZE)
+        )).scalars().all()
+        if not due_ids:
+            return []
+        claimed = (await session.execute(
+            sa.update(OutboxEvent)
+            .where(OutboxEvent.id.in_(due_ids), due)
+            .values(status='processing', available_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS), attempts=OutboxEvent.attempts + 1)
+            .returning(OutboxEvent.id, OutboxEvent.kind)
+            .execution_options(synchronize_session=False)
+        )).all()
+        await session.commit()
+        return [(event_id, kind) for event_id, kind in claimed]
+
+
+async def _record_outcome(session: AsyncSession, event: OutboxEvent, error: Optional[Exception]):
+    if error is None:
+        event.status = 'done'
+        event.processed_at = datetime.now()
+        event.last_error = None
+        return
+
+    event.last_error = str(error)[:1000]
+    if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+        event.status = 'failed'
+        logger.error(f"Подію #{event.id} ({event.kind}) не оброблено після {event.attempts} спроб: {error}")
+        give_up = _give_up_handlers.get(event.kind)
+        if give_up:
+            await give_up(session, dict(event.payload or {}))
+    else:
+        event.status = 'pending'
+        event.available_at = datetime.now() + _backoff(event.attempts)
+        logger.warning(f"Подію #{event.id} ({event.kind}) буде повторено о {event.available_at:%H:%M:%S}: {error}")
+
+
+async def _process_event(event_id: int):
+    async with async_session_maker() as session:
+        event = await session.get(OutboxEvent, event_id)
+        if not event:
+            return
+        kind, payload = event.kind, dict(event.payload or {})
+        try:
+            handler = _handlers.get(kind)
+            if handler is None:
+                raise ValueError(f"Невідомий тип події: {kind}")
+            await handler(session, payload)
+        except Exception as e:
+            await session.rollback()
+            event = await session.get(OutboxEvent, event_id)
+            await _record_outcome(session, event, e)
+        else:
+            await _record_outcome(session, event, None)
+        await session.commit()
+
+
+async def _process_batch(kind: str, event_ids: List[int]):
+    async def load_events():
+        return (await session.execute(
+            sa.select(OutboxEvent).where(OutboxEvent.id.in_(event_ids)).order_by(OutboxEvent.id)
+        )).scalars().all()
+
+    async with async_session_maker() as session:
+        events = await load_events()
+        try:
+            errors = await _batch_handlers[kind](session, [dict(e.payload or {}) for e in events])
+        except Exception as e:
+            await session.rollback()
+            events = await load_events()
+            errors = [e] * len(events)
+        for event, error in zip(events, errors):
+            await _record_outcome(session, event, error)
+        await session.commit()
+
+
+async def _purge_processed_events():
+    cutoff = datetime.now() - timedelta(days=OUTBOX_RETENTION_DAYS)
+    async with async_session_maker() as session:
+        result = await session.execute(
+            sa.delete(OutboxEvent).where(OutboxEvent.status == 'done', OutboxEvent.processed_at < cutoff)
+        )
+        await session.commit()
+    if result.rowcount:
+        logger.info(f"Видалено {result.rowcount} оброблених подій outbox.")
+
+
+async def _worker_loop(worker_number: int):
+    last_purge = 0.0
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            if worker_number == 0 and loop.time() - last_purge > OUTBOX_PURGE_INTERVAL:
+                last_purge = loop.time()
+                await _purge_processed_events()
+
+            claimed = await _claim_due_events()
+            if claimed:
+                ids_by_kind: Dict[str, List[int]] = {}
+                for event_id, kind in claimed:
+                    ids_by_kind.setdefault(kind, []).append(event_id)
+                jobs = []
+                for kind, event_ids in ids_by_kind.items():
+                    if kind in _batch_handlers:
+                        jobs.append(_process_batch(kind, event_ids))
+                    else:
+                        jobs.extend(_process_event(event_id) for event_id in event_ids)
+                await asyncio.gather(*jobs)
+                if len(claimed) == OUTBOX_BATCH_SIZE:
+                    continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Помилка воркера outbox #{worker_number}: {e}", exc_info=True)
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_outbox_workers():
+    global _wakeup
+    _wakeup = asyncio.Event()
+    _worker_tasks.extend(asyncio.create_task(_worker_loop(n)) for n in range(OUTBOX_WORKERS))
+    logger.info(f"Запущено воркерів outbox: {OUTBOX_WORKERS}.")
+
+
+async def stop_outbox_workers():
+    global _wakeup
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
+    _wakeup = None
+    if close_r_keeper_client is not None:
+        await close_r_keeper_client()
@@ -0,0 +1,106 @@
+# pagination.py
+
+import html
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Скільки секунд вважати загальну кількість записів актуальною
+COUNT_CACHE_TTL = 60
+# Скільки лічильників тримати в пам'яті: кожен новий пошуковий запит — окремий запис
+COUNT_CACHE_MAX_SIZE = 256
+
+
+@dataclass
+class KeysetPage:
+    """Сторінка списку, отримана за курсором (id першого/останнього запису), а не через OFFSET."""
+    items: List[Any]
+    next_after: Optional[int]
+    prev_before: Optional[int]
+
+
+async def keyset_paginate(session: AsyncSession, query: sa.Select, key_column, per_page: int,
+                          after: Optional[int] = None, before: Optional[int] = None) -> KeysetPage:
+    """
+    Повертає сторінку записів, відсортованих за key_column за спаданням (новіші першими).
+    after — показати записи, старіші за цей id; before — новіші за цей id.
+    Кожна сторінка — це пошук за індексом первинного ключа, тож сторінка N коштує стільки ж, скільки перша.
+    """
+    query = query.order_by(None)
+    if before is not None:
+        # Йдемо "назад": беремо найближчі новіші записи за зростанням і розвертаємо
+        result = await session.execute(query.where(key_column > before).order_by(key_column.asc()).limit(per_page + 1))
+        rows = list(result.unique().scalars().all())
+        has_newer = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_older = True
+    else:
+        if after is not None:
+            query = query.where(key_column < after)
+        result = await session.execute(query.order_by(key_column.desc()).limit(per_page + 1))
+        rows = list(result.unique().scalars().all())
+        has_older = len(rows) > per_page
+        items = rows[:per_page]
+        has_newer = after is not None
+
+    key_name = key_column.key
+    return KeysetPage(
+        items=items,
+        next_after=getattr(items[-1], key_name) if items and has_older else None,
+        prev_before=getattr(items[0], key_name) if items and has_newer else None,
+    )
+
+
+class CountCache:
+    """
+    Загальна кількість записів для списків адмінки з коротким TTL.
+    COUNT(*) по великій таблиці не рахується на кожен перехід між сторінками.
+    Найдавніше використані записи витісняються, тож різні пошукові запити не накопичуються без меж.
+    """
+    def __init__(self, ttl: int = COUNT_CACHE_TTL, max_size: int = COUNT_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._counts: "OrderedDict[Tuple[str, str], Tuple[float, int]]" = OrderedDict()
+
+    async def get(self, session: AsyncSession, name: str, query: sa.Select, search: Optional[str] = None) -> int:
+        key = (name, search or "")
+        cached = self._counts.get(key)
+        now = time.monotonic()
+        if cached and now - cached[0] < self.ttl:
+            self._counts.move_to_end(key)
+            return cached[1]
+
+        count_query = sa.select(sa.func.count()).select_from(query.order_by(None).subquery())
+        total = (await session.execute(count_query)).scalar_one_or_none() or 0
+        self._counts[key] = (now, total)
+        self._counts.move_to_end(key)
+        while len(self._counts) > self.max_size:
+            self._counts.popitem(last=False)
+        return total
+
+    def invalidate(self, name: Optional[str] = None):
+        if name is None:
+            self._counts.clear()
+        else:
+            for key in [k for k in self._counts if k[0] == name]:
+                del self._counts[key]
+
+
+count_cache = CountCache()
+
+
+def render_keyset_pagination(base_url: str, page: KeysetPage, search: Optional[str] = None) -> str:
+    """HTML-блок навігації «новіші / старіші» для списків адмінки."""
+    extra = {"search": search} if search else {}
+    links = []
+    if page.prev_before is not None:
+        links.append(f'<a href="{base_url}?{html.escape(urlencode(extra))}">⏮ Перша</a>')
+        links.append(f'<a href="{base_url}?{html.escape(urlencode({**extra, "before": page.prev_before}))}">« Новіші</a>')
+    if page.next_after is not None:
+        links.append(f'<a href="{base_url}?{html.escape(urlencode({**extra, "after": page.next_after}))}">Старіші »</a>')
+    return f"<div class='pagination'>{' '.join(links)}</div>" if links else ""
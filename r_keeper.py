@@ -1,7 +1,10 @@
 # r_keeper.py
+import asyncio
 import logging
+import os
+import time
 import httpx
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
@@ -12,111 +15,291 @@ from models import Order, Settings
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Таймауты и пул соединений для R-Keeper (секунды / количество соединений)
+R_KEEPER_CONNECT_TIMEOUT = float(os.getenv("R_KEEPER_CONNECT_TIMEOUT", "5"))
+R_KEEPER_TIMEOUT = float(os.getenv("R_KEEPER_TIMEOUT", "15"))
+R_KEEPER_MAX_CONNECTIONS = int(os.getenv("R_KEEPER_MAX_CONNECTIONS", "10"))
+# Сколько жить токену, если /login не вернул expires_in; обновляем чуть раньше срока
+R_KEEPER_TOKEN_TTL = int(os.getenv("R_KEEPER_TOKEN_TTL", "3600"))
+TOKEN_REFRESH_MARGIN = 30
+# Больше 1 — заказы из очереди отправляются пакетами через /orders/batch (если API это поддерживает)
+R_KEEPER_BATCH_SIZE = int(os.getenv("R_KEEPER_BATCH_SIZE", "1"))
+
+
+class RKeeperClient:
+    """
+    Общий для процесса HTTP-клиент R-Keeper: держит пул keep-alive соединений
+    и кэширует токен авторизации до истечения срока или ответа 401.
+    """
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        # (api_url, user, password) -> (token, monotonic-время истечения)
+        self._tokens: Dict[Tuple[str, str, str], Tuple[str, float]] = {}
+        self._login_lock = asyncio.Lock()
+        # Становится False, если сервер ответил, что /orders/batch не существует
+        self.batch_supported = True
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(R_KEEPER_TIMEOUT, connect=R_KEEPER_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=R_KEEPER_MAX_CONNECTIONS,
+                                    max_keepalive_connections=R_KEEPER_MAX_CONNECTIONS),
+            )
+        return self._client
+
+    async def get_token(self, api_url: str, user: str, password: str, stale_token: Optional[str] = None) -> Optional[str]:
+        """
+        Возвращает действующий токен, выполняя /login только при его отсутствии или истечении.
+        stale_token — токен, на который сервер ответил 401: его нужно заменить, даже если срок не вышел.
+        """
+        key = (api_url, user, password)
+        cached = self._tokens.get(key)
+        if cached and cached[0] != stale_token and cached[1] > time.monotonic():
+            return cached[0]
+
+        async with self._login_lock:
+            # Пока ждали блокировку, токен мог обновить другой запрос
+            cached = self._tokens.get(key)
+            if cached and cached[0] != stale_token and cached[1] > time.monotonic():
+                return cached[0]
+            self._tokens.pop(key, None)
+
+            try:
+                response = await self.http.post(f"{api_url}/login", json={"user": user, "password": password})
+                response.raise_for_status()
+            except httpx.RequestError as e:
+                logger.error(f"Failed to connect to R-Keeper for authentication: {e}")
+                return None
+            except httpx.HTTPStatusError as e:
+                logger.error(f"Authentication failed for R-Keeper. Status: {e.response.status_code}, Body: {e.response.text}")
+                return None
+
+            # ПРЕДПОЛОЖЕНИЕ: API возвращает {"access_token": "...", "expires_in": <секунды>} (expires_in необязателен)
+            body = response.json()
+            token = body.get("access_token")
+            if not token:
+                logger.error("R-Keeper /login response has no access_token.")
+                return None
+            ttl = int(body.get("expires_in") or R_KEEPER_TOKEN_TTL)
+            self._tokens[key] = (token, time.monotonic() + max(ttl - TOKEN_REFRESH_MARGIN, 1))
+            logger.info("Successfully authenticated with R-Keeper API.")
+            return token
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._tokens.clear()
+
+
+r_keeper_client = RKeeperClient()
+
+
+async def close_r_keeper_client():
+    """Закрывает соединения с R-Keeper при остановке приложения."""
+    await r_keeper_client.close()
+
+
 class RKeeperAPI:
     """
     Класс для взаимодействия с API R-Keeper.
+    Создаётся на каждый заказ из текущих настроек; соединения и токен берутся из общего r_keeper_client.
     """
-    def __init__(self, settings: Settings):
-        self.api_url = settings.r_keeper_api_url
+    def __init__(self, settings: Settings, client: Optional[RKeeperClient] = None):
+        self.api_url = (settings.r_keeper_api_url or "").rstrip("/")
         self.user = settings.r_keeper_user
         self.password = settings.r_keeper_password
         self.station_code = settings.r_keeper_station_code
         self.payment_type = settings.r_keeper_payment_type
         self.enabled = settings.r_keeper_enabled
-        self.token = None
+        self.client = client or r_keeper_client
 
-    async def _get_auth_token(self, client: httpx.AsyncClient) -> str | None:
+    async def _get_auth_token(self, stale_token: Optional[str] = None) -> str | None:
         """
-        Получает токен аутентификации.
+        Получает токен аутентификации (из кэша или через /login).
         Примечание: Этот метод является примером. Реальная аутентификация может отличаться.
         """
         if not self.user or not self.password:
             logger.warning("R-Keeper user/password not set. Cannot authenticate.")
             return None
-            
-        auth_url = f"{self.api_url}/login"
-        try:
-            response = await client.post(auth_url, json={"user": self.user, "password": self.password})
-            response.raise_for_status()
-            # ПРЕДПОЛОЖЕНИЕ: API возвращает токен в формате {"access_token": "..."}
-            self.token = response.json().get("access_token")
-            logger.info("Successfully authenticated with R-Keeper API.")
-            return self.token
-        except httpx.RequestError as e:
-            logger.error(f"Failed to connect to R-Keeper for authentication: {e}")
-            return None
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Authentication failed for R-Keeper. Status: {e.response.status_code}, Body: {e.response.text}")
+        return await self.client.get_token(self.api_url, self.user, self.password, stale_token)
+
+    def _build_order_data(self, order: Order, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # --- ВАЖНО: Адаптируйте эту структуру под ваше API R-Keeper ---
+        # Это примерная структура тела запроса на создание заказа.
+        return {
+            "stationCode": self.station_code,
+            "orderNumber": f"TG-{order.id}", # Уникальный номер заказа
+            "comment": f"Клиент: {order.customer_name}, Телефон: {order.phone_number}",
+            "customer": {
+                "name": order.customer_name,
+                "phone": order.phone_number,
+                "address": order.address if order.is_delivery else "Самовивіз"
+            },
+            "items": [
+                {
+                    "id": item['r_keeper_id'], # Идентификатор блюда в R-Keeper
+                    "quantity": item['quantity'],
+                    "price": item['price'] # Цена за единицу
+                }
+                for item in items if item.get('r_keeper_id')
+            ],
+            "payment": {
+                "type": self.payment_type,
+                "amount": order.total_price
+            },
+            "deliveryInfo": {
+                "type": "delivery" if order.is_delivery else "pickup",
+                "time": order.delivery_time
+            }
+        }
+        # --- Конец блока для адаптации ---
+
+    def _ready_to_send(self) -> bool:
+        if not all([self.api_url, self.station_code, self.payment_type]):
+            logger.error("R-Keeper API URL, station code, or payment type not configured. Cannot send order.")
+            return False
+        return True
+
+    async def _request(self, method: str, path: str, headers: Optional[Dict[str, str]] = None, **kwargs) -> Optional[httpx.Response]:
+        """Запрос с токеном; на 401 логинимся заново и повторяем один раз. None — если не удалось авторизоваться."""
+        token = await self._get_auth_token()
+        if not token:
             return None
+        url = f"{self.api_url}{path}"
+        response = await self.client.http.request(method, url, headers={**(headers or {}), "Authorization": f"Bearer {token}"}, **kwargs)
+        if response.status_code == 401:
+            # Токен отозван или истёк раньше срока
+            token = await self._get_auth_token(stale_token=token)
+            if not token:
+                return None
+            response = await self.client.http.request(method, url, headers={**(headers or {}), "Authorization": f"Bearer {token}"}, **kwargs)
+        return response
 
-    async def send_order(self, order: Order, items: List[Dict[str, Any]]):
+    async def _post(self, path: str, payload: Dict[str, Any]) -> Optional[httpx.Response]:
+        return await self._request("POST", path, json=payload)
+
+    async def send_order(self, order: Order, items: List[Dict[str, Any]]) -> bool:
         """
         Отправляет заказ в R-Keeper.
 
         :param order: Объект заказа из нашей БД.
         :param items: Список словарей с деталями товаров в заказе. 
                       Каждый словарь должен содержать 'r_keeper_id', 'quantity', 'price'.
+        :return: False, если заказ не доставлен и отправку стоит повторить позже.
         """
         if not self.enabled:
             logger.info("R-Keeper integration is disabled. Skipping order sending.")
-            return
+            return True
+        if not self._ready_to_send():
+            return False
 
-        if not all([self.api_url, self.station_code, self.payment_type]):
-            logger.error("R-Keeper API URL, station code, or payment type not configured. Cannot send order.")
-            return
-
-        async with httpx.AsyncClient() as client:
-            # ПРЕДПОЛОЖЕНИЕ: Для каждого запроса нужен свежий токен. 
-            # Если токен долгоживущий, можно оптимизировать.
-            if not await self._get_auth_token(client):
-                return
-
-            headers = {"Authorization": f"Bearer {self.token}"}
-
-            # --- ВАЖНО: Адаптируйте эту структуру под ваше API R-Keeper ---
-            # Это примерная структура тела запроса на создание заказа.
-            order_data = {
-                "stationCode": self.station_code,
-                "orderNumber": f"TG-{order.id}", # Уникальный номер заказа
-                "comment": f"Клиент: {order.customer_name}, Телефон: {order.phone_number}",
-                "customer": {
-                    "name": order.customer_name,
-                    "phone": order.phone_number,
-                    "address": order.address if order.is_delivery else "Самовивіз"
-                },
-                "items": [
-                    {
-                        "id": item['r_keeper_id'], # Идентификатор блюда в R-Keeper
-                        "quantity": item['quantity'],
-                        "price": item['price'] # Цена за единицу
-                    }
-                    for item in items if item.get('r_keeper_id')
-                ],
-                "payment": {
-                    "type": self.payment_type,
-                    "amount": order.total_price
-                },
-                "deliveryInfo": {
-                    "type": "delivery" if order.is_delivery else "pickup",
-                    "time": order.delivery_time
-                }
-            }
-            # --- Конец блока для адаптации ---
+        order_data = self._build_order_data(order, items)
+        # Проверяем, есть ли что отправлять (вдруг ни у одного товара не было r_keeper_id)
+        if not order_data["items"]:
+            logger.warning(f"Order #{order.id} has no items with R-Keeper IDs. Skipping sending to R-Keeper.")
+            return True
+
+        try:
+            response = await self._post("/orders", order_data)
+            if response is None:
+                return False
+            response.raise_for_status()
+            logger.info(f"Order #{order.id} successfully sent to R-Keeper. Response: {response.json()}")
+            return True
+        except httpx.RequestError as e:
+            logger.error(f"Failed to connect to R-Keeper to send order #{order.id}: {e}")
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Failed to send order #{order.id} to R-Keeper. Status: {e.response.status_code}, Body: {e.response.text}")
+        return False
 
-            # Проверяем, есть ли что отправлять (вдруг ни у одного товара не было r_keeper_id)
-            if not order_data["items"]:
-                logger.warning(f"Order #{order.id} has no items with R-Keeper IDs. Skipping sending to R-Keeper.")
-                return
+    async def send_orders(self, orders: List[Tuple[Order, List[Dict[str, Any]]]]) -> Dict[int, bool]:
+        """
+        Отправляет несколько заказов: пакетами по R_KEEPER_BATCH_SIZE через /orders/batch, если это включено
+        и поддерживается API, иначе по одному (параллельно). Возвращает {order.id: доставлен ли заказ}.
+        """
+        if R_KEEPER_BATCH_SIZE <= 1 or len(orders) <= 1 or not self.client.batch_supported or not self.enabled:
+            results = await asyncio.gather(*(self.send_order(order, items) for order, items in orders))
+            return {order.id: ok for (order, _), ok in zip(orders, results)}
 
-            try:
-                order_url = f"{self.api_url}/orders"
-                response = await client.post(order_url, json=order_data, headers=headers)
-                response.raise_for_status()
-                logger.info(f"Order #{order.id} successfully sent to R-Keeper. Response: {response.json()}")
-            except httpx.RequestError as e:
-                logger.error(f"Failed to connect to R-Keeper to send order #{order.id}: {e}")
-            except httpx.HTTPStatusError as e:
-                logger.error(f"Failed to send order #{order.id} to R-Keeper. Status: {e.response.status_code}, Body: {e.response.text}")
+        results: Dict[int, bool] = {}
+        for start in range(0, len(orders), R_KEEPER_BATCH_SIZE):
+            results.update(await self._send_batch(orders[start:start + R_KEEPER_BATCH_SIZE]))
+        return results
+
+    async def _send_batch(self, orders: List[Tuple[Order, List[Dict[str, Any]]]]) -> Dict[int, bool]:
+        if not self._ready_to_send():
+            return {order.id: False for order, _ in orders}
+
+        batch = [(order, self._build_order_data(order, items)) for order, items in orders]
+        results = {order.id: True for order, data in batch if not data["items"]}
+        batch = [(order, data) for order, data in batch if data["items"]]
+        if not batch:
+            return results
+
+        try:
+            response = await self._post("/orders/batch", {"orders": [data for _, data in batch]})
+            if response is None:
+                return {**results, **{order.id: False for order, _ in batch}}
+            if response.status_code in (404, 405):
+                logger.warning("R-Keeper API does not support batch submission. Falling back to single orders.")
+                self.client.batch_supported = False
+                return {**results, **await self.send_orders([(order, items) for order, items in orders if order.id not in results])}
+            response.raise_for_status()
+        except httpx.RequestError as e:
+            logger.error(f"Failed to connect to R-Keeper to send a batch of {len(batch)} orders: {e}")
+            return {**results, **{order.id: False for order, _ in batch}}
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Failed to send a batch of {len(batch)} orders to R-Keeper. Status: {e.response.status_code}, Body: {e.response.text}")
+            return {**results, **{order.id: False for order, _ in batch}}
+
+        # ПРЕДПОЛОЖЕНИЕ: API возвращает {"results": [{"orderNumber": "TG-1", "status": "accepted"}, ...]}
+        accepted = {r.get("orderNumber") for r in response.json().get("results", []) if r.get("status") == "accepted"}
+        for order, data in batch:
+            results[order.id] = data["orderNumber"] in accepted
+            if not results[order.id]:
+                logger.error(f"R-Keeper rejected order #{order.id} in batch.")
+        logger.info(f"Batch of {len(batch)} orders sent to R-Keeper, accepted: {len(accepted)}.")
+        return results
+
+    async def fetch_menu(self, since: Optional[str] = None, etag: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Загружает меню R-Keeper.
+
+        :param since: Версия меню из прошлой синхронизации — сервер вернёт только изменённые после неё позиции.
+        :param etag: ETag прошлого ответа — если меню не менялось, сервер ответит 304 без тела.
+        :return: {"not_modified": True}, либо {"version", "items", "etag", "full"}; None при ошибке.
+        """
+        if not self.api_url:
+            logger.error("R-Keeper API URL not configured. Cannot fetch menu.")
+            return None
+        try:
+            response = await self._request("GET", "/menu", params={"since": since} if since else None,
+                                           headers={"If-None-Match": etag} if etag else None)
+            if response is None:
+                return None
+            if response.status_code == 304:
+                return {"not_modified": True}
+            response.raise_for_status()
+        except httpx.RequestError as e:
+            logger.error(f"Failed to connect to R-Keeper to fetch menu: {e}")
+            return None
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Failed to fetch menu from R-Keeper. Status: {e.response.status_code}, Body: {e.response.text}")
+            return None
+
+        # ПРЕДПОЛОЖЕНИЕ: API возвращает {"version": "42", "items": [{"id": "1001", "name": "...", "price": 150, "available": true}]}
+        # и без since отдаёт всё меню целиком
+        body = response.json()
+        version = body.get("version")
+        return {
+            "version": str(version) if version is not None else None,
+            "items": body.get("items", []),
+            "etag": response.headers.get("ETag"),
+            "full": since is None,
+        }
 
 # REMOVED: Видалено невикористовувану функцію send_order_to_rkeeper
 # Вона дублювала логіку, яка вже є в main.py, і ніколи не викликалася.
@@ -0,0 +1,195 @@
+# r_keeper_sync.py
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import sqlalchemy as sa
+
+from leader_election import LeaderLease, run_as_leader
+from menu_cache import invalidate_menu_cache
+from models import Product, RKeeperMenuSync, async_session_maker
+from reference_data import get_settings_snapshot
+
+try:
+    from r_keeper import RKeeperAPI
+except ImportError:
+    RKeeperAPI = None
+
+logger = logging.getLogger(__name__)
+
+# Як часто підтягувати зміни меню з R-Keeper, секунд (0 — лише вручну з адмінки)
+R_KEEPER_MENU_SYNC_INTERVAL = int(os.getenv("R_KEEPER_MENU_SYNC_INTERVAL", "300"))
+# Інкрементальна відповідь не містить видалених позицій, тому раз на стільки годин меню звіряється повністю
+R_KEEPER_MENU_FULL_SYNC_HOURS = int(os.getenv("R_KEEPER_MENU_FULL_SYNC_HOURS", "24"))
+# Скільки товарів оновлювати одним executemany
+UPDATE_CHUNK_SIZE = 500
+
+_sync_lock = asyncio.Lock()
+_sync_task: Optional[asyncio.Task] = None
+_manual_task: Optional[asyncio.Task] = None
+
+
+@dataclass
+class MenuSyncResult:
+    full: bool = False
+    not_modified: bool = False
+    fetched: int = 0
+    updated: int = 0
+    deactivated: int = 0
+    unmatched: int = 0
+
+    def summary(self) -> str:
+        if self.not_modified:
+            return "Меню в R-Keeper не змінилося."
+        kind = "Повна синхронізація" if self.full else "Синхронізація змін"
+        return (f"{kind}: отримано позицій {self.fetched}, оновлено товарів {self.updated}, "
+                f"знято з продажу відсутніх у R-Keeper {self.deactivated}, без відповідного товару {self.unmatched}.")
+
+
+def _to_price(value: Any) -> Optional[int]:
+    try:
+        return int(round(float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def _diff(products: List[Any], items: Dict[str, Dict[str, Any]], full: bool, result: MenuSyncResult) -> List[Dict[str, Any]]:
+    """Порівнює товари з позиціями R-Keeper і повертає рядки для пакетного UPDATE (лише змінені товари)."""
+    changes = []
+    matched_ids = set()
+    for product in products:
+        item = items.get(product.r_keeper_id)
+        if item is None:
+            # Позиції немає в повному меню — її прибрали з каси
+            if full and product.is_active:
+                changes.append({"id": product.id, "name": product.name, "price": product.price, "is_active": False})
+                result.deactivated += 1
+            continue
+        matched_ids.add(product.r_keeper_id)
+
+        name = (item.get("name") or "").strip()[:100] or product.name
+        price = _to_price(item.get("price"))
+        price = product.price if price is None else price
+        is_active = bool(item.get("available", True))
+        if (name, price, is_active) != (product.name, product.price, product.is_active):
+            changes.append({"id": product.id, "name": name, "price": price, "is_active": is_active})
+            result.updated += 1
+
+    result.unmatched = len(set(items) - matched_ids)
+    return changes
+
+
+async def sync_r_keeper_menu(full: bool = False) -> Optional[MenuSyncResult]:
+    """
+    Підтягує з R-Keeper ціни, назви та доступність позицій і оновлює товари з відповідним r_keeper_id.
+    Зазвичай просить лише зміни після збереженої версії меню; з full=True (або раз на
+    R_KEEPER_MENU_FULL_SYNC_HOURS) звіряє все меню і знімає з продажу товари, яких у R-Keeper більше немає.
+    Усі зміни пишуться однією транзакцією, кеш меню скидається один раз.
+    Повертає None, якщо інтеграцію вимкнено або R-Keeper не відповів.
+    """
+    settings = await get_settings_snapshot()
+    if not settings.r_keeper_enabled or RKeeperAPI is None:
+        return None
+
+    async with _sync_lock:
+        async with async_session_maker() as session:
+            state = await session.get(RKeeperMenuSync, 1)
+            if state is None:
+                state = RKeeperMenuSync(id=1)
+                session.add(state)
+
+            now = datetime.now()
+            full = (full or state.api_url != settings.r_keeper_api_url or not state.menu_version
+                    or state.last_full_sync_at is None
+                    or now - state.last_full_sync_at > timedelta(hours=R_KEEPER_MENU_FULL_SYNC_HOURS))
+            menu = await RKeeperAPI(settings).fetch_menu(since=None if full else state.menu_version,
+                                                         etag=None if full else state.etag)
+            if menu is None:
+                return None
+
+            result = MenuSyncResult(full=full)
+            state.last_synced_at = now
+            if menu.get("not_modified"):
+                result.not_modified = True
+                state.last_result = result.summary()
+                await session.commit()
+                return result
+
+            items = {str(item["id"]): item for item in menu["items"] if item.get("id") is not None}
+            result.fetched = len(items)
+
+            # Читаємо лише потрібні колонки; при синхронізації змін — лише товари, яких вони стосуються
+            query = sa.select(Product.id, Product.r_keeper_id, Product.name, Product.price, Product.is_active)
+            if full:
+                query = query.where(Product.r_keeper_id.isnot(None), Product.r_keeper_id != '')
+            elif items:
+                query = query.where(Product.r_keeper_id.in_(list(items)))
+            products = (await session.execute(query)).all() if full or items else []
+            changes = _diff(products, items, full, result)
+
+            for start in range(0, len(changes), UPDATE_CHUNK_SIZE):
+                await session.execute(sa.update(Product), changes[start:start + UPDATE_CHUNK_SIZE])
+
+            state.api_url = settings.r_keeper_api_url
+            state.menu_version = menu.get("version")
+            state.etag = menu.get("etag")
+            if full:
+                state.last_full_sync_at = now
+            state.last_result = result.summary()
+            await session.commit()
+
+    if changes:
+        invalidate_menu_cache()
+    logger.info(f"R-Keeper: {result.summary()}")
+    return result
+
+
+async def _sync_loop():
+    while True:
+        try:
+            await sync_r_keeper_menu()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Помилка синхронізації меню з R-Keeper: {e}", exc_info=True)
+        await asyncio.sleep(R_KEEPER_MENU_SYNC_INTERVAL)
+
+
+async def _manual_sync(full: bool):
+    try:
+        await sync_r_keeper_menu(full=full)
+    except Exception as e:
+        logger.error(f"Помилка синхронізації меню з R-Keeper: {e}", exc_info=True)
+
+
+def request_menu_sync(full: bool = False) -> bool:
+    """
+    Запускає синхронізацію у фоні, щоб запит з адмінки не чекав відповіді R-Keeper.
+    Повертає False, якщо попередній ручний запуск ще триває (результат з'явиться на сторінці інтеграції).
+    """
+    global _manual_task
+    if _manual_task is not None and not _manual_task.done():
+        return False
+    _manual_task = asyncio.create_task(_manual_sync(full))
+    return True
+
+
+def start_menu_sync():
+    """Періодична синхронізація меню; виконує лише воркер-лідер, щоб R-Keeper не опитували всі процеси."""
+    global _sync_task
+    if R_KEEPER_MENU_SYNC_INTERVAL <= 0 or RKeeperAPI is None:
+        return
+    _sync_task = asyncio.create_task(run_as_leader(LeaderLease("r_keeper_menu_sync"), _sync_loop))
+
+
+async def stop_menu_sync():
+    global _sync_task, _manual_task
+    for task in (_sync_task, _manual_task):
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    _sync_task = _manual_task = None
@@ -0,0 +1,204 @@
+# reference_data.py
+
+import asyncio
+import logging
+from dataclasses import dataclass, fields, replace
+from os import getenv
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select
+
+from cache_sync import publish_invalidation, register_cache
+from models import OrderStatus, Role, Settings, async_session_maker
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class StatusInfo:
+    id: int
+    name: str
+    notify_customer: bool
+    visible_to_operator: bool
+    visible_to_courier: bool
+    visible_to_waiter: bool
+    is_completed_status: bool
+    is_cancelled_status: bool
+
+    @property
+    def is_final(self) -> bool:
+        return self.is_completed_status or self.is_cancelled_status
+
+
+@dataclass(frozen=True)
+class RoleInfo:
+    id: int
+    name: str
+    can_manage_orders: bool
+    can_be_assigned: bool
+    can_serve_tables: bool
+
+
+@dataclass(frozen=True)
+class SettingsInfo:
+    """Знімок налаштувань лише для читання. Для зміни налаштувань використовуйте модель Settings."""
+    id: Optional[int] = None
+    client_bot_token: Optional[str] = None
+    admin_bot_token: Optional[str] = None
+    admin_chat_id: Optional[str] = None
+    logo_url: Optional[str] = None
+    r_keeper_enabled: bool = False
+    r_keeper_api_url: Optional[str] = None
+    r_keeper_user: Optional[str] = None
+    r_keeper_password: Optional[str] = None
+    r_keeper_station_code: Optional[str] = None
+    r_keeper_payment_type: Optional[str] = None
+
+
+def _snapshot(cls, obj):
+    return cls(**{f.name: getattr(obj, f.name) for f in fields(cls)})
+
+
+class ReferenceData:
+    """
+    Довідники, які змінюються лише з адмін-панелі: статуси замовлень, ролі та налаштування.
+    Завантажуються один раз і віддаються з пам'яті; адмін-панель скидає відповідний розділ після змін,
+    і наступне звернення перечитує його з БД.
+    """
+    def __init__(self):
+        self._statuses: Optional[Tuple[StatusInfo, ...]] = None
+        self._roles: Optional[Tuple[RoleInfo, ...]] = None
+        self._settings: Optional[SettingsInfo] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        """Завантажує всі довідники (викликається при старті застосунку)."""
+        async with self._lock:
+            async with async_session_maker() as session:
+                await self._load_statuses(session)
+                await self._load_roles(session)
+                await self._load_settings(session)
+        logger.info(f"Довідники завантажено: {len(self._statuses)} статусів, {len(self._roles)} ролей.")
+
+    async def _load_statuses(self, session):
+        statuses_res = await session.execute(select(OrderStatus).order_by(OrderStatus.id))
+        self._statuses = tuple(_snapshot(StatusInfo, s) for s in statuses_res.scalars().all())
+
+    async def _load_roles(self, session):
+        roles_res = await session.execute(select(Role).order_by(Role.id))
+        self._roles = tuple(_snapshot(RoleInfo, r) for r in roles_res.scalars().all())
+
+    async def _load_settings(self, session):
+        settings = await session.get(Settings, 1)
+        snapshot = _snapshot(SettingsInfo, settings) if settings else SettingsInfo()
+        # Як і get_settings у main.py: змінні оточення використовуються, лише якщо поле в БД порожнє
+        self._settings = replace(
+            snapshot,
+            client_bot_token=snapshot.client_bot_token or getenv("CLIENT_BOT_TOKEN", None),
+            admin_bot_token=snapshot.admin_bot_token or getenv("ADMIN_BOT_TOKEN", None),
+            admin_chat_id=snapshot.admin_chat_id or getenv("ADMIN_CHAT_ID", None),
+        )
+
+    async def _ensure(self, attr: str, loader):
+        value = getattr(self, attr)
+        if value is not None:
+            return value
+        async with self._lock:
+            value = getattr(self, attr)
+            if value is None:
+                generation = self._generation
+                async with async_session_maker() as session:
+                    await loader(session)
+                value = getattr(self, attr)
+                if generation != self._generation:
+                    # Довідник змінили під час завантаження — наступне звернення перечитає його
+                    setattr(self, attr, None)
+        return value
+
+    async def statuses(self) -> Tuple[StatusInfo, ...]:
+        return await self._ensure("_statuses", self._load_statuses)
+
+    async def status(self, status_id: int) -> Optional[StatusInfo]:
+        return next((s for s in await self.statuses() if s.id == status_id), None)
+
+    async def roles(self) -> Tuple[RoleInfo, ...]:
+        return await self._ensure("_roles", self._load_roles)
+
+    async def settings(self) -> SettingsInfo:
+        return await self._ensure("_settings", self._load_settings)
+
+    def invalidate_statuses(self):
+        self._generation += 1
+        self._statuses = None
+
+    def invalidate_roles(self):
+        self._generation += 1
+        self._roles = None
+
+    def invalidate_settings(self):
+        self._generation += 1
+        self._settings = None
+
+
+reference_data = ReferenceData()
+# Зміни з адмін-панелі в одному воркері скидають довідники і в інших (див. cache_sync.py)
+register_cache("statuses", reference_data.invalidate_statuses)
+register_cache("roles", reference_data.invalidate_roles)
+register_cache("settings", reference_data.invalidate_settings)
+
+
+async def load_reference_data():
+    await reference_data.load()
+
+
+async def get_statuses() -> Tuple[StatusInfo, ...]:
+    """Усі статуси замовлень, відсортовані за id."""
+    return await reference_data.statuses()
+
+
+async def get_status(status_id: int) -> Optional[StatusInfo]:
+    return await reference_data.status(status_id)
+
+
+async def get_status_by_name(name: str) -> Optional[StatusInfo]:
+    return next((s for s in await reference_data.statuses() if s.name == name), None)
+
+
+async def get_visible_statuses(audience: str) -> List[StatusInfo]:
+    """Статуси для кнопок: audience — 'operator', 'courier' або 'waiter'."""
+    flag = f"visible_to_{audience}"
+    return [s for s in await reference_data.statuses() if getattr(s, flag)]
+
+
+async def get_final_status_ids() -> List[int]:
+    """ID статусів, що завершують замовлення (виконано або скасовано)."""
+    return [s.id for s in await reference_data.statuses() if s.is_final]
+
+
+async def get_completed_status_ids() -> List[int]:
+    return [s.id for s in await reference_data.statuses() if s.is_completed_status]
+
+
+async def get_role_ids(permission: str) -> List[int]:
+    """ID ролей з дозволом: 'can_manage_orders', 'can_be_assigned' або 'can_serve_tables'."""
+    return [r.id for r in await reference_data.roles() if getattr(r, permission)]
+
+
+async def get_settings_snapshot() -> SettingsInfo:
+    return await reference_data.settings()
+
+
+def invalidate_statuses():
+    reference_data.invalidate_statuses()
+    publish_invalidation("statuses")
+
+
+def invalidate_roles():
+    reference_data.invalidate_roles()
+    publish_invalidation("roles")
+
+
+def invalidate_settings():
+    reference_data.invalidate_settings()
+    publish_invalidation("settings")
@@ -0,0 +1,150 @@
+# search_index.py
+
+import logging
+from typing import Optional
+
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from models import engine, ClientStat, Order, Product
+
+logger = logging.getLogger(__name__)
+
+# FTS5 trigram шукає підрядки, але запит має бути не коротшим за 3 символи
+MIN_FTS_QUERY_LENGTH = 3
+
+# Індекси з зовнішнім вмістом (content=...): тексти зберігаються лише в основних таблицях,
+# FTS-таблиця містить тільки триграми. Тригери оновлюють індекс у тій самій транзакції.
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+        customer_name, phone_number, content='orders', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS orders_fts_ai AFTER INSERT ON orders BEGIN
+        INSERT INTO orders_fts(rowid, customer_name, phone_number) VALUES (new.id, new.customer_name, new.phone_number);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS orders_fts_ad AFTER DELETE ON orders BEGIN
+        INSERT INTO orders_fts(orders_fts, rowid, customer_name, phone_number) VALUES ('delete', old.id, old.customer_name, old.phone_number);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS orders_fts_au AFTER UPDATE OF customer_name, phone_number ON orders BEGIN
+        INSERT INTO orders_fts(orders_fts, rowid, customer_name, phone_number) VALUES ('delete', old.id, old.customer_name, old.phone_number);
+        INSERT INTO orders_fts(rowid, customer_name, phone_number) VALUES (new.id, new.customer_name, new.phone_number);
+    END""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, content='products', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+]
+
+FTS_TABLES = ("orders_fts", "products_fts")
+
+# Чи доступний повнотекстовий індекс у поточній БД (визначається при старті)
+_fts_enabled = False
+
+
+def create_search_index(sync_conn) -> bool:
+    """
+    Створює FTS5-таблиці та тригери. Таблиці, створені вперше, заповнюються з наявних даних.
+    Повертає False, якщо БД не SQLite або SQLite зібрано без FTS5/trigram (потрібна версія 3.34+).
+    """
+    if sync_conn.dialect.name != "sqlite":
+        return False
+
+    existing = {row[0] for row in sync_conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    try:
+        for statement in FTS_DDL:
+            sync_conn.execute(text(statement))
+    except sa.exc.OperationalError as e:
+        logger.warning(f"Повнотекстовий пошук недоступний, використовується LIKE: {e}")
+        return False
+
+    for table in FTS_TABLES:
+        if table not in existing:
+            sync_conn.execute(text(f"INSERT INTO {table}({table}) VALUES ('rebuild')"))
+            logger.info(f"Побудовано пошуковий індекс {table}")
+    return True
+
+
+async def init_search_index():
+    global _fts_enabled
+    async with engine.begin() as conn:
+        _fts_enabled = await conn.run_sync(create_search_index)
+
+
+def _fts_phrase(q: str) -> str:
+    # Беремо весь запит як одну фразу в лапках, щоб символи на кшталт +, -, * не сприймались як оператори FTS5
+    return '"' + q.replace('"', '""') + '"'
+
+
+def _use_fts(q: str) -> bool:
+    return _fts_enabled and len(q) >= MIN_FTS_QUERY_LENGTH
+
+
+def _bounded_fts_ids(ids: sa.Select, after: Optional[int], before: Optional[int], limit: Optional[int]) -> sa.Select:
+    """
+    Переносить курсор сторінки та LIMIT всередину FTS-запиту: FTS5 перебирає збіги
+    в порядку rowid і зупиняється на першій сторінці, а не збирає всі збіги для сортування.
+    """
+    if limit is None:
+        return ids
+    rowid = sa.column("rowid")
+    if before is not None:
+        ids = ids.where(rowid > before).order_by(rowid.asc())
+    else:
+        if after is not None:
+            ids = ids.where(rowid < after)
+        ids = ids.order_by(rowid.desc())
+    return ids.limit(limit)
+
+
+def _order_text_clause(q: str, after: Optional[int] = None, before: Optional[int] = None, limit: Optional[int] = None):
+    if _use_fts(q):
+        ids = (
+            sa.select(sa.column("rowid")).select_from(sa.table("orders_fts"))
+            .where(text("orders_fts MATCH :orders_q").bindparams(orders_q=_fts_phrase(q)))
+        )
+        return Order.id.in_(_bounded_fts_ids(ids, after, before, limit))
+    return sa.or_(Order.customer_name.ilike(f"%{q}%"), Order.phone_number.ilike(f"%{q}%"))
+
+
+def order_search_clause(q: str, after: Optional[int] = None, before: Optional[int] = None, limit: Optional[int] = None):
+    """
+    Умова пошуку замовлень за іменем клієнта або телефоном (та за номером замовлення, якщо запит числовий).
+    Для сторінки списку передайте курсор і limit (див. keyset_paginate); без них умова підходить для COUNT.
+    """
+    q = q.strip()
+    clause = _order_text_clause(q, after, before, limit)
+    search_term = q.replace('#', '')
+    if search_term.isdigit():
+        clause = sa.or_(Order.id == int(search_term), clause)
+    return clause
+
+
+def product_search_clause(q: str):
+    """Умова пошуку страв за назвою."""
+    q = q.strip()
+    if _use_fts(q):
+        return Product.id.in_(
+            sa.select(sa.column("rowid")).select_from(sa.table("products_fts"))
+            .where(text("products_fts MATCH :products_q").bindparams(products_q=_fts_phrase(q)))
+        )
+    return Product.name.ilike(f"%{q}%")
+
+
+def client_search_clause(q: str):
+    """
+    Умова пошуку клієнтів (client_stats). Клієнт — це агрегат замовлень за номером телефону,
+    тому шукаємо по індексу замовлень і відбираємо відповідні телефони.
+    """
+    matching_phones = sa.select(Order.phone_number).where(_order_text_clause(q.strip()), Order.phone_number.isnot(None))
+    return ClientStat.phone_number.in_(matching_phones)
+
+
+def is_fts_enabled() -> bool:
+    return _fts_enabled
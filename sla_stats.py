@@ -0,0 +1,226 @@
+# sla_stats.py
+
+import logging
+import math
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from models import Order, OrderSla, OrderStatusHistory, SlaDay, async_session_maker
+from reference_data import StatusInfo, get_statuses
+
+logger = logging.getLogger(__name__)
+
+# День кешується, коли з його кінця минуло стільки годин (замовлення встигли завершитися)
+SLA_DAY_CLOSE_HOURS = int(os.getenv("SLA_DAY_CLOSE_HOURS", "6"))
+# Скільки замовлень обробляти одним груповим запитом до історії статусів
+SLA_BATCH_SIZE = int(os.getenv("SLA_BATCH_SIZE", "2000"))
+
+# Етапи: (поле OrderSla, назва у звіті)
+STAGES = (
+    ("to_processing", "Прийняття"),
+    ("to_ready", "Приготування"),
+    ("to_done", "Видача / доставка"),
+    ("total", "Всього"),
+)
+PERCENTILES = (50, 90, 95)
+GROUPINGS = ("courier", "waiter", "hour", "order_type")
+
+
+@dataclass(frozen=True)
+class StageStatuses:
+    """Які статуси означають початок кожного етапу (за прапорцями статусів, бо назви можна змінювати)."""
+    processing: Tuple[int, ...]
+    ready: Tuple[int, ...]
+    done: Tuple[int, ...]
+
+
+def stage_statuses(statuses: Sequence[StatusInfo]) -> StageStatuses:
+    """
+    Виконано — статуси з is_completed_status. Готово — незавершальні статуси, які бачать кур'єри
+    (замовлення можна забирати). В роботі — решта незавершальних статусів, крім початкового (найменший id).
+    """
+    active = [s for s in statuses if not s.is_final]
+    initial_id = min((s.id for s in statuses), default=None)
+    ready = tuple(s.id for s in active if s.visible_to_courier)
+    processing = tuple(s.id for s in active if s.id != initial_id and s.id not in ready)
+    done = tuple(s.id for s in statuses if s.is_completed_status)
+    return StageStatuses(processing=processing, ready=ready, done=done)
+
+
+def _seconds(start: Optional[datetime], end: Optional[datetime]) -> Optional[int]:
+    if start is None or end is None or end < start:
+        return None
+    return int((end - start).total_seconds())
+
+
+def _day_bounds(day: date) -> Tuple[datetime, datetime]:
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+async def _compute_day(session, day: date, stages: StageStatuses) -> List[Dict[str, Any]]:
+    """
+    Тривалості етапів для замовлень, створених за день. Час входу в кожен етап рахує сама БД —
+    MIN(timestamp) по відповідних статусах, один груповий запит на SLA_BATCH_SIZE замовлень.
+    """
+    def entered(status_ids: Tuple[int, ...]):
+        return sa.func.min(sa.case((OrderStatusHistory.status_id.in_(status_ids), OrderStatusHistory.timestamp), else_=None))
+
+    start, end = _day_bounds(day)
+    rows: List[Dict[str, Any]] = []
+    last_id = 0
+    while True:
+        batch_ids = (
+            sa.select(Order.id)
+            .where(Order.created_at >= start, Order.created_at < end, Order.id > last_id)
+            .order_by(Order.id)
+            .limit(SLA_BATCH_SIZE)
+            .scalar_subquery()
+        )
+        batch = (await session.execute(
+            sa.select(Order.id, Order.created_at, Order.order_type, Order.completed_by_courier_id, Order.accepted_by_waiter_id,
+                      entered(stages.processing).label("processing_at"), entered(stages.ready).label("ready_at"),
+                      entered(stages.done).label("done_at"))
+            .outerjoin(OrderStatusHistory, OrderStatusHistory.order_id == Order.id)
+            .where(Order.id.in_(batch_ids))
+            .group_by(Order.id, Order.created_at, Order.order_type, Order.completed_by_courier_id, Order.accepted_by_waiter_id)
+            .order_by(Order.id)
+        )).all()
+        if not batch:
+            return rows
+
+        for row in batch:
+            rows.append({
+                "order_id": row.id, "day": day, "hour": row.created_at.hour, "order_type": row.order_type,
+                "courier_id": row.completed_by_courier_id, "waiter_id": row.accepted_by_waiter_id,
+                "to_processing": _seconds(row.created_at, row.processing_at),
+                "to_ready": _seconds(row.processing_at, row.ready_at),
+                "to_done": _seconds(row.ready_at, row.done_at),
+                "total": _seconds(row.created_at, row.done_at),
+            })
+        last_id = batch[-1].id
+
+
+def _last_closed_day(now: datetime) -> date:
+    return (now - timedelta(hours=SLA_DAY_CLOSE_HOURS)).date() - timedelta(days=1)
+
+
+def _days(date_from: date, date_to: date) -> Iterable[date]:
+    day = date_from
+    while day <= date_to:
+        yield day
+        day += timedelta(days=1)
+
+
+@dataclass
+class _Durations:
+    hour: int
+    order_type: str
+    courier_id: Optional[int]
+    waiter_id: Optional[int]
+    to_processing: Optional[int]
+    to_ready: Optional[int]
+    to_done: Optional[int]
+    total: Optional[int]
+
+
+async def load_durations(date_from: date, date_to: date) -> List[Any]:
+    """
+    Тривалості етапів за період. Закриті дні рахуються один раз і беруться з order_sla,
+    останні (ще відкриті) дні рахуються наново при кожному запиті.
+    """
+    stages = stage_statuses(await get_statuses())
+    now = datetime.now()
+    last_closed = _last_closed_day(now)
+    date_to = min(date_to, now.date())
+    computed_days = computed_orders = 0
+    columns = [OrderSla.order_type, OrderSla.hour, OrderSla.courier_id, OrderSla.waiter_id] + [getattr(OrderSla, f) for f, _ in STAGES]
+
+    async with async_session_maker() as session:
+        if date_from <= last_closed:
+            closed_to = min(date_to, last_closed)
+            cached = set((await session.execute(
+                sa.select(SlaDay.day).where(SlaDay.day >= date_from, SlaDay.day <= closed_to)
+            )).scalars())
+            for day in _days(date_from, closed_to):
+                if day in cached:
+                    continue
+                rows = await _compute_day(session, day, stages)
+                await session.execute(sa.delete(OrderSla).where(OrderSla.day == day))
+                if rows:
+                    await session.execute(sa.insert(OrderSla), rows)
+                session.add(SlaDay(day=day, orders=len(rows)))
+                try:
+                    await session.commit()
+                except IntegrityError:
+                    # Той самий день щойно порахував паралельний запит
+                    await session.rollback()
+                    continue
+                computed_days += 1
+                computed_orders += len(rows)
+
+            if computed_days:
+                logger.info(f"SLA пораховано за {computed_days} дн. ({computed_orders} замовлень).")
+            durations = (await session.execute(
+                sa.select(*columns).where(OrderSla.day >= date_from, OrderSla.day <= closed_to)
+            )).all()
+        else:
+            durations = []
+
+        for day in _days(max(date_from, last_closed + timedelta(days=1)), date_to):
+            durations.extend(_Durations(**{k: v for k, v in row.items() if k not in ("order_id", "day")})
+                             for row in await _compute_day(session, day, stages))
+    return durations
+
+
+def percentile(sorted_values: Sequence[int], p: float) -> Optional[int]:
+    """Перцентиль методом найближчого рангу (значення, яке справді траплялося)."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+@dataclass
+class SlaGroup:
+    key: Any
+    orders: int
+    # {поле етапу: (кількість замірів, {перцентиль: секунди})}
+    stages: Dict[str, Tuple[int, Dict[int, Optional[int]]]]
+
+
+def group_durations(durations: Sequence[Any], group_by: str) -> List[SlaGroup]:
+    """Перцентилі тривалості кожного етапу в розрізі кур'єра, офіціанта, години створення чи типу замовлення."""
+    key_field = {"courier": "courier_id", "waiter": "waiter_id", "hour": "hour", "order_type": "order_type"}[group_by]
+    values: Dict[Any, Dict[str, List[int]]] = defaultdict(lambda: {f: [] for f, _ in STAGES})
+    counts: Dict[Any, int] = defaultdict(int)
+    for row in durations:
+        key = getattr(row, key_field)
+        counts[key] += 1
+        for stage, _ in STAGES:
+            seconds = getattr(row, stage)
+            if seconds is not None:
+                values[key][stage].append(seconds)
+
+    groups = []
+    for key, count in counts.items():
+        stages = {}
+        for stage, samples in values[key].items():
+            samples.sort()
+            stages[stage] = (len(samples), {p: percentile(samples, p) for p in PERCENTILES})
+        groups.append(SlaGroup(key=key, orders=count, stages=stages))
+    return groups
+
+
+async def invalidate_days(date_from: date, date_to: date):
+    """Скидає кеш за період (напр. після зміни налаштувань статусів) — наступний звіт порахує ці дні заново."""
+    async with async_session_maker() as session:
+        await session.execute(sa.delete(SlaDay).where(SlaDay.day >= date_from, SlaDay.day <= date_to))
+        await session.execute(sa.delete(OrderSla).where(OrderSla.day >= date_from, OrderSla.day <= date_to))
+        await session.commit()
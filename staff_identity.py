@@ -0,0 +1,115 @@
+# staff_identity.py
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from cache_sync import publish_invalidation, register_cache
+from models import Employee
+from reference_data import RoleInfo
+
+logger = logging.getLogger(__name__)
+
+# Скільки секунд довіряти збереженим даним співробітника та скільки записів тримати в пам'яті
+STAFF_CACHE_TTL = int(os.getenv("STAFF_CACHE_TTL", "300"))
+STAFF_CACHE_MAX_SIZE = int(os.getenv("STAFF_CACHE_MAX_SIZE", "1000"))
+
+
+@dataclass(frozen=True)
+class StaffIdentity:
+    """
+    Знімок співробітника, прив'язаного до Telegram-акаунта, лише для читання.
+    Для змін використовуйте модель Employee (session.get(Employee, staff.id)) і скидайте кеш після commit.
+    """
+    id: int
+    full_name: str
+    telegram_user_id: int
+    is_on_shift: bool
+    role: RoleInfo
+
+
+def _snapshot(employee: Employee) -> StaffIdentity:
+    role = employee.role
+    return StaffIdentity(
+        id=employee.id,
+        full_name=employee.full_name,
+        telegram_user_id=employee.telegram_user_id,
+        is_on_shift=employee.is_on_shift,
+        role=RoleInfo(id=role.id, name=role.name, can_manage_orders=role.can_manage_orders,
+                      can_be_assigned=role.can_be_assigned, can_serve_tables=role.can_serve_tables),
+    )
+
+
+class StaffIdentityCache:
+    """
+    Кеш "Telegram ID → співробітник і його роль" з TTL та витісненням найдавніше використаних записів.
+    Зберігається і відсутність співробітника, тож незареєстровані користувачі теж не створюють запитів.
+    """
+    def __init__(self, ttl: int = STAFF_CACHE_TTL, max_size: int = STAFF_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, Tuple[float, Optional[StaffIdentity]]]" = OrderedDict()
+
+    async def get(self, session: AsyncSession, telegram_user_id: int) -> Optional[StaffIdentity]:
+        now = time.monotonic()
+        cached = self._entries.get(telegram_user_id)
+        if cached and now - cached[0] < self.ttl:
+            self._entries.move_to_end(telegram_user_id)
+            return cached[1]
+
+        employee = await session.scalar(
+            select(Employee).where(Employee.telegram_user_id == telegram_user_id).options(joinedload(Employee.role))
+        )
+        staff = _snapshot(employee) if employee else None
+        self._entries[telegram_user_id] = (now, staff)
+        self._entries.move_to_end(telegram_user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return staff
+
+    def invalidate(self, telegram_user_id: Optional[int]):
+        """Скидає запис для Telegram-акаунта (вхід, вихід, зміна статусу зміни)."""
+        if telegram_user_id is not None:
+            self._entries.pop(telegram_user_id, None)
+            publish_invalidation("staff")
+
+    def invalidate_employee(self, employee_id: int):
+        """Скидає записи співробітника (редагування чи видалення в адмін-панелі)."""
+        for key in [k for k, (_, staff) in self._entries.items() if staff and staff.id == employee_id]:
+            del self._entries[key]
+        publish_invalidation("staff")
+
+    def clear(self):
+        self._entries.clear()
+        publish_invalidation("staff")
+
+    def clear_local(self):
+        """Скидає кеш лише в цьому процесі (коли співробітників змінили в іншому воркері)."""
+        self._entries.clear()
+
+
+staff_cache = StaffIdentityCache()
+# Інші процеси не знають, чий запис змінився, тому скидають кеш повністю
+register_cache("staff", staff_cache.clear_local)
+
+
+async def get_staff(session: AsyncSession, telegram_user_id: int) -> Optional[StaffIdentity]:
+    return await staff_cache.get(session, telegram_user_id)
+
+
+class StaffIdentityMiddleware:
+    """
+    Визначає співробітника для кожного оновлення адмін-бота і передає його в обробники як `staff`.
+    Реєструється після DbSessionMiddleware, бо використовує сесію з data.
+    """
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        user = data.get("event_from_user")
+        data["staff"] = await staff_cache.get(data["session"], user.id) if user else None
+        return await handler(event, data)
@@ -0,0 +1,110 @@
+# telegram_media.py
+
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+import sqlalchemy as sa
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+from sqlalchemy.exc import IntegrityError
+
+from models import TelegramFile, async_session_maker
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramFileIdCache:
+    """
+    Кеш file_id за парою (бот, шлях до зображення).
+    file_id прив'язаний до бота, який завантажив файл, тому ключ містить bot.id.
+    Значення тримаються в пам'яті та в таблиці telegram_file_ids, щоб пережити перезапуск.
+    """
+    def __init__(self):
+        self._file_ids: Dict[Tuple[int, str], str] = {}
+
+    async def get(self, bot_id: int, file_path: str) -> Optional[str]:
+        key = (bot_id, file_path)
+        if key in self._file_ids:
+            return self._file_ids[key]
+
+        async with async_session_maker() as session:
+            file_id = await session.scalar(
+                sa.select(TelegramFile.file_id).where(TelegramFile.bot_id == bot_id, TelegramFile.file_path == file_path)
+            )
+        if file_id:
+            self._file_ids[key] = file_id
+        return file_id
+
+    async def remember(self, bot_id: int, file_path: str, file_id: str):
+        self._file_ids[(bot_id, file_path)] = file_id
+        async with async_session_maker() as session:
+            record = await session.scalar(
+                sa.select(TelegramFile).where(TelegramFile.bot_id == bot_id, TelegramFile.file_path == file_path)
+            )
+            if record:
+                record.file_id = file_id
+            else:
+                session.add(TelegramFile(bot_id=bot_id, file_path=file_path, file_id=file_id))
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Той самий файл паралельно завантажив інший запит — його file_id теж дійсний
+                await session.rollback()
+
+    async def forget(self, file_path: str, bot_id: Optional[int] = None):
+        """Видаляє file_id зображення для одного або всіх ботів."""
+        for key in [k for k in self._file_ids if k[1] == file_path and (bot_id is None or k[0] == bot_id)]:
+            del self._file_ids[key]
+
+        stmt = sa.delete(TelegramFile).where(TelegramFile.file_path == file_path)
+        if bot_id is not None:
+            stmt = stmt.where(TelegramFile.bot_id == bot_id)
+        async with async_session_maker() as session:
+            await session.execute(stmt)
+            await session.commit()
+
+
+telegram_file_cache = TelegramFileIdCache()
+
+
+def _is_remote(file_path: str) -> bool:
+    return file_path.startswith(("http://", "https://"))
+
+
+async def send_photo_cached(bot: Bot, chat_id: int, file_path: Optional[str], **kwargs) -> Optional[Message]:
+    """
+    Надсилає фото, повторно використовуючи file_id з попередніх відправок.
+    Локальний файл завантажується в Telegram лише один раз для кожного бота.
+    Повертає None, якщо зображення немає (тоді викликач надсилає текст).
+    """
+    if not file_path:
+        return None
+
+    file_id = await telegram_file_cache.get(bot.id, file_path)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            logger.warning(f"Збережений file_id для {file_path} не прийнято Telegram, завантажуємо файл повторно: {e}")
+            await telegram_file_cache.forget(file_path, bot.id)
+
+    if _is_remote(file_path):
+        photo = file_path
+    elif os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+        photo = FSInputFile(file_path)
+    else:
+        return None
+
+    sent = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+    if sent.photo:
+        # Найбільший розмір іде останнім; його file_id підходить для повторної відправки
+        await telegram_file_cache.remember(bot.id, file_path, sent.photo[-1].file_id)
+    return sent
+
+
+async def forget_photo(file_path: Optional[str]):
+    """Скидає file_id зображення після його заміни або видалення."""
+    if file_path:
+        await telegram_file_cache.forget(file_path)
@@ -563,6 +563,8 @@ ADMIN_ORDER_FORM_BODY = """
 document.addEventListener('DOMContentLoaded', () => {
     // State
     let orderItems = {};
+    // Позиції старих замовлень, страв яких уже немає в меню: лише показуються, сервер зберігає їх як є
+    let legacyItems = [];
     let allProducts = [];
 
     // Element References
@@ -596,12 +598,24 @@ document.addEventListener('DOMContentLoaded', () => {
         for (const id in orderItems) {
             currentTotal += orderItems[id].price * orderItems[id].quantity;
         }
+        for (const item of legacyItems) {
+            currentTotal += item.price * item.quantity;
+        }
         grandTotalEl.textContent = currentTotal.toFixed(2);
     };
 
     const renderOrderItems = () => {
         orderItemsBody.innerHTML = '';
-        if (Object.keys(orderItems).length === 0) {
+        for (const item of legacyItems) {
+            const row = document.createElement('tr');
+            [`${item.name} (немає в меню)`, `${item.price.toFixed(2)} грн`, item.quantity, `${(item.price * item.quantity).toFixed(2)} грн`, ''].forEach(text => {
+                const cell = document.createElement('td');
+                cell.textContent = text;
+                row.appendChild(cell);
+            });
+            orderItemsBody.appendChild(row);
+        }
+        if (Object.keys(orderItems).length === 0 && legacyItems.length === 0) {
             orderItemsBody.innerHTML = '<tr><td colspan="5" style="text-align: center;">Додайте страви до замовлення</td></tr>';
         } else {
             for (const id in orderItems) {
@@ -682,6 +696,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         orderItems = data.items || {};
+        legacyItems = data.legacy_items || [];
         renderOrderItems();
     };
 
@@ -978,6 +993,7 @@ WEB_ORDER_HTML = """
         .product-image-wrapper {{ width: 100%; height: 220px; position: relative; overflow: hidden; }}
         .product-image-wrapper::after {{ content: ''; position: absolute; bottom: 0; left: 0; right: 0; height: 50%; background: linear-gradient(to top, rgba(0,0,0,0.8), transparent); }}
         .product-image {{ width: 100%; height: 100%; object-fit: cover; transition: transform 0.4s ease; }}
+        .product-image-wrapper picture {{ display: block; width: 100%; height: 100%; }}
         .product-card:hover .product-image {{ transform: scale(1.1); }}
         .product-info {{ padding: 25px; flex-grow: 1; display: flex; flex-direction: column; }}
         .product-name {{ font-family: 'Playfair Display', serif; font-size: 1.7em; font-weight: 700; margin: 0 0 10px; }}
@@ -1349,7 +1365,10 @@ WEB_ORDER_HTML = """
                         productCard.style.animationDelay = `${{pIndex * 0.05}}s`;
                         productCard.innerHTML = `
                             <div class="product-image-wrapper">
-                                <img src="/${{product.image_url || 'static/images/placeholder.jpg'}}" alt="${{product.name}}" class="product-image">
+                                <picture>
+                                    ${{product.image_srcset_webp ? `<source type="image/webp" srcset="${{product.image_srcset_webp}}" sizes="{image_sizes}">` : ''}}
+                                    <img src="/${{product.image_url || 'static/images/placeholder.jpg'}}" ${{product.image_srcset ? `srcset="${{product.image_srcset}}" sizes="{image_sizes}"` : ''}} alt="${{product.name}}" class="product-image" loading="lazy">
+                                </picture>
                             </div>
                             <div class="product-info">
                                 <h3 class="product-name">${{product.name}}</h3>
@@ -1676,12 +1695,19 @@ ADMIN_REPORTS_BODY = """
     </form>
 </div>
 <div class="card">
-    <h2>Результати звіту за період з {date_from_formatted} по {date_to_formatted}</h2>
+    <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 1.5rem;">
+        <h2>Результати звіту за період з {date_from_formatted} по {date_to_formatted}</h2>
+        <div>
+            <a href="/admin/export/couriers?format=xlsx&date_from={date_from}&date_to={date_to}" class="button">⬇️ XLSX</a>
+            <a href="/admin/export/couriers?format=csv&date_from={date_from}&date_to={date_to}" class="button">⬇️ CSV</a>
+        </div>
+    </div>
     <table>
         <thead>
             <tr>
                 <th>Ім'я кур'єра</th>
                 <th>Кількість виконаних замовлень</th>
+                <th>Сума виконаних замовлень</th>
             </tr>
         </thead>
         <tbody>
@@ -1713,6 +1739,7 @@ ADMIN_SETTINGS_BODY = """
         <label>Пароль:</label><input type="password" name="r_keeper_password" value="{r_keeper_password}">
         <label>Код станції:</label><input type="text" name="r_keeper_station_code" value="{r_keeper_station_code}">
         <label>Тип оплати:</label><input type="text" name="r_keeper_payment_type" value="{r_keeper_payment_type}">
+        <p><a href="/admin/r_keeper">Черга відправки замовлень в R-Keeper</a></p>
 
         <h3 style="margin-top: 2rem;">Налаштування Favicon</h3>
         <p>Завантажте необхідні файли favicon. Після завантаження оновіть сторінку (Ctrl+F5), щоб побачити зміни.</p>
@@ -1894,7 +1921,13 @@ ADMIN_ORDER_MANAGE_BODY = """
 
 ADMIN_CLIENTS_LIST_BODY = """
 <div class="card">
-    <h2><i class="fa-solid fa-users-line"></i> Список клієнтів</h2>
+    <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 1.5rem;">
+        <h2><i class="fa-solid fa-users-line"></i> Список клієнтів</h2>
+        <div>
+            <a href="/admin/export/clients?format=xlsx" class="button">⬇️ XLSX</a>
+            <a href="/admin/export/clients?format=csv" class="button">⬇️ CSV</a>
+        </div>
+    </div>
     <form action="/admin/clients" method="get" class="search-form">
         <input type="text" name="search" placeholder="Пошук за іменем або телефоном..." value="{search_query}">
         <button type="submit">🔍 Знайти</button>
@@ -2151,6 +2184,7 @@ IN_HOUSE_MENU_HTML_TEMPLATE = """
         }}
         .product-image-wrapper {{ width: 100%; height: 220px; position: relative; overflow: hidden; }}
         .product-image {{ width: 100%; height: 100%; object-fit: cover; transition: transform 0.4s ease; }}
+        .product-image-wrapper picture {{ display: block; width: 100%; height: 100%; }}
         .product-card:hover .product-image {{ transform: scale(1.1); }}
         .product-info {{ padding: 25px; flex-grow: 1; display: flex; flex-direction: column; }}
         .product-name {{ font-family: 'Playfair Display', serif; font-size: 1.7em; margin: 0 0 10px; }}
@@ -2377,7 +2411,10 @@ IN_HOUSE_MENU_HTML_TEMPLATE = """
                         productCard.style.animationDelay = `${{pIndex * 0.05}}s`;
                         productCard.innerHTML = `
                             <div class="product-image-wrapper">
-                                <img src="/${{product.image_url || 'static/images/placeholder.jpg'}}" alt="${{product.name}}" class="product-image">
+                                <picture>
+                                    ${{product.image_srcset_webp ? `<source type="image/webp" srcset="${{product.image_srcset_webp}}" sizes="{image_sizes}">` : ''}}
+                                    <img src="/${{product.image_url || 'static/images/placeholder.jpg'}}" ${{product.image_srcset ? `srcset="${{product.image_srcset}}" sizes="{image_sizes}"` : ''}} alt="${{product.name}}" class="product-image" loading="lazy">
+                                </picture>
                             </div>
                             <div class="product-info">
                                 <h3 class="product-name">${{product.name}}</h3>
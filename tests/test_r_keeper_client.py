@@ -0,0 +1,73 @@
+# tests/test_r_keeper_client.py
+#
+# Токен RKeeperClient проти заглушки R-Keeper (benchmarks/r_keeper_mock.py), без мережі: заглушка підключена через ASGI.
+# Використання: python -m unittest discover tests
+
+import asyncio
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import httpx
+
+import r_keeper
+from r_keeper import RKeeperAPI, RKeeperClient
+from r_keeper_mock import create_app
+
+API_URL = "http://r-keeper.test"
+ITEMS = [{"r_keeper_id": "1001", "quantity": 2, "price": 150}]
+
+
+def _settings():
+    return SimpleNamespace(r_keeper_api_url=API_URL, r_keeper_user="test", r_keeper_password="test",
+                           r_keeper_station_code="1", r_keeper_payment_type="cash", r_keeper_enabled=True)
+
+
+def _order(order_id: int):
+    return SimpleNamespace(id=order_id, customer_name="Тест", phone_number="+380000000000",
+                           address="вул. Тестова, 1", is_delivery=True, total_price=300, delivery_time="Якнайшвидше")
+
+
+class RKeeperTokenTest(unittest.IsolatedAsyncioTestCase):
+    async def _start(self, token_ttl: int = 3600):
+        self.mock = create_app(latency_ms=0, token_ttl=token_ttl)
+        self.client = RKeeperClient()
+        # Властивість http повертає вже створений клієнт, тож запити підуть у заглушку
+        self.client._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=self.mock), base_url=API_URL)
+        self.addAsyncCleanup(self.client.close)
+        self.api = RKeeperAPI(_settings(), client=self.client)
+
+    async def test_token_reused_across_orders(self):
+        await self._start()
+        for order_id in range(1, 11):
+            self.assertTrue(await self.api.send_order(_order(order_id), ITEMS))
+        self.assertEqual(self.mock.state.stats["logins"], 1)
+        self.assertEqual(self.mock.state.stats["orders"], 10)
+
+    async def test_relogin_after_unauthorized(self):
+        await self._start()
+        self.assertTrue(await self.api.send_order(_order(1), ITEMS))
+        # Сервер відкликає токени — наступний запит отримує 401, логіниться заново і повторюється
+        self.mock.state.tokens.clear()
+        self.assertTrue(await self.api.send_order(_order(2), ITEMS))
+        self.assertTrue(await self.api.send_order(_order(3), ITEMS))
+        stats = self.mock.state.stats
+        self.assertEqual((stats["logins"], stats["unauthorized"], stats["orders"]), (2, 1, 3))
+
+    async def test_token_refreshed_before_expiry(self):
+        # Клієнт тримає токен на TOKEN_REFRESH_MARGIN менше за expires_in, тобто тут 1 секунду
+        await self._start(token_ttl=r_keeper.TOKEN_REFRESH_MARGIN + 1)
+        self.assertTrue(await self.api.send_order(_order(1), ITEMS))
+        await asyncio.sleep(1.1)
+        self.assertTrue(await self.api.send_order(_order(2), ITEMS))
+        stats = self.mock.state.stats
+        self.assertEqual((stats["logins"], stats["unauthorized"]), (2, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()